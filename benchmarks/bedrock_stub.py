@@ -0,0 +1,76 @@
+"""
+Stand-in for a `bedrock-runtime` client that answers after a configurable
+latency, in the response formats of the supported models
+"""
+
+import io
+import json
+import time
+
+COMPLETION = (
+    "During the covered period of time, you attended several meetings and "
+    "worked on issues, pull requests and commits in a number of repositories. "
+) * 10
+
+
+class StubBedrockClient:
+    def __init__(
+        self,
+        latency: float = 1.0,
+        tokens_per_second: float = 100.0,
+        completion: str = COMPLETION,
+    ):
+        """
+        :param latency: Time (in seconds) until the first token is generated.
+        :param tokens_per_second: Speed at which the completion is generated,
+          counting one token per word.
+        """
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.completion = completion
+        self.invocations = 0
+
+    def response_body(self, model_id: str, prompt_tokens: int, text: str) -> dict:
+        output_tokens = len(text.split())
+        if model_id.startswith("anthropic."):
+            return {
+                "content": [{"type": "text", "text": text}],
+                "usage": {
+                    "input_tokens": prompt_tokens,
+                    "output_tokens": output_tokens,
+                },
+            }
+        if model_id.startswith("meta."):
+            return {
+                "generation": text,
+                "prompt_token_count": prompt_tokens,
+                "generation_token_count": output_tokens,
+            }
+        return {
+            "prompt": {"tokens": [None] * prompt_tokens},
+            "completions": [{"data": {"text": text, "tokens": [None] * output_tokens}}],
+        }
+
+    def invoke_model(self, modelId: str, body: str, **kwargs) -> dict:
+        self.invocations += 1
+        words = self.completion.split()
+        time.sleep(self.latency + len(words) / self.tokens_per_second)
+        response_body = self.response_body(modelId, len(body.split()), self.completion)
+        return {"body": io.BytesIO(json.dumps(response_body).encode())}
+
+    def invoke_model_with_response_stream(
+        self, modelId: str, body: str, **kwargs
+    ) -> dict:
+        self.invocations += 1
+        return {"body": self.stream_events(modelId)}
+
+    def stream_events(self, model_id: str):
+        time.sleep(self.latency)
+        for word in self.completion.split(" "):
+            time.sleep(1 / self.tokens_per_second)
+            text = word + " "
+            if model_id.startswith("anthropic."):
+                chunk = {"type": "content_block_delta", "delta": {"text": text}}
+            else:
+                chunk = {"generation": text}
+            yield {"chunk": {"bytes": json.dumps(chunk).encode()}}
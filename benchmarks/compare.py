@@ -0,0 +1,52 @@
+"""
+Compare two benchmark result files, e.g. before and after a change
+"""
+
+import argparse
+import json
+
+
+def key(result: dict) -> tuple:
+    return result["benchmark"], tuple(sorted(result["parameters"].items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("baseline", help="Results of the baseline run")
+    parser.add_argument("candidate", help="Results of the run to compare")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=1.1,
+        help="Ratio of candidate to baseline time above which a case is flagged as a regression",
+    )
+    args = parser.parse_args()
+
+    with open(args.baseline) as f:
+        baseline = {key(result): result for result in json.load(f)["results"]}
+    with open(args.candidate) as f:
+        candidate = json.load(f)["results"]
+
+    regressions = 0
+    for result in candidate:
+        before = baseline.get(key(result))
+        if before is None:
+            continue
+        time_ratio = result["median_seconds"] / before["median_seconds"]
+        memory_ratio = result["peak_memory_bytes"] / before["peak_memory_bytes"]
+        flag = ""
+        if time_ratio > args.threshold:
+            flag = "  <-- slower"
+            regressions += 1
+        parameters = ", ".join(f"{k}={v}" for k, v in result["parameters"].items())
+        print(
+            f"{result['benchmark']} ({parameters}): "
+            f"{before['median_seconds']:.3f}s -> {result['median_seconds']:.3f}s "
+            f"(x{time_ratio:.2f}), memory x{memory_ratio:.2f}{flag}"
+        )
+    if regressions:
+        raise SystemExit(f"{regressions} case(s) got slower")
+
+
+if __name__ == "__main__":
+    main()
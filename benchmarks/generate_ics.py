@@ -0,0 +1,187 @@
+"""
+Generate synthetic calendar exports that look like those of Google Calendar
+"""
+
+import argparse
+import datetime
+import random
+from typing import TextIO
+
+# Email address that the generated calendars are filtered for by default
+DEFAULT_EMAIL = "me@example.com"
+
+VTIMEZONE = """BEGIN:VTIMEZONE
+TZID:Europe/Paris
+X-LIC-LOCATION:Europe/Paris
+BEGIN:DAYLIGHT
+TZOFFSETFROM:+0100
+TZOFFSETTO:+0200
+TZNAME:CEST
+DTSTART:19700329T020000
+RRULE:FREQ=YEARLY;BYMONTH=3;BYDAY=-1SU
+END:DAYLIGHT
+BEGIN:STANDARD
+TZOFFSETFROM:+0200
+TZOFFSETTO:+0100
+TZNAME:CET
+DTSTART:19701025T030000
+RRULE:FREQ=YEARLY;BYMONTH=10;BYDAY=-1SU
+END:STANDARD
+END:VTIMEZONE"""
+
+WORDS = (
+    "roadmap review sync planning retro design migration incident budget hiring "
+    "onboarding demo release customer interview workshop architecture backlog "
+    "estimate deploy rollout metrics dashboard feedback proposal deadline"
+).split()
+
+PARTSTATS = ["ACCEPTED"] * 6 + ["TENTATIVE", "DECLINED", "NEEDS-ACTION"]
+
+
+def fold(line: str) -> str:
+    """
+    Fold a content line into lines of at most 75 characters (RFC 5545)
+    """
+    if len(line) <= 75:
+        return line
+    parts = [line[:75]] + [line[i : i + 74] for i in range(75, len(line), 74)]
+    return "\r\n ".join(parts)
+
+
+def format_utc(dt: datetime.datetime) -> str:
+    return dt.strftime("%Y%m%dT%H%M%SZ")
+
+
+def attendee_line(email: str, name: str, partstat: str) -> str:
+    return fold(
+        f"ATTENDEE;CUTYPE=INDIVIDUAL;ROLE=REQ-PARTICIPANT;PARTSTAT={partstat};"
+        f"CN={name};X-NUM-GUESTS=0:mailto:{email}"
+    )
+
+
+def generate_event(
+    rng: random.Random,
+    uid: int,
+    start: datetime.datetime,
+    days: int,
+    email: str,
+    people: list[str],
+    max_attendees: int,
+    max_description_length: int,
+    recurring: bool,
+    attend_ratio: float,
+) -> list[str]:
+    begin = start + datetime.timedelta(
+        days=rng.randrange(days), hours=rng.randrange(8, 18)
+    )
+    lines = ["BEGIN:VEVENT"]
+    if rng.random() < 0.02:
+        # All-day event
+        lines.append(f"DTSTART;VALUE=DATE:{begin:%Y%m%d}")
+        lines.append(f"DTEND;VALUE=DATE:{begin + datetime.timedelta(days=1):%Y%m%d}")
+    elif recurring:
+        # Recurring series are exported in the organizer's time zone
+        lines.append(f"DTSTART;TZID=Europe/Paris:{begin:%Y%m%dT%H%M%S}")
+        end = begin + datetime.timedelta(minutes=rng.choice([15, 30, 60]))
+        lines.append(f"DTEND;TZID=Europe/Paris:{end:%Y%m%dT%H%M%S}")
+        freq = rng.choice(["DAILY;BYDAY=MO,TU,WE,TH,FR", "WEEKLY", "MONTHLY"])
+        lines.append(f"RRULE:FREQ={freq};COUNT={rng.randrange(5, 100)}")
+    else:
+        lines.append(f"DTSTART:{format_utc(begin)}")
+        end = begin + datetime.timedelta(minutes=rng.choice([15, 30, 45, 60, 90]))
+        lines.append(f"DTEND:{format_utc(end)}")
+    lines.append(f"DTSTAMP:{format_utc(start)}")
+    lines.append(f"UID:{uid:08d}@example.com")
+
+    attendees = rng.sample(people, rng.randrange(1, max_attendees + 1))
+    if rng.random() < attend_ratio:
+        attendees.append(email)
+    for attendee in attendees:
+        name = attendee.split("@")[0].replace(".", " ").title()
+        lines.append(attendee_line(attendee, name, rng.choice(PARTSTATS)))
+
+    description_length = rng.randrange(max_description_length + 1)
+    description = []
+    while sum(len(word) + 1 for word in description) < description_length:
+        description.append(rng.choice(WORDS))
+    if description:
+        lines.append(fold("DESCRIPTION:" + " ".join(description)))
+    lines.append(f"SUMMARY:{' '.join(rng.sample(WORDS, 2)).capitalize()}")
+    lines.append("STATUS:CONFIRMED")
+    lines.append("END:VEVENT")
+    return lines
+
+
+def generate_calendar(
+    out: TextIO,
+    num_events: int,
+    start: datetime.datetime = datetime.datetime(2024, 1, 1),
+    days: int = 365,
+    email: str = DEFAULT_EMAIL,
+    num_people: int = 200,
+    max_attendees: int = 12,
+    max_description_length: int = 2000,
+    recurring_ratio: float = 0.05,
+    attend_ratio: float = 0.3,
+    seed: int = 0,
+):
+    """
+    Write a calendar export with `num_events` events spread over `days` days
+    from `start` to `out`. The events are written one by one, so that even
+    very large calendars don't need to fit into memory.
+
+    :param email: Email address of the calendar's owner, who attends about
+      `attend_ratio` of the events.
+    :param recurring_ratio: Share of the events that are recurring series.
+    """
+    rng = random.Random(seed)
+    people = [f"person.{i}@example.com" for i in range(num_people)]
+    out.write(
+        "BEGIN:VCALENDAR\r\nPRODID:-//Google Inc//Google Calendar 70.9054//EN\r\n"
+        "VERSION:2.0\r\nCALSCALE:GREGORIAN\r\nMETHOD:PUBLISH\r\n"
+    )
+    out.write(VTIMEZONE.replace("\n", "\r\n") + "\r\n")
+    for uid in range(num_events):
+        lines = generate_event(
+            rng,
+            uid,
+            start,
+            days,
+            email,
+            people,
+            max_attendees,
+            max_description_length,
+            rng.random() < recurring_ratio,
+            attend_ratio,
+        )
+        out.write("\r\n".join(lines) + "\r\n")
+    out.write("END:VCALENDAR\r\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("--events", type=int, default=1000, help="Number of events")
+    parser.add_argument("--output", type=str, required=True, help="Path of the file")
+    parser.add_argument("--email", type=str, default=DEFAULT_EMAIL)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--max-attendees", type=int, default=12)
+    parser.add_argument("--max-description-length", type=int, default=2000)
+    parser.add_argument("--recurring-ratio", type=float, default=0.05)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with open(args.output, "w", newline="") as f:
+        generate_calendar(
+            f,
+            args.events,
+            days=args.days,
+            email=args.email,
+            max_attendees=args.max_attendees,
+            max_description_length=args.max_description_length,
+            recurring_ratio=args.recurring_ratio,
+            seed=args.seed,
+        )
+
+
+if __name__ == "__main__":
+    main()
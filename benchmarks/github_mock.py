@@ -0,0 +1,406 @@
+"""
+Local stand-in for the GitHub search and GraphQL APIs, serving generated
+issues, pull requests and commits with the same pagination as GitHub
+
+Items of each kind are spread evenly over time, so that both APIs (and
+searches over any date range) find the same items.
+"""
+
+import argparse
+import datetime
+import hashlib
+import json
+import re
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# GitHub only returns the first 1000 results of a search
+MAX_SEARCH_RESULTS = 1000
+GRAPHQL_PAGE_SIZE = 100
+# Date of the first generated item
+EPOCH = datetime.datetime(2020, 1, 1)
+DATE_RANGE = re.compile(
+    r"(\d{4}-\d\d-\d\dT\d\d:\d\d:\d\dZ)\.\.(\d{4}-\d\d-\d\dT\d\d:\d\d:\d\dZ)"
+)
+UPDATED_SINCE = re.compile(r"updated:>=(\d{4}-\d\d-\d\dT\d\d:\d\d:\d\dZ)")
+
+
+def parse_date(value: str) -> datetime.datetime:
+    return datetime.datetime.strptime(value, "%Y-%m-%dT%H:%M:%SZ")
+
+
+def format_date(dt: datetime.datetime) -> str:
+    return dt.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def make_item(
+    kind: str, i: int, date: datetime.datetime, num_repos: int, text_length: int
+) -> dict:
+    repository = f"example/repo-{i % num_repos}"
+    text = ("Lorem ipsum dolor sit amet. " * (text_length // 28 + 1))[:text_length]
+    if kind == "commit":
+        sha = hashlib.sha1(f"{date.isoformat()}:{i}".encode()).hexdigest()
+        return {
+            "url": f"https://api.github.com/repos/{repository}/commits/{sha}",
+            "sha": sha,
+            "commit": {
+                "author": {"name": "Me", "date": format_date(date)},
+                "message": text,
+            },
+            "repository": {"full_name": repository},
+        }
+    number = i + 1
+    item = {
+        "url": f"https://api.github.com/repos/{repository}/issues/{number}",
+        "number": number,
+        "title": f"Item {number}",
+        "body": text,
+        "created_at": format_date(date),
+        "updated_at": format_date(date + datetime.timedelta(hours=i % 48)),
+        "closed_at": (
+            format_date(date + datetime.timedelta(days=1)) if i % 3 == 0 else None
+        ),
+        "repository_url": f"https://api.github.com/repos/{repository}",
+    }
+    if kind == "pull-request":
+        item["pull_request"] = {"url": item["url"].replace("issues", "pulls")}
+    return item
+
+
+class GitHubSearchHandler(BaseHTTPRequestHandler):
+    server: "GitHubSearchServer"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status: int, payload: dict, headers: dict):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def check_rate_limit(self, resource: str) -> dict | None:
+        """
+        Count a request against the rate limit of `resource`, answering it
+        with an error if the limit is exceeded
+
+        :return: Rate limit headers for the response, or None if the request
+          was answered.
+        """
+        allowed, headers = self.server.count_request(resource)
+        if not allowed:
+            self.send_json(
+                403,
+                {"message": "API rate limit exceeded for user ID 1."},
+                headers,
+            )
+            return None
+        return headers
+
+    def do_GET(self):
+        if (headers := self.check_rate_limit("search")) is None:
+            return
+        time.sleep(self.server.latency)
+        url = urllib.parse.urlsplit(self.path)
+        params = urllib.parse.parse_qs(url.query)
+        query = params.get("q", [""])[0]
+        per_page = int(params.get("per_page", ["30"])[0])
+        page = int(params.get("page", ["1"])[0])
+
+        if url.path.endswith("/commits"):
+            kind = "commit"
+        elif url.path.endswith("/issues"):
+            kind = "pull-request" if "is:pull-request" in query else "issue"
+        else:
+            self.send_json(404, {"message": "Not Found"}, {})
+            return
+
+        indices = self.server.search(query)
+        total = len(indices)
+        first = (page - 1) * per_page
+        if first >= MAX_SEARCH_RESULTS:
+            self.send_json(
+                422,
+                {"message": "Only the first 1000 search results are available"},
+                {},
+            )
+            return
+        available = min(total, MAX_SEARCH_RESULTS)
+        items = [
+            self.server.item(kind, i)
+            for i in indices[first : min(first + per_page, available)]
+        ]
+        payload = {"total_count": total, "incomplete_results": False, "items": items}
+
+        last_page = max((available + per_page - 1) // per_page, 1)
+        if last_page > 1:
+            base = f"http://{self.headers['Host']}{url.path}?" + re.sub(
+                r"&page=\d+", "", url.query
+            )
+            links = []
+            if page < last_page:
+                links.append(f'<{base}&page={page + 1}>; rel="next"')
+                links.append(f'<{base}&page={last_page}>; rel="last"')
+            if page > 1:
+                links.append(f'<{base}&page={page - 1}>; rel="prev"')
+                links.append(f'<{base}&page=1>; rel="first"')
+            headers["Link"] = ", ".join(links)
+
+        etag = '"' + hashlib.sha1(json.dumps(payload).encode()).hexdigest() + '"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            return
+        headers["ETag"] = etag
+        self.send_json(200, payload, headers)
+
+    def do_POST(self):
+        """
+        Answer GraphQL queries made of aliased `search`, `user` and
+        `repository` fields, taking their arguments from variables named
+        after the alias (e.g. `$f0_query`), as the GraphQL backend sends them
+        """
+        if (headers := self.check_rate_limit("graphql")) is None:
+            return
+        time.sleep(self.server.latency)
+        if not self.path.endswith("/graphql"):
+            self.send_json(404, {"message": "Not Found"}, {})
+            return
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        variables = body.get("variables") or {}
+        data = {}
+        for alias, field in re.findall(
+            r"(\w+): (search|user|repository)\(", body["query"]
+        ):
+            arguments = {
+                name.removeprefix(f"{alias}_"): value
+                for name, value in variables.items()
+                if name.startswith(f"{alias}_")
+            }
+            data[alias] = getattr(self.server, f"graphql_{field}")(**arguments)
+        self.send_json(200, {"data": data}, headers)
+
+
+class GitHubSearchServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address: tuple[str, int],
+        items_per_day: float = 40.0,
+        latency: float = 0.0,
+        num_repos: int = 10,
+        text_length: int = 500,
+        rate_limit: int | None = None,
+        rate_limit_window: int = 60,
+    ):
+        """
+        :param items_per_day: Number of items of each kind per day.
+        :param latency: Time (in seconds) to wait before answering a request.
+        :param rate_limit: Number of requests allowed per `rate_limit_window`
+          seconds, separately for searches and GraphQL queries, as GitHub
+          does. Unlimited if None.
+        """
+        super().__init__(address, GitHubSearchHandler)
+        self.interval = datetime.timedelta(days=1) / items_per_day
+        self.latency = latency
+        self.num_repos = num_repos
+        self.text_length = text_length
+        self.rate_limit = rate_limit
+        self.rate_limit_window = rate_limit_window
+        self.requests = 0
+        # Requests rejected because of the rate limit
+        self.rejected = 0
+        self._window_start = 0
+        self._used: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def indices(self, lower: datetime.datetime, upper: datetime.datetime) -> range:
+        """
+        Indices of the items dated between `lower` and `upper`
+        """
+        first = max(-((EPOCH - lower) // self.interval), 0)
+        last = (upper - EPOCH) // self.interval
+        return range(first, last + 1)
+
+    def search(self, query: str) -> range | list[int]:
+        if match := DATE_RANGE.search(query):
+            indices = self.indices(
+                parse_date(match.group(1)), parse_date(match.group(2))
+            )
+        else:
+            upper = datetime.datetime(2024, 12, 31)
+            indices = self.indices(upper - datetime.timedelta(days=365), upper)
+        if match := UPDATED_SINCE.search(query):
+            since = parse_date(match.group(1))
+            indices = [
+                i
+                for i in indices
+                if parse_date(self.item("issue", i)["updated_at"]) >= since
+            ]
+        return indices
+
+    def item(self, kind: str, i: int) -> dict:
+        return make_item(
+            kind, i, EPOCH + i * self.interval, self.num_repos, self.text_length
+        )
+
+    def graphql_search(self, query: str, after: str | None) -> dict:
+        kind = "pull-request" if "is:pull-request" in query else "issue"
+        indices = self.search(query)
+        first = int(after or 0)
+        last = min(first + GRAPHQL_PAGE_SIZE, len(indices), MAX_SEARCH_RESULTS)
+        nodes = []
+        for i in indices[first:last]:
+            item = self.item(kind, i)
+            nodes.append(
+                {
+                    "number": item["number"],
+                    "body": item["body"],
+                    "createdAt": item["created_at"],
+                    "updatedAt": item["updated_at"],
+                    "closedAt": item["closed_at"],
+                    "repository": {
+                        "nameWithOwner": "/".join(
+                            item["repository_url"].split("/")[-2:]
+                        )
+                    },
+                }
+            )
+        return {
+            "issueCount": len(indices),
+            "pageInfo": {
+                "hasNextPage": last < min(len(indices), MAX_SEARCH_RESULTS),
+                "endCursor": str(last),
+            },
+            "nodes": nodes,
+        }
+
+    def graphql_user(self, login: str, **dates: str) -> dict:
+        indices = self.indices(parse_date(dates["from"]), parse_date(dates["to"]))
+        repositories = sorted({i % self.num_repos for i in indices[: self.num_repos]})
+        return {
+            "id": f"U_{login}",
+            "contributionsCollection": {
+                "commitContributionsByRepository": [
+                    {"repository": {"name": f"repo-{r}", "owner": {"login": "example"}}}
+                    for r in repositories
+                ]
+            },
+        }
+
+    def graphql_repository(
+        self,
+        owner: str,
+        name: str,
+        author: str,
+        since: str,
+        until: str,
+        after: str | None,
+    ) -> dict:
+        repository = int(name.removeprefix("repo-"))
+        indices = [
+            i
+            for i in self.indices(parse_date(since), parse_date(until))
+            if i % self.num_repos == repository
+        ]
+        first = int(after or 0)
+        last = min(first + GRAPHQL_PAGE_SIZE, len(indices))
+        nodes = []
+        for i in indices[first:last]:
+            item = self.item("commit", i)
+            nodes.append(
+                {
+                    "oid": item["sha"],
+                    "message": item["commit"]["message"],
+                    "authoredDate": item["commit"]["author"]["date"],
+                    "committer": {"user": {"login": author.removeprefix("U_")}},
+                }
+            )
+        history = {
+            "pageInfo": {"hasNextPage": last < len(indices), "endCursor": str(last)},
+            "nodes": nodes,
+        }
+        return {"defaultBranchRef": {"target": {"history": history}}}
+
+    def count_request(self, resource: str) -> tuple[bool, dict]:
+        """
+        Count a request against the rate limit of `resource`
+
+        :return: Whether the request is allowed, and the rate limit headers
+          of its response.
+        """
+        with self._lock:
+            self.requests += 1
+            if self.rate_limit is None:
+                return True, {}
+            window = self.rate_limit_window
+            window_start = int(time.time()) // window * window
+            if window_start != self._window_start:
+                self._window_start = window_start
+                self._used = {}
+            used = self._used[resource] = self._used.get(resource, 0) + 1
+            allowed = used <= self.rate_limit
+            if not allowed:
+                self.rejected += 1
+            return allowed, {
+                "X-RateLimit-Limit": str(self.rate_limit),
+                "X-RateLimit-Remaining": str(max(self.rate_limit - used, 0)),
+                "X-RateLimit-Reset": str(window_start + window),
+                "X-RateLimit-Used": str(min(used, self.rate_limit)),
+                "X-RateLimit-Resource": resource,
+            }
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+def start_server(port: int = 0, **kwargs) -> GitHubSearchServer:
+    """
+    Start a server on `port` (by default any free port) in a background thread
+    """
+    server = GitHubSearchServer(("127.0.0.1", port), **kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument(
+        "--items-per-day", type=float, default=40.0, help="Items of each kind per day"
+    )
+    parser.add_argument("--latency", type=float, default=0.0, help="In seconds")
+    parser.add_argument(
+        "--rate-limit",
+        type=int,
+        help="Requests allowed per minute, for searches and GraphQL queries each",
+    )
+    args = parser.parse_args()
+
+    server = GitHubSearchServer(
+        ("127.0.0.1", args.port),
+        items_per_day=args.items_per_day,
+        latency=args.latency,
+        rate_limit=args.rate_limit,
+    )
+    print(
+        f"Set GITHUB_API_URL={server.url} and GITHUB_GRAPHQL_URL={server.url}/graphql"
+        " to use this server"
+    )
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
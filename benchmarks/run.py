@@ -0,0 +1,297 @@
+"""
+Measure the throughput and memory use of the calendar and GitHub pipelines
+against synthetic calendars, a local GitHub API stand-in and a stub Bedrock
+client
+"""
+
+import argparse
+import datetime
+import json
+import os
+import pathlib
+import platform
+import statistics
+import subprocess
+import time
+from typing import Callable
+
+from ics import Calendar
+
+from work_daigest.fetchers import github, github_graphql
+from work_daigest.fetchers.calendar_cache import CalendarCache, set_calendar_cache
+from work_daigest.fetchers.github import fetch_comments, set_activity_store
+from work_daigest.fetchers.google_calendar import filter_events
+from work_daigest.main import munge_calendar_data, process_data
+from work_daigest.profiling import profile
+from work_daigest.prompt import build_prompt
+
+from .bedrock_stub import StubBedrockClient
+from .generate_ics import DEFAULT_EMAIL, generate_calendar
+from .github_mock import start_server
+
+DEFAULT_SIZES = [1000, 10_000, 100_000]
+# Parsing a whole calendar with `ics` (which `filter_events` needs) takes
+# minutes and gigabytes beyond this size
+FILTER_EVENTS_MAX_EVENTS = 5000
+# Date range queried in all benchmarks, one week as by default in the CLI
+LOWER_DATE = datetime.datetime(2024, 3, 4)
+UPPER_DATE = datetime.datetime(2024, 3, 11)
+BENCHMARK_DAYS = (UPPER_DATE - LOWER_DATE).days
+YEAR_LOWER_DATE = UPPER_DATE - datetime.timedelta(days=365)
+
+
+def measure(name: str, fn: Callable, repeat: int, **parameters) -> dict:
+    """
+    Time `repeat` runs of `fn`, then run it once more while tracing memory
+    allocations, which slows it down, to record its peak memory use and the
+    profiling spans of its stages
+    """
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        seconds.append(time.perf_counter() - start)
+    with profile(name) as root:
+        fn()
+    median = statistics.median(seconds)
+    items = len(result) if isinstance(result, list) else None
+    print(f"{name} {parameters}: {median:.3f}s, {items} items", flush=True)
+    return {
+        "benchmark": name,
+        "parameters": parameters,
+        "seconds": seconds,
+        "median_seconds": median,
+        "items": items,
+        "items_per_second": items / median if items and median else None,
+        "peak_memory_bytes": root.attributes["peak_memory_bytes"],
+        "spans": root.to_dict(),
+    }
+
+
+def calendar_file(data_dir: pathlib.Path, num_events: int) -> pathlib.Path:
+    """
+    Return the path of a synthetic calendar with `num_events` events,
+    generating it unless it was generated before
+    """
+    path = data_dir / f"calendar-{num_events}.ics"
+    if not path.exists():
+        print(f"Generating {path}", flush=True)
+        with open(path, "w", newline="") as f:
+            generate_calendar(f, num_events)
+    return path
+
+
+def run_calendar_benchmarks(path: pathlib.Path, num_events: int, repeat: int):
+    parameters = {"events": num_events, "bytes": path.stat().st_size}
+
+    set_calendar_cache(None)
+    yield measure(
+        "munge_calendar_data",
+        lambda: munge_calendar_data(path, LOWER_DATE, UPPER_DATE, DEFAULT_EMAIL),
+        repeat,
+        **parameters,
+    )
+
+    # Events parsed before and kept in memory
+    set_calendar_cache(CalendarCache(None))
+    munge_calendar_data(path, LOWER_DATE, UPPER_DATE, DEFAULT_EMAIL)
+    yield measure(
+        "munge_calendar_data_cached",
+        lambda: munge_calendar_data(path, LOWER_DATE, UPPER_DATE, DEFAULT_EMAIL),
+        repeat,
+        **parameters,
+    )
+    set_calendar_cache(None)
+
+    if num_events <= FILTER_EVENTS_MAX_EVENTS:
+        with open(path) as f:
+            calendar = Calendar(f.read())
+        lower, upper = (
+            dt.replace(tzinfo=datetime.timezone.utc) for dt in (LOWER_DATE, UPPER_DATE)
+        )
+        yield measure(
+            "filter_events",
+            lambda: filter_events(calendar, lower, upper, DEFAULT_EMAIL),
+            repeat,
+            **parameters,
+        )
+
+
+def start_github_server(github_items: int, github_latency: float):
+    """
+    Start a GitHub API stand-in with `github_items` items of each kind in the
+    benchmarked date range, and point both GitHub backends to it
+    """
+    server = start_server(
+        items_per_day=github_items / BENCHMARK_DAYS, latency=github_latency
+    )
+    github.BASE_URL = f"{server.url}/search"
+    github_graphql.GRAPHQL_URL = f"{server.url}/graphql"
+    return server
+
+
+def run_github_benchmarks(github_items: int, github_latency: float, repeat: int):
+    server = start_github_server(github_items, github_latency)
+    try:
+        for backend in github.GITHUB_BACKENDS:
+            github.set_github_backend(backend)
+            suffix = "" if backend == "rest" else f"_{backend}"
+            yield measure(
+                f"fetch_comments{suffix}",
+                lambda: fetch_comments("someone", LOWER_DATE, UPPER_DATE),
+                repeat,
+                items_per_search=github_items,
+                latency=github_latency,
+            )
+            # Searches over a year find more items than GitHub returns per
+            # search, so they are split into shards
+            yield measure(
+                f"fetch_comments_year{suffix}",
+                lambda: fetch_comments("someone", YEAR_LOWER_DATE, UPPER_DATE),
+                repeat,
+                items_per_search=github_items,
+                latency=github_latency,
+            )
+    finally:
+        github.set_github_backend("rest")
+        server.shutdown()
+
+
+def run_end_to_end_benchmark(
+    path: pathlib.Path,
+    num_events: int,
+    github_items: int,
+    github_latency: float,
+    model_latency: float,
+    repeat: int,
+):
+    server = start_github_server(github_items, github_latency)
+    client = StubBedrockClient(latency=model_latency)
+
+    def summarize():
+        model_fn, calendar_data, github_data = process_data(
+            path,
+            "someone",
+            DEFAULT_EMAIL,
+            LOWER_DATE,
+            UPPER_DATE,
+            "claude3",
+            use_cache=False,
+            runtime_client=client,
+        )
+        prompt, _ = build_prompt(
+            calendar_data,
+            github_data,
+            LOWER_DATE,
+            UPPER_DATE,
+            "claude3",
+            DEFAULT_EMAIL,
+        )
+        return model_fn(prompt=prompt)
+
+    try:
+        yield measure(
+            "process_data",
+            summarize,
+            repeat,
+            events=num_events,
+            items_per_search=github_items,
+            github_latency=github_latency,
+            model_latency=model_latency,
+        )
+    finally:
+        server.shutdown()
+
+
+def metadata(args: argparse.Namespace) -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "arguments": vars(args),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=DEFAULT_SIZES,
+        help="Numbers of calendar events to benchmark with",
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per case")
+    parser.add_argument(
+        "--github-items", type=int, default=300, help="Items per GitHub search"
+    )
+    parser.add_argument(
+        "--github-latency",
+        type=float,
+        default=0.05,
+        help="Latency of the GitHub API stand-in, in seconds",
+    )
+    parser.add_argument(
+        "--model-latency",
+        type=float,
+        default=0.5,
+        help="Latency of the stub Bedrock client, in seconds",
+    )
+    parser.add_argument(
+        "--data-dir",
+        type=pathlib.Path,
+        default=pathlib.Path("benchmarks/data"),
+        help="Directory to keep the generated calendars in",
+    )
+    parser.add_argument(
+        "--output",
+        type=pathlib.Path,
+        help="Path to write the results to. Defaults to benchmarks/results/<timestamp>.json.",
+    )
+    args = parser.parse_args()
+
+    # Measure the pipelines themselves, not the caches in front of them
+    github.set_http_cache(None)
+    set_activity_store(None)
+
+    args.data_dir.mkdir(parents=True, exist_ok=True)
+    results = []
+    for num_events in args.sizes:
+        path = calendar_file(args.data_dir, num_events)
+        results.extend(run_calendar_benchmarks(path, num_events, args.repeat))
+    results.extend(
+        run_github_benchmarks(args.github_items, args.github_latency, args.repeat)
+    )
+    smallest = min(args.sizes)
+    results.extend(
+        run_end_to_end_benchmark(
+            calendar_file(args.data_dir, smallest),
+            smallest,
+            args.github_items,
+            args.github_latency,
+            args.model_latency,
+            args.repeat,
+        )
+    )
+
+    output = args.output or pathlib.Path(
+        f"benchmarks/results/{datetime.datetime.now():%Y%m%d-%H%M%S}.json"
+    )
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(
+            {"metadata": metadata(args), "results": results}, f, indent=2, default=str
+        )
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Check that `work-daigest --help` and fetching GitHub data start up within a
+time budget and without importing heavy dependencies they don't need
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from .github_mock import start_server
+
+# Budgets (in seconds) for the whole process, taking the fastest of several
+# runs. They are generous enough for slow CI machines, since importing any of
+# the modules below takes longer than that.
+HELP_BUDGET = 0.6
+FETCH_BUDGET = 1.2
+HEAVY_MODULES = ["streamlit", "boto3", "ics"]
+# `requests` is needed for fetching, but not for printing the help
+HELP_FORBIDDEN_MODULES = HEAVY_MODULES + ["requests"]
+
+FETCH_SCRIPT = """
+import datetime, json, sys
+from work_daigest import main
+main.fetch_comments("someone", datetime.datetime(2024, 3, 4), datetime.datetime(2024, 3, 11))
+print(json.dumps(sorted(sys.modules)))
+"""
+
+HELP_SCRIPT = """
+import json, sys
+from work_daigest import main
+sys.argv = ["work-daigest", "--help"]
+try:
+    main.main()
+except SystemExit:
+    pass
+print(json.dumps(sorted(sys.modules)), file=sys.stderr)
+"""
+
+
+def run(script: str, env: dict, repeat: int) -> tuple[float, list[str]]:
+    """
+    Run `script` in a fresh interpreter and with empty caches, as on a first
+    run, `repeat` times
+
+    :return: Fastest wall time and the modules imported by the last run, which
+      the script prints as JSON on its last line of output.
+    """
+    times = []
+    for _ in range(repeat):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            start = time.perf_counter()
+            process = subprocess.run(
+                [sys.executable, "-c", script],
+                env=dict(env, WORK_DAIGEST_CACHE_DIR=cache_dir),
+                capture_output=True,
+                text=True,
+                check=True,
+            )
+            times.append(time.perf_counter() - start)
+    output = process.stdout + process.stderr
+    modules = json.loads(output.strip().splitlines()[-1])
+    return min(times), modules
+
+
+def check(
+    name: str, seconds: float, budget: float, modules: list[str], forbidden: list[str]
+) -> bool:
+    loaded = [
+        module
+        for module in forbidden
+        if any(m == module or m.startswith(module + ".") for m in modules)
+    ]
+    ok = seconds <= budget and not loaded
+    print(
+        f"{'OK' if ok else 'FAIL'} {name}: {seconds:.3f}s (budget {budget:.3f}s)"
+        + (f", imported {', '.join(loaded)}" if loaded else "")
+    )
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--help-budget", type=float, default=HELP_BUDGET)
+    parser.add_argument("--fetch-budget", type=float, default=FETCH_BUDGET)
+    args = parser.parse_args()
+
+    server = start_server(items_per_day=5)
+    env = dict(os.environ, GITHUB_API_URL=server.url)
+    help_time, help_modules = run(HELP_SCRIPT, env, args.repeat)
+    fetch_time, fetch_modules = run(FETCH_SCRIPT, env, args.repeat)
+    server.shutdown()
+
+    results = [
+        check(
+            "--help",
+            help_time,
+            args.help_budget,
+            help_modules,
+            HELP_FORBIDDEN_MODULES,
+        ),
+        check(
+            "first fetch",
+            fetch_time,
+            args.fetch_budget,
+            fetch_modules,
+            HEAVY_MODULES,
+        ),
+    ]
+    if not all(results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
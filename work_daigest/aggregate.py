@@ -0,0 +1,124 @@
+import collections
+import datetime
+
+from .fetchers.github import GitHubComment
+from .fetchers.google_calendar import CalendarEvent
+
+# Number of days listed as the busiest ones
+BUSIEST_DAYS = 3
+# Number of GitHub items per repository and kind that are included in the
+# prompt next to the facts, most recent first
+REPRESENTATIVE_ITEMS = 5
+
+
+def event_duration(e: CalendarEvent) -> datetime.timedelta:
+    return e.duration if e.duration is not None else e.end - e.begin
+
+
+def is_meeting(e: CalendarEvent) -> bool:
+    # All-day events are holidays, offsites and the like rather than meetings
+    return event_duration(e) < datetime.timedelta(days=1)
+
+
+def count_activity(
+    github_data: list[GitHubComment],
+) -> dict[tuple[str, str, str], int]:
+    """
+    Count GitHub items by repository, kind (issue, pull request or commit)
+    and action
+    """
+    counts = collections.Counter(
+        (comment.repository, comment.kind or "unknown", comment.action)
+        for comment in github_data
+    )
+    return dict(sorted(counts.items()))
+
+
+def attendee_group(e: CalendarEvent, email: str | None) -> str:
+    names = sorted(
+        att.common_name or att.email for att in e.attendees if att.email != email
+    )
+    return ", ".join(names) if names else "no other attendees"
+
+
+def meeting_hours(
+    calendar_data: list[CalendarEvent], email: str | None = None
+) -> dict[str, tuple[int, float]]:
+    """
+    Count meetings and sum up their hours by group of attendees
+
+    :param email: Email address of the person the data is about, who is left
+      out of the groups.
+    :return: Number of meetings and hours by group, the largest number of
+      hours first.
+    """
+    counts = collections.Counter()
+    hours = collections.Counter()
+    for e in filter(is_meeting, calendar_data):
+        group = attendee_group(e, email)
+        counts[group] += 1
+        hours[group] += event_duration(e).total_seconds() / 3600
+    return {group: (counts[group], hours[group]) for group, _ in hours.most_common()}
+
+
+def busiest_days(
+    calendar_data: list[CalendarEvent],
+    github_data: list[GitHubComment],
+    n: int = BUSIEST_DAYS,
+) -> list[tuple[datetime.date, int, float, int]]:
+    """
+    Find the days with the most meetings and GitHub items combined
+
+    :return: Date, number of meetings, meeting hours and number of GitHub
+      items of each of the `n` busiest days.
+    """
+    meetings = collections.Counter()
+    hours = collections.Counter()
+    items = collections.Counter(comment.date.date() for comment in github_data)
+    for e in filter(is_meeting, calendar_data):
+        meetings[e.begin.date()] += 1
+        hours[e.begin.date()] += event_duration(e).total_seconds() / 3600
+    days = sorted(
+        set(meetings) | set(items),
+        key=lambda day: (meetings[day] + items[day], hours[day]),
+        reverse=True,
+    )
+    return [(day, meetings[day], hours[day], items[day]) for day in days[:n]]
+
+
+def render_facts(
+    calendar_data: list[CalendarEvent],
+    github_data: list[GitHubComment],
+    email: str | None = None,
+) -> str:
+    """
+    Compute counts and totals over all calendar and GitHub data and render
+    them as compact tables, so that the model doesn't have to work them out
+    from the individual events and items
+    """
+    lines = ["GitHub items (repository | kind | action | count):"]
+    for (repository, kind, action), count in count_activity(github_data).items():
+        lines.append(f"{repository} | {kind} | {action} | {count}")
+    lines.append("Meetings (attendees | meetings | hours):")
+    for group, (count, hours) in meeting_hours(calendar_data, email).items():
+        lines.append(f"{group} | {count} | {hours:.1f}")
+    lines.append("Busiest days (date | meetings | meeting hours | GitHub items):")
+    for day, meetings, hours, items in busiest_days(calendar_data, github_data):
+        lines.append(f"{day.isoformat()} | {meetings} | {hours:.1f} | {items}")
+    return "\n".join(lines)
+
+
+def representative_items(
+    github_data: list[GitHubComment], n: int = REPRESENTATIVE_ITEMS
+) -> list[GitHubComment]:
+    """
+    Keep the `n` most recent GitHub items of every repository and kind. The
+    counts in the facts cover the items that are left out.
+    """
+    groups = collections.defaultdict(list)
+    for comment in github_data:
+        groups[(comment.repository, comment.kind)].append(comment)
+    kept = []
+    for comments in groups.values():
+        kept.extend(sorted(comments, key=lambda c: c.date, reverse=True)[:n])
+    return sorted(kept, key=lambda c: c.date)
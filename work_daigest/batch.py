@@ -0,0 +1,232 @@
+import argparse
+import csv
+import datetime
+import json
+import logging
+import pathlib
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import TextIO
+
+from .bedrock import get_runtime_client
+from .fetchers.github import (
+    DEFAULT_GITHUB_BACKEND,
+    DEFAULT_MAX_WORKERS,
+    GITHUB_BACKENDS,
+    set_github_backend,
+)
+from .fetchers.ratelimit import format_rate_limit_waits
+from .hedging import HedgeConfig, hedge_stats
+from .main import (
+    add_hedge_arguments,
+    check_hedge_arguments,
+    convert_to_datetime,
+    hedge_config,
+    process_data,
+)
+from .prompt import build_prompt
+
+logger = logging.getLogger(__name__)
+
+# Default number of users whose data is fetched at the same time
+DEFAULT_GITHUB_WORKERS = 2
+# Default number of concurrent model invocations
+DEFAULT_MODEL_WORKERS = 2
+
+
+def read_roster(roster_file: TextIO) -> list[dict[str, str]]:
+    """
+    Read a CSV roster with the columns `github_handle`, `email` and
+    `calendar_data` (path to the user's calendar .ics file).
+    """
+    roster = list(csv.DictReader(roster_file))
+    for i, user in enumerate(roster, start=2):
+        missing = [
+            column
+            for column in ("github_handle", "email", "calendar_data")
+            if not user.get(column)
+        ]
+        if missing:
+            raise ValueError(f"Roster line {i} is missing {', '.join(missing)}")
+    return roster
+
+
+def run_batch(
+    roster: list[dict[str, str]],
+    output: TextIO,
+    lower_date: datetime.datetime,
+    upper_date: datetime.datetime,
+    model_choice: str,
+    github_workers: int = DEFAULT_GITHUB_WORKERS,
+    model_workers: int = DEFAULT_MODEL_WORKERS,
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    hedge: HedgeConfig | None = None,
+) -> int:
+    """
+    Generate summaries for all users of a roster and write them to `output`
+    as JSON lines, in the order in which they finish.
+
+    Users are processed concurrently, with at most `github_workers` users'
+    data being fetched and at most `model_workers` model invocations running
+    at the same time. All users share one Bedrock client as well as the
+    GitHub, calendar and response caches. If processing a user fails, the
+    error is written to `output` instead of the summary and the remaining
+    users are processed anyway.
+
+    :param hedge: Whether and how to send backup requests for slow model
+      invocations.
+    :return: Number of users for which no summary could be generated.
+    """
+    runtime_client = get_runtime_client()
+    fetch_slots = threading.Semaphore(github_workers)
+    model_slots = threading.Semaphore(model_workers)
+    output_lock = threading.Lock()
+
+    def process_user(user: dict[str, str]) -> bool:
+        result = {
+            "github_handle": user["github_handle"],
+            "email": user["email"],
+            "lower_date": lower_date.isoformat(),
+            "upper_date": upper_date.isoformat(),
+            "model": model_choice,
+        }
+        try:
+            with fetch_slots:
+                model_fn, calendar_data, github_data = process_data(
+                    pathlib.Path(user["calendar_data"]),
+                    user["github_handle"],
+                    user["email"],
+                    lower_date,
+                    upper_date,
+                    model_choice,
+                    max_workers,
+                    runtime_client=runtime_client,
+                    hedge=hedge,
+                )
+            prompt, _ = build_prompt(
+                calendar_data,
+                github_data,
+                lower_date,
+                upper_date,
+                model_choice,
+                user["email"],
+            )
+            with model_slots:
+                result["summary"] = model_fn(prompt=prompt)
+        except Exception as e:
+            logger.exception(f"Couldn't generate summary for {user['github_handle']}")
+            result["error"] = f"{type(e).__name__}: {e}"
+        with output_lock:
+            output.write(json.dumps(result) + "\n")
+            output.flush()
+        return "error" not in result
+
+    # Enough threads to keep both the fetch and the model slots busy
+    with ThreadPoolExecutor(max_workers=github_workers + model_workers) as executor:
+        succeeded = list(executor.map(process_user, roster))
+    return succeeded.count(False)
+
+
+def main():
+    """
+    Generate summaries for a whole team.
+    """
+    parser = argparse.ArgumentParser(
+        description="Generate summaries of the work of several people"
+    )
+    parser.add_argument(
+        "--roster",
+        type=pathlib.Path,
+        help="Path to a CSV file with the columns github_handle, email and calendar_data (path to the calendar .ics file)",
+        required=True,
+    )
+    parser.add_argument(
+        "--output",
+        type=pathlib.Path,
+        help="Path to the JSON lines file to write the summaries to. Defaults to standard output.",
+    )
+    parser.add_argument(
+        "--lower-date",
+        type=convert_to_datetime,
+        help="Lower date limit to consider data for, in the format YYYY-MM-DD. Defaults to today - 7 days.",
+        default=(datetime.datetime.today() - datetime.timedelta(days=7)).strftime(
+            "%Y-%m-%d"
+        ),
+    )
+    parser.add_argument(
+        "--upper-date",
+        type=convert_to_datetime,
+        help="Upper date limit to consider data for, in the format YYYY-MM-DD. Defaults to today.",
+        default=datetime.datetime.now().strftime("%Y-%m-%d"),
+    )
+    parser.add_argument(
+        "--model",
+        type=str,
+        choices=["jurassic2", "llama2", "claude3"],
+        default="claude3",
+        help="Model to use for summary generation",
+    )
+    parser.add_argument(
+        "--github-workers",
+        type=int,
+        default=DEFAULT_GITHUB_WORKERS,
+        help=f"Maximum number of users whose data is fetched at the same time. Defaults to {DEFAULT_GITHUB_WORKERS}.",
+    )
+    parser.add_argument(
+        "--model-workers",
+        type=int,
+        default=DEFAULT_MODEL_WORKERS,
+        help=f"Maximum number of concurrent model invocations. Defaults to {DEFAULT_MODEL_WORKERS}.",
+    )
+    parser.add_argument(
+        "--max-workers",
+        type=int,
+        default=DEFAULT_MAX_WORKERS,
+        help=f"Maximum number of concurrent GitHub API requests per user. Defaults to {DEFAULT_MAX_WORKERS}.",
+    )
+    parser.add_argument(
+        "--github-backend",
+        type=str,
+        choices=GITHUB_BACKENDS,
+        default=DEFAULT_GITHUB_BACKEND,
+        help="API to fetch GitHub data through. GraphQL needs fewer requests, but requires a token. Defaults to the GITHUB_BACKEND environment variable, or rest.",
+    )
+    add_hedge_arguments(parser)
+    args = parser.parse_args()
+    check_hedge_arguments(parser, args)
+    logging.basicConfig()
+    set_github_backend(args.github_backend)
+
+    with open(args.roster, "r") as f:
+        roster = read_roster(f)
+
+    output = open(args.output, "w") if args.output else sys.stdout
+    try:
+        failures = run_batch(
+            roster,
+            output,
+            args.lower_date,
+            args.upper_date,
+            args.model,
+            args.github_workers,
+            args.model_workers,
+            args.max_workers,
+            hedge_config(args),
+        )
+    finally:
+        if args.output:
+            output.close()
+
+    if args.hedge_delay is not None:
+        print(hedge_stats.format_summary(), file=sys.stderr)
+    if waits := format_rate_limit_waits():
+        print(waits, file=sys.stderr)
+
+    if failures:
+        print(f"{failures} of {len(roster)} summaries failed", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,70 @@
+import hashlib
 import json
 import logging
+import os
+import random
+import threading
+import time
+from typing import Iterator, Protocol
 
-import boto3
 from botocore.exceptions import ClientError
 
+from .cache import DiskCache, default_cache_dir
+from .profiling import annotate, traced
+
 logger = logging.getLogger(__name__)
 
 
+class ResponseCache(Protocol):
+    """
+    Anything that can store model completions by key, such as a `DiskCache`
+    """
+
+    def get(self, key: str) -> str | None: ...
+
+    def set(self, key: str, value: str) -> None: ...
+
+
+RESPONSE_CACHE_TTL = 7 * 24 * 60 * 60
+RESPONSE_CACHE_MAX_BYTES = 50 * 1024 * 1024
+
+response_cache: ResponseCache | None = DiskCache(
+    default_cache_dir() / "responses",
+    ttl=RESPONSE_CACHE_TTL,
+    max_bytes=RESPONSE_CACHE_MAX_BYTES,
+)
+
+
+def set_response_cache(cache: ResponseCache | None) -> None:
+    """
+    Replace the cache of model completions. Pass `None` to disable caching.
+    """
+    global response_cache
+    response_cache = cache
+
+
+def response_cache_key(model_id: str, body: dict) -> str:
+    """
+    Cache key for a model invocation. The request body contains both the
+    prompt and all inference parameters (temperature, top_p, max tokens).
+    """
+    request = json.dumps({"model_id": model_id, "body": body}, sort_keys=True)
+    return hashlib.sha256(request.encode()).hexdigest()
+
+
+def get_cached_completion(model_id: str, body: dict, use_cache: bool) -> str | None:
+    cache = response_cache
+    if not use_cache or cache is None:
+        return None
+    return cache.get(response_cache_key(model_id, body))
+
+
+def cache_completion(model_id: str, body: dict, completion: str, use_cache: bool):
+    cache = response_cache
+    if use_cache and cache is not None:
+        cache.set(response_cache_key(model_id, body), completion)
+
+
 def list_models(client, pattern: str):
     response = client.list_foundation_models()
     return [
@@ -16,12 +74,124 @@ def list_models(client, pattern: str):
     ]
 
 
+# Regions to send model invocations to, in order of preference. Invocations
+# fail over to the next region when a region keeps throttling.
+BEDROCK_REGIONS = [
+    region.strip()
+    for region in os.getenv("BEDROCK_REGIONS", "").split(",")
+    if region.strip()
+] or ["us-east-1"]
+# Number of connections each client keeps open, which bounds the number of
+# concurrent requests per client
+MAX_POOL_CONNECTIONS = 32
+# botocore's adaptive retry mode retries throttled requests with jittered
+# exponential backoff and additionally rate-limits the client itself while
+# it is being throttled.
+CLIENT_CONFIG = {
+    "retries": {"mode": "adaptive", "max_attempts": 6},
+    "max_pool_connections": MAX_POOL_CONNECTIONS,
+    "tcp_keepalive": True,
+}
+# Base delay (in seconds) before failing over to the next region
+FAILOVER_BACKOFF = 1.0
+THROTTLING_ERRORS = ("ThrottlingException", "TooManyRequestsException")
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(service_name: str, region_name: str, profile_name: str | None = None):
+    """
+    Return the process-wide client for a service, region and AWS profile,
+    creating it on first use. Clients are thread-safe and keep a pool of
+    connections open, so reusing them saves both setup time and handshakes.
+    """
+    # boto3 is slow to import and only needed once a model is invoked
+    import boto3
+    from botocore.config import Config
+
+    key = (service_name, region_name, profile_name)
+    with _clients_lock:
+        if key not in _clients:
+            session = boto3.session.Session(profile_name=profile_name)
+            _clients[key] = session.client(
+                service_name, region_name=region_name, config=Config(**CLIENT_CONFIG)
+            )
+        return _clients[key]
+
+
 def init_client(service_name: str, region_name: str):
-    return boto3.client(service_name, region_name=region_name)
+    return get_client(service_name, region_name)
+
+
+class FailoverClient:
+    """
+    Stand-in for a `bedrock-runtime` client that sends model invocations to
+    the first of several regions and fails over to the next region if a
+    request is still throttled after the client's own retries.
+    """
+
+    def __init__(self, regions: list[str], profile_name: str | None = None):
+        self.regions = regions
+        self.profile_name = profile_name
+
+    def _call(self, method: str, **kwargs):
+        for attempt, region in enumerate(self.regions):
+            client = get_client("bedrock-runtime", region, self.profile_name)
+            try:
+                return getattr(client, method)(**kwargs)
+            except ClientError as e:
+                last_region = attempt == len(self.regions) - 1
+                if e.response["Error"]["Code"] not in THROTTLING_ERRORS or last_region:
+                    raise
+                logger.warning(f"Throttled in {region}, failing over")
+                # Full jitter, so that concurrent requests don't all hit the
+                # next region at once
+                time.sleep(random.uniform(0, FAILOVER_BACKOFF * 2**attempt))
+
+    def invoke_model(self, **kwargs):
+        return self._call("invoke_model", **kwargs)
+
+    def invoke_model_with_response_stream(self, **kwargs):
+        return self._call("invoke_model_with_response_stream", **kwargs)
+
+
+def get_runtime_client(
+    regions: list[str] | None = None, profile_name: str | None = None
+) -> FailoverClient:
+    """
+    Return a `bedrock-runtime` client for the given regions (defaulting to
+    `BEDROCK_REGIONS`) that fails over between them when throttled
+    """
+    return FailoverClient(regions or BEDROCK_REGIONS, profile_name)
 
 
+# Default model of each model choice
+JURASSIC2_MODEL_ID = "ai21.j2-jumbo-instruct"
+LLAMA2_MODEL_ID = "meta.llama2-70b-chat-v1"
+CLAUDE3_MODEL_ID = "anthropic.claude-3-sonnet-20240229-v1:0"
+
+
+def jurassic2_request_body(prompt: str) -> dict:
+    # The different model providers have individual request and response formats.
+    # For the format, ranges, and default values for AI21 Labs Jurassic-2, refer to:
+    # https://docs.aws.amazon.com/bedrock/latest/userguide/model-parameters-jurassic2.html
+    # The parameters below are just a (subjectively) relevant subset of the available
+    # parameters.
+    return {
+        "prompt": prompt,
+        "temperature": 0.5,
+        "topP": 0.5,
+        "maxTokens": 200,
+    }
+
+
+@traced("bedrock.invoke")
 def invoke_jurassic2(
-    client, prompt: str, model_id: str = "ai21.j2-jumbo-instruct"
+    client,
+    prompt: str,
+    model_id: str = JURASSIC2_MODEL_ID,
+    use_cache: bool = True,
 ) -> str:
     """
     Invokes the AI21 Labs Jurassic-2 large-language model to run an inference
@@ -30,26 +200,27 @@ def invoke_jurassic2(
     :param client: A `boto3.client` object for the `bedrock-runtime` service.
     :param prompt: The prompt that you want Jurassic-2 to complete.
     :param model_id: The model ID of the Jurassic-2 model to invoke.
+    :param use_cache: Whether to look up and store the completion in the
+      response cache.
     :return: Inference response from the model.
     """
 
     try:
-        # The different model providers have individual request and response formats.
-        # For the format, ranges, and default values for AI21 Labs Jurassic-2, refer to:
-        # https://docs.aws.amazon.com/bedrock/latest/userguide/model-parameters-jurassic2.html
-        # The parameters below are just a (subjectively) relevant subset of the available
-        # parameters.
-        body = {
-            "prompt": prompt,
-            "temperature": 0.5,
-            "topP": 0.5,
-            "maxTokens": 200,
-        }
+        body = jurassic2_request_body(prompt)
+        completion = get_cached_completion(model_id, body, use_cache)
+        annotate(model=model_id, cached=completion is not None)
+        if completion is not None:
+            return completion
 
         response = client.invoke_model(modelId=model_id, body=json.dumps(body))
 
         response_body = json.loads(response["body"].read())
         completion = response_body["completions"][0]["data"]["text"]
+        annotate(
+            input_tokens=len(response_body["prompt"]["tokens"]),
+            output_tokens=len(response_body["completions"][0]["data"]["tokens"]),
+        )
+        cache_completion(model_id, body, completion, use_cache)
 
         return completion
 
@@ -58,29 +229,48 @@ def invoke_jurassic2(
         raise
 
 
+def llama2_request_body(prompt: str) -> dict:
+    return {
+        "prompt": prompt,
+        "temperature": 0.3,
+        "top_p": 0.3,
+        "max_gen_len": 1000,
+    }
+
+
+@traced("bedrock.invoke")
 def invoke_llama2(
-    client, prompt: str, model_id: str = "meta.llama2-70b-chat-v1"
+    client,
+    prompt: str,
+    model_id: str = LLAMA2_MODEL_ID,
+    use_cache: bool = True,
 ) -> str:
     """
     Invokes the Meta Llama 2 large-language model to run an inference
     using the input provided in the request body.
 
     :param prompt: The prompt that you want Jurassic-2 to complete.
+    :param use_cache: Whether to look up and store the completion in the
+      response cache.
     :return: Inference response from the model.
     """
 
     try:
-        body = {
-            "prompt": prompt,
-            "temperature": 0.3,
-            "top_p": 0.3,
-            "max_gen_len": 1000,
-        }
+        body = llama2_request_body(prompt)
+        completion = get_cached_completion(model_id, body, use_cache)
+        annotate(model=model_id, cached=completion is not None)
+        if completion is not None:
+            return completion
 
         response = client.invoke_model(modelId=model_id, body=json.dumps(body))
 
         response_body = json.loads(response["body"].read())
         completion = response_body["generation"]
+        annotate(
+            input_tokens=response_body["prompt_token_count"],
+            output_tokens=response_body["generation_token_count"],
+        )
+        cache_completion(model_id, body, completion, use_cache)
 
         return completion
 
@@ -89,8 +279,22 @@ def invoke_llama2(
         raise
 
 
+def claude3_request_body(prompt: str) -> dict:
+    return {
+        "anthropic_version": "bedrock-2023-05-31",
+        "max_tokens": 1000,
+        "temperature": 0.3,
+        "top_p": 0.3,
+        "messages": [{"role": "user", "content": [{"type": "text", "text": prompt}]}],
+    }
+
+
+@traced("bedrock.invoke")
 def invoke_claude3(
-    client, prompt: str, model_id: str = "anthropic.claude-3-sonnet-20240229-v1:0"
+    client,
+    prompt: str,
+    model_id: str = CLAUDE3_MODEL_ID,
+    use_cache: bool = True,
 ) -> str:
     """
     Invokes the Anthropics Claude-3 large-language model to run an inference
@@ -99,22 +303,26 @@ def invoke_claude3(
     :param client: `boto3.client` object for the Bedrock service.
     :param claude_model: The model ID for the Claude-3 model you want to use.
     :param prompt: The prompt that you want Claude-3 to complete.
+    :param use_cache: Whether to look up and store the completion in the
+      response cache.
     :return: Inference response from the model.
     """
 
     try:
-        body = {
-            "anthropic_version": "bedrock-2023-05-31",
-            "max_tokens": 1000,
-            "temperature": 0.3,
-            "top_p": 0.3,
-            "messages": [
-                {"role": "user", "content": [{"type": "text", "text": prompt}]}
-            ],
-        }
+        body = claude3_request_body(prompt)
+        completion = get_cached_completion(model_id, body, use_cache)
+        annotate(model=model_id, cached=completion is not None)
+        if completion is not None:
+            return completion
+
         response = client.invoke_model(modelId=model_id, body=json.dumps(body))
         response_body = json.loads(response["body"].read())
         completion = response_body["content"][0]["text"]
+        annotate(
+            input_tokens=response_body["usage"]["input_tokens"],
+            output_tokens=response_body["usage"]["output_tokens"],
+        )
+        cache_completion(model_id, body, completion, use_cache)
 
         return completion
 
@@ -123,6 +331,109 @@ def invoke_claude3(
         raise e
 
 
+def request_fingerprint(model_choice: str, prompt: str) -> str:
+    """
+    Identify the request that the invoke and stream functions of
+    `model_choice` send for `prompt` with their default model. It changes
+    whenever the prompt, the model or the inference parameters do.
+    """
+    model_id, request_body = {
+        "jurassic2": (JURASSIC2_MODEL_ID, jurassic2_request_body),
+        "llama2": (LLAMA2_MODEL_ID, llama2_request_body),
+        "claude3": (CLAUDE3_MODEL_ID, claude3_request_body),
+    }[model_choice]
+    return response_cache_key(model_id, request_body(prompt))
+
+
+def stream_chunks(client, model_id: str, body: dict) -> Iterator[dict]:
+    """
+    Invoke a model with a streaming response and yield the decoded chunks as
+    they arrive.
+    """
+    response = client.invoke_model_with_response_stream(
+        modelId=model_id, body=json.dumps(body)
+    )
+    for event in response["body"]:
+        if chunk := event.get("chunk"):
+            yield json.loads(chunk["bytes"])
+
+
+def stream_jurassic2(
+    client,
+    prompt: str,
+    model_id: str = JURASSIC2_MODEL_ID,
+    use_cache: bool = True,
+) -> Iterator[str]:
+    """
+    Streaming variant of `invoke_jurassic2`. Bedrock doesn't support response
+    streaming for Jurassic-2, so this yields the whole completion at once.
+    """
+    yield invoke_jurassic2(client, prompt, model_id, use_cache)
+
+
+@traced("bedrock.stream")
+def stream_llama2(
+    client,
+    prompt: str,
+    model_id: str = LLAMA2_MODEL_ID,
+    use_cache: bool = True,
+) -> Iterator[str]:
+    """
+    Streaming variant of `invoke_llama2`, yielding the completion piece by
+    piece as the model generates it.
+    """
+    body = llama2_request_body(prompt)
+    completion = get_cached_completion(model_id, body, use_cache)
+    annotate(model=model_id, cached=completion is not None)
+    if completion is not None:
+        yield completion
+        return
+
+    try:
+        completion = ""
+        for chunk in stream_chunks(client, model_id, body):
+            if text := chunk.get("generation"):
+                completion += text
+                yield text
+        cache_completion(model_id, body, completion, use_cache)
+
+    except ClientError:
+        logger.error("Couldn't invoke Llama 2")
+        raise
+
+
+@traced("bedrock.stream")
+def stream_claude3(
+    client,
+    prompt: str,
+    model_id: str = CLAUDE3_MODEL_ID,
+    use_cache: bool = True,
+) -> Iterator[str]:
+    """
+    Streaming variant of `invoke_claude3`, yielding the completion piece by
+    piece as the model generates it.
+    """
+    body = claude3_request_body(prompt)
+    completion = get_cached_completion(model_id, body, use_cache)
+    annotate(model=model_id, cached=completion is not None)
+    if completion is not None:
+        yield completion
+        return
+
+    try:
+        completion = ""
+        for chunk in stream_chunks(client, model_id, body):
+            if chunk["type"] == "content_block_delta":
+                text = chunk["delta"].get("text", "")
+                completion += text
+                yield text
+        cache_completion(model_id, body, completion, use_cache)
+
+    except ClientError as e:
+        logger.error("Couldn't invoke Claude-3")
+        raise e
+
+
 if __name__ == "__main__":
     client = init_client("bedrock", "us-east-1")
     for a in list_models(client, ""):
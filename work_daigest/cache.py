@@ -0,0 +1,134 @@
+import hashlib
+import json
+import os
+import pathlib
+import threading
+import time
+
+
+def default_cache_dir() -> pathlib.Path:
+    """
+    Return the base directory for all on-disk caches.
+
+    This is `$WORK_DAIGEST_CACHE_DIR` if set, otherwise `work-daigest` in the
+    user's cache directory (`$XDG_CACHE_HOME`, defaulting to `~/.cache`).
+    """
+    if cache_dir := os.getenv("WORK_DAIGEST_CACHE_DIR"):
+        return pathlib.Path(cache_dir)
+    xdg_cache_home = os.getenv("XDG_CACHE_HOME") or pathlib.Path.home() / ".cache"
+    return pathlib.Path(xdg_cache_home) / "work-daigest"
+
+
+class DiskCache:
+    """
+    A simple on-disk key-value store for JSON-serializable values.
+
+    Each entry is stored in its own file, named after the hash of its key.
+    Entries older than `ttl` seconds are treated as missing. Once the files
+    take up more than `max_bytes`, the least recently used entries are
+    deleted until the cache fits again.
+    """
+
+    def __init__(
+        self,
+        directory: pathlib.Path,
+        ttl: float | None = None,
+        max_bytes: int | None = None,
+    ):
+        self.directory = pathlib.Path(directory)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # Total size of the cache files, computed lazily on the first write
+        self._size: int | None = None
+
+    def _path(self, key: str) -> pathlib.Path:
+        return self.directory / f"{hashlib.sha256(key.encode()).hexdigest()}.json"
+
+    def get(self, key: str):
+        """
+        Return the value stored under `key`, or `None` if there is no such
+        entry or it has expired.
+        """
+        path = self._path(key)
+        try:
+            with open(path, "r") as f:
+                entry = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        if self.ttl is not None and time.time() - entry["stored_at"] > self.ttl:
+            with self._lock:
+                self._delete(path)
+            return None
+        # The modification time tracks when an entry was last used, which is
+        # what the eviction policy goes by.
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return entry["value"]
+
+    def set(self, key: str, value) -> None:
+        """
+        Store `value` under `key`, evicting old entries if the cache grows
+        too large.
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self._path(key)
+        data = json.dumps({"key": key, "stored_at": time.time(), "value": value})
+        # Write to a temporary file first so that concurrent readers never
+        # see a partially written entry.
+        tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp_path, "w") as f:
+            f.write(data)
+        with self._lock:
+            old_size = path.stat().st_size if path.exists() else 0
+            os.replace(tmp_path, path)
+            if self.max_bytes is not None:
+                if self._size is None:
+                    self._size = sum(p.stat().st_size for p in self._entries())
+                else:
+                    self._size += len(data) - old_size
+                if self._size > self.max_bytes:
+                    self._evict()
+
+    def _entries(self) -> list[pathlib.Path]:
+        return list(self.directory.glob("*.json"))
+
+    def _delete(self, path: pathlib.Path) -> None:
+        try:
+            size = path.stat().st_size
+            path.unlink()
+        except FileNotFoundError:
+            return
+        if self._size is not None:
+            self._size -= size
+
+    def _evict(self) -> None:
+        """
+        Delete least recently used entries until the cache is at most 90% of
+        `max_bytes` large. Must be called with `self._lock` held.
+        """
+        entries = []
+        for path in self._entries():
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort()
+        self._size = sum(size for _, size, _ in entries)
+        target = self.max_bytes * 0.9
+        for _, size, path in entries:
+            if self._size <= target:
+                break
+            self._delete(path)
+
+    def clear(self) -> None:
+        """
+        Delete all entries.
+        """
+        with self._lock:
+            for path in self._entries():
+                self._delete(path)
+            self._size = 0
@@ -0,0 +1,228 @@
+"""
+Client of the digest server (see `server`), which lets the CLI and the UI
+leave generating digests to a long-lived server
+"""
+
+import base64
+import datetime
+import http.client
+import json
+import os
+import socket
+import time
+from typing import Any, Callable
+from urllib.parse import urlsplit
+
+# Address of the digest server to use by default, either an HTTP URL such as
+# "http://127.0.0.1:8765" or the path of a Unix socket such as
+# "unix:/run/work-daigest.sock"
+DEFAULT_SERVER = os.getenv("WORK_DAIGEST_SERVER")
+# Time (in seconds) between status requests while following progress
+POLL_INTERVAL = 0.25
+# Longest time (in seconds) a status request asks the server to wait for a
+# job to finish. Requests time out a bit later.
+LONG_POLL_WAIT = 30.0
+REQUEST_TIMEOUT = LONG_POLL_WAIT + 30.0
+# Age (in seconds) after which the state of a `RemoteJob` is fetched again
+MAX_STATE_AGE = 0.1
+
+
+class ServerError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(f"Digest server answered {status}: {message}")
+        self.status = status
+
+
+# Errors raised when the digest server can't be reached, or answers with an
+# error
+REQUEST_ERRORS = (OSError, http.client.HTTPException, ServerError)
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path: str, timeout: float):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class DigestClient:
+    def __init__(self, address: str):
+        """
+        :param address: URL of the server, or "unix:" followed by the path of
+          its Unix socket.
+        """
+        self.address = address
+        if address.startswith("unix:"):
+            self._socket_path = address.removeprefix("unix:").removeprefix("//")
+        else:
+            self._socket_path = None
+            url = urlsplit(address)
+            if url.scheme != "http" or not url.hostname:
+                raise ValueError(f"Invalid digest server address: {address}")
+            self._host, self._port = url.hostname, url.port
+
+    def _connect(self) -> http.client.HTTPConnection:
+        if self._socket_path is not None:
+            return UnixHTTPConnection(self._socket_path, REQUEST_TIMEOUT)
+        return http.client.HTTPConnection(
+            self._host, self._port, timeout=REQUEST_TIMEOUT
+        )
+
+    def _request(self, method: str, path: str, body: dict | None = None) -> dict:
+        connection = self._connect()
+        try:
+            headers = {}
+            data = None
+            if body is not None:
+                data = json.dumps(body).encode()
+                headers["Content-Type"] = "application/json"
+            connection.request(method, path, body=data, headers=headers)
+            response = connection.getresponse()
+            payload = json.loads(response.read())
+        finally:
+            connection.close()
+        if response.status >= 400:
+            raise ServerError(response.status, payload.get("error", ""))
+        return payload
+
+    def submit(self, request: dict) -> dict:
+        """
+        Request a digest, as built by `digest_request`
+
+        :return: State of the job generating it.
+        """
+        return self._request("POST", "/digests", request)
+
+    def status(self, job_id: str, wait: float = 0.0) -> dict:
+        """
+        :param wait: Time (in seconds) to wait for the job to finish before
+          answering.
+        :return: State of the job.
+        """
+        return self._request("GET", f"/digests/{job_id}?wait={wait}")
+
+    def cancel(self, job_id: str) -> dict:
+        return self._request("DELETE", f"/digests/{job_id}")
+
+    def health(self) -> dict:
+        return self._request("GET", "/health")
+
+
+def digest_request(
+    calendar: bytes,
+    github_handle: str,
+    email: str,
+    lower_date: datetime.datetime,
+    upper_date: datetime.datetime,
+    model_choice: str,
+    chunk_by: str | None = None,
+    max_model_workers: int | None = None,
+    use_cache: bool = True,
+) -> dict:
+    """
+    Build the request for a digest
+
+    :param calendar: Content of the calendar .ics file.
+    :param chunk_by: How to split the data for map-reduce summarization, or
+      None to summarize it with a single prompt.
+    """
+    request = {
+        # Calendars aren't always valid UTF-8, so their bytes are sent as is
+        "calendar": base64.b64encode(calendar).decode("ascii"),
+        "github_handle": github_handle,
+        "email": email,
+        "lower_date": lower_date.isoformat(),
+        "upper_date": upper_date.isoformat(),
+        "model": model_choice,
+        "map_reduce": chunk_by,
+        "use_cache": use_cache,
+    }
+    if max_model_workers is not None:
+        request["max_model_workers"] = max_model_workers
+    return request
+
+
+class RemoteJob:
+    """
+    Job running on a digest server, with the same interface as `jobs.Job`
+    for following its progress. Its state is fetched from the server when
+    read, at most every `MAX_STATE_AGE` seconds.
+    """
+
+    def __init__(
+        self,
+        client: DigestClient,
+        state: dict,
+        decode: Callable[[dict], Any] | None = None,
+    ):
+        """
+        :param state: State of the job, as returned when submitting it.
+        :param decode: Function converting the result sent by the server.
+        """
+        self.client = client
+        self.id = state["id"]
+        self._decode = decode
+        self._update(state)
+
+    def _update(self, state: dict):
+        self._state = state
+        self._fetched_at = time.monotonic()
+
+    def refresh(self):
+        self._update(self.client.status(self.id))
+
+    @property
+    def state(self) -> dict:
+        finished = self._state["status"] not in ("queued", "running")
+        if not finished and time.monotonic() - self._fetched_at > MAX_STATE_AGE:
+            self.refresh()
+        return self._state
+
+    @property
+    def status(self) -> str:
+        return self.state["status"]
+
+    @property
+    def running(self) -> bool:
+        return self.status in ("queued", "running")
+
+    @property
+    def result(self) -> Any:
+        result = self.state["result"]
+        if result is not None and self._decode is not None:
+            return self._decode(result)
+        return result
+
+    @property
+    def error(self) -> str | None:
+        return self.state["error"]
+
+    @property
+    def stages(self) -> dict[str, tuple[int, dict]]:
+        return {
+            stage: (progress["count"], progress["details"])
+            for stage, progress in self.state["stages"].items()
+        }
+
+    def cancel(self):
+        self._update(self.client.cancel(self.id))
+
+    def wait(self, timeout: float | None = None) -> bool:
+        """
+        Wait for the job to finish
+
+        :return: Whether it finished within `timeout` seconds.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.running:
+            wait = LONG_POLL_WAIT
+            if deadline is not None:
+                wait = min(wait, deadline - time.monotonic())
+                if wait <= 0:
+                    return False
+            self._update(self.client.status(self.id, wait))
+        return True
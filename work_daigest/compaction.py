@@ -0,0 +1,159 @@
+import collections
+import dataclasses
+import json
+from dataclasses import dataclass
+
+from .aggregate import render_facts, representative_items
+from .fetchers.github import GitHubComment
+from .fetchers.google_calendar import CalendarEvent, format_event
+
+# Rough number of characters per token for English text, which is good enough
+# to keep prompts within budget without depending on each model's tokenizer
+CHARS_PER_TOKEN = 4
+
+# Number of tokens the calendar and GitHub data may take up in the prompt, per
+# model. This is the context window minus room for the prompt template and
+# the completion (see the `invoke_*` functions in `bedrock.py`).
+MODEL_TOKEN_BUDGETS = {
+    "claude3": 150_000,
+    "llama2": 2_500,
+    "jurassic2": 7_000,
+}
+
+# Texts of issues, PRs and commits are cut to the first of these lengths (in
+# characters) for which the prompt fits the budget
+TEXT_LENGTH_LIMITS = (2000, 1000, 500, 200, 100)
+
+
+@dataclass
+class CompactedData:
+    facts: str
+    calendar_data: str
+    github_data: str
+    tokens_before: int
+    tokens_after: int
+
+    @property
+    def tokens_saved(self) -> int:
+        return self.tokens_before - self.tokens_after
+
+
+def estimate_tokens(text: str) -> int:
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def merge_repeated_events(events: list[str]) -> list[str]:
+    """
+    Merge identical calendar events (typically the occurrences of a recurring
+    meeting) into one entry that says how often the event took place
+    """
+    counts = collections.Counter(events)
+    merged = []
+    for event, count in counts.items():
+        if count > 1:
+            lines = event.split("\n")
+            # Keep the separator line last
+            event = "\n".join(lines[:-1] + [f"occurrences: {count}", lines[-1]])
+        merged.append(event)
+    return merged
+
+
+def truncate(text: str | None, max_chars: int) -> str | None:
+    if text is None or len(text) <= max_chars:
+        return text
+    return text[:max_chars].rstrip() + " [...]"
+
+
+def compact_github_data(comments: list[GitHubComment], max_chars: int) -> list[dict]:
+    """
+    Drop duplicate issues / PRs / commits (e.g. the same commit pushed to
+    several branches) and cut their texts to `max_chars` characters
+
+    Only exact duplicates are dropped: distinct items may well share their
+    repository, action and text (e.g. several commits saying "fix typo", or
+    several PRs without a description), but not also their date.
+    """
+    seen = set()
+    compacted = []
+    for comment in comments:
+        key = (
+            comment.date,
+            comment.kind,
+            comment.repository,
+            comment.action,
+            comment.text,
+        )
+        if key in seen:
+            continue
+        seen.add(key)
+        record = dataclasses.asdict(comment)
+        record["text"] = truncate(comment.text, max_chars)
+        compacted.append(record)
+    return compacted
+
+
+def render_github_data(records: list[dict]) -> str:
+    # Without `default=str`, `dumps` will fail on `datetime` objects
+    return json.dumps(records, default=str)
+
+
+def compact(
+    calendar_data: list[CalendarEvent],
+    github_data: list[GitHubComment],
+    model_choice: str,
+    email: str | None = None,
+) -> CompactedData:
+    """
+    Shrink calendar and GitHub data so that together they fit the token budget
+    of the given model.
+
+    Counts and totals over all of the data are computed up front (see
+    `render_facts`), so that only the most recent GitHub items of every
+    repository need to be kept. Repeated events are merged and duplicate
+    GitHub items dropped next. Then GitHub texts are cut to shorter and
+    shorter lengths, and if that's still not enough, the last events and
+    GitHub items are dropped.
+
+    :param email: Email address of the person the data is about.
+    """
+    formatted_events = [format_event(e) for e in calendar_data]
+    tokens_before = estimate_tokens("\n".join(formatted_events)) + estimate_tokens(
+        render_github_data([dataclasses.asdict(c) for c in github_data])
+    )
+
+    facts = render_facts(calendar_data, github_data, email)
+    facts_tokens = estimate_tokens(facts)
+    budget = max(MODEL_TOKEN_BUDGETS[model_choice] - facts_tokens, 0)
+    github_data = representative_items(github_data)
+
+    events = merge_repeated_events(formatted_events)
+    calendar_tokens = estimate_tokens("\n".join(events))
+    for max_chars in TEXT_LENGTH_LIMITS:
+        records = compact_github_data(github_data, max_chars)
+        github_tokens = estimate_tokens(render_github_data(records))
+        if calendar_tokens + github_tokens <= budget:
+            break
+
+    # Still too large: drop entries from whichever part is larger. Sizes are
+    # updated by subtracting the size of each dropped entry (and its
+    # separator) to avoid re-rendering everything each time.
+    calendar_chars = len("\n".join(events))
+    github_chars = len(render_github_data(records))
+    budget_chars = budget * CHARS_PER_TOKEN
+    while calendar_chars + github_chars > budget_chars and (events or records):
+        if calendar_chars >= github_chars and events:
+            calendar_chars -= len(events.pop()) + len("\n")
+        else:
+            # A record takes up as much space as a list containing only that
+            # record, i.e. its own length plus that of the separator ", "
+            github_chars -= len(render_github_data([records.pop()]))
+    calendar_text = "\n".join(events)
+    github_text = render_github_data(records)
+
+    return CompactedData(
+        facts,
+        calendar_text,
+        github_text,
+        tokens_before,
+        facts_tokens + estimate_tokens(calendar_text) + estimate_tokens(github_text),
+    )
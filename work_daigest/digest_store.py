@@ -0,0 +1,80 @@
+import pathlib
+import sqlite3
+import threading
+import time
+
+from .cache import default_cache_dir
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS digests (
+    user TEXT NOT NULL,
+    model TEXT NOT NULL,
+    period TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    summary TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (user, model, period)
+);
+"""
+
+
+class DigestStore:
+    """
+    Local SQLite store of summaries of single periods of time (days or
+    weeks), which longer summaries are combined from.
+
+    Summaries are stored per user, model and period, together with a
+    fingerprint of the model request that produced them. A stored summary is
+    only reused for a request with the same fingerprint, so periods whose
+    data changed since (e.g. the current day) are summarized again and
+    replace their previous summary.
+    """
+
+    def __init__(self, path: pathlib.Path):
+        self.path = pathlib.Path(path)
+        self._lock = threading.Lock()
+        self._connection: sqlite3.Connection | None = None
+
+    def _connect(self) -> sqlite3.Connection:
+        # Must be called with `self._lock` held
+        if self._connection is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.executescript(SCHEMA)
+        return self._connection
+
+    def get(self, user: str, model: str, period: str, fingerprint: str) -> str | None:
+        """
+        Return the stored summary of `period`, unless there is none or it was
+        produced by a different request than the one identified by
+        `fingerprint`
+        """
+        with self._lock:
+            row = (
+                self._connect()
+                .execute(
+                    "SELECT summary FROM digests WHERE user = ? AND model = ?"
+                    " AND period = ? AND fingerprint = ?",
+                    (user, model, period, fingerprint),
+                )
+                .fetchone()
+            )
+        return row[0] if row is not None else None
+
+    def put(
+        self, user: str, model: str, period: str, fingerprint: str, summary: str
+    ) -> None:
+        """
+        Store the summary of `period`, replacing any previous one
+        """
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                connection.execute(
+                    "INSERT OR REPLACE INTO digests VALUES (?, ?, ?, ?, ?, ?)",
+                    (user, model, period, fingerprint, summary, time.time()),
+                )
+
+
+def default_store() -> DigestStore:
+    return DigestStore(default_cache_dir() / "digests.sqlite3")
@@ -0,0 +1,123 @@
+import collections
+import hashlib
+import io
+import pathlib
+import threading
+from typing import BinaryIO
+
+from ..cache import DiskCache, default_cache_dir
+from ..profiling import traced
+from .calendar_index import EventTable
+from .ics_stream import parse_in_chunks
+
+# Bump this whenever the format of stored event tables changes, so that
+# tables stored by older versions are not used anymore.
+TABLE_VERSION = 2
+
+CALENDAR_CACHE_TTL = 30 * 24 * 60 * 60
+CALENDAR_CACHE_MAX_BYTES = 500 * 1024 * 1024
+# Number of event tables kept in memory
+MEMORY_CACHE_SIZE = 4
+
+
+@traced("calendar.parse")
+def build_event_table(cal_file: BinaryIO) -> EventTable:
+    """
+    Parse a calendar export into an `EventTable`
+    """
+    text_file = io.TextIOWrapper(cal_file, encoding="utf-8")
+    try:
+        return EventTable.from_calendars(parse_in_chunks(text_file))
+    finally:
+        # Leave closing the underlying file to the caller
+        text_file.detach()
+
+
+class CalendarCache:
+    """
+    Cache of parsed calendar exports, keyed by the hash of their content.
+    Recently used tables are kept in memory, and all tables are stored on
+    disk so that they survive restarts.
+    """
+
+    def __init__(
+        self, disk_cache: DiskCache | None, memory_size: int = MEMORY_CACHE_SIZE
+    ):
+        """
+        :param memory_size: Number of event tables kept in memory.
+        """
+        self.disk_cache = disk_cache
+        self.memory_size = memory_size
+        self._memory = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def load(self, cal_file: BinaryIO) -> EventTable:
+        """
+        Return the `EventTable` for the calendar export in `cal_file`, only
+        parsing the export if it has not been seen before
+        """
+        digest = hashlib.sha256()
+        while chunk := cal_file.read(1024 * 1024):
+            digest.update(chunk)
+        key = f"{TABLE_VERSION}:{digest.hexdigest()}"
+
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key]
+
+        rows = self.disk_cache.get(key) if self.disk_cache is not None else None
+        if rows is not None:
+            table = EventTable.from_json(rows)
+        else:
+            cal_file.seek(0)
+            table = build_event_table(cal_file)
+            if self.disk_cache is not None:
+                self.disk_cache.set(key, table.to_json())
+
+        with self._lock:
+            self._memory[key] = table
+            while len(self._memory) > self.memory_size:
+                self._memory.popitem(last=False)
+        return table
+
+
+def default_calendar_cache(memory_size: int = MEMORY_CACHE_SIZE) -> CalendarCache:
+    return CalendarCache(
+        DiskCache(
+            default_cache_dir() / "calendars",
+            ttl=CALENDAR_CACHE_TTL,
+            max_bytes=CALENDAR_CACHE_MAX_BYTES,
+        ),
+        memory_size,
+    )
+
+
+_calendar_cache: CalendarCache | None = default_calendar_cache()
+
+
+def get_calendar_cache() -> CalendarCache | None:
+    return _calendar_cache
+
+
+def set_calendar_cache(cache: CalendarCache | None) -> None:
+    """
+    Replace the cache of parsed calendar exports. Pass `None` to parse the
+    export on every call.
+    """
+    global _calendar_cache
+    _calendar_cache = cache
+
+
+def load_event_table(
+    cache: CalendarCache, cal_file: pathlib.Path | BinaryIO
+) -> EventTable:
+    """
+    Load the event table of a calendar export given either as a path or as a
+    binary file object (such as a Streamlit `UploadedFile`)
+    """
+    if isinstance(cal_file, pathlib.Path):
+        with open(cal_file, "rb") as f:
+            return cache.load(f)
+    cal_file.seek(0)
+    return cache.load(cal_file)
@@ -0,0 +1,192 @@
+import bisect
+import collections
+import dataclasses
+import datetime
+from typing import TYPE_CHECKING, Iterable
+
+import dateutil.rrule
+import dateutil.tz
+
+from ..profiling import traced
+from .google_calendar import (
+    Attendee,
+    CalendarEvent,
+    format_event,
+    is_attended_by,
+    to_calendar_event,
+)
+
+if TYPE_CHECKING:
+    from ics import Calendar
+
+
+class EventTable:
+    """
+    Index of the events of a calendar export that anybody attends, which can
+    be queried for any date range and email address.
+
+    For every attendee, single events are kept sorted by their start time, so
+    that the events within a date range are found by binary search. Recurring
+    series are kept separately and are only expanded within the queried date
+    range.
+    """
+
+    def __init__(self, events: list[CalendarEvent]):
+        self.events = events
+        # Occurrences of recurring series that were moved or changed and are
+        # thus exported as separate events, by series UID
+        self._overrides = collections.defaultdict(set)
+        # Single events as (start timestamp, event) and recurring series, by
+        # the email addresses of their (non-declining) attendees
+        self._singles = collections.defaultdict(list)
+        self._series = collections.defaultdict(list)
+
+        for e in sorted(events, key=lambda e: e.begin):
+            if e.recurrence_id is not None:
+                self._overrides[e.uid].add(e.recurrence_id.timestamp())
+            emails = {att.email for att in e.attendees if is_attended_by(e, att.email)}
+            for email in emails:
+                if e.rrule is None:
+                    self._singles[email].append((e.begin.timestamp(), e))
+                else:
+                    self._series[email].append(e)
+        self._begins = {
+            email: [begin for begin, _ in singles]
+            for email, singles in self._singles.items()
+        }
+
+    def expand(
+        self, series: CalendarEvent, start: datetime.datetime, end: datetime.datetime
+    ) -> list[CalendarEvent]:
+        """
+        Return the occurrences of a recurring series that lie within
+        `start`..`end`
+        """
+        length = series.end - series.begin
+        tz = (series.tzid and dateutil.tz.gettz(series.tzid)) or series.begin.tzinfo
+        # Expand in the series' own time zone so that occurrences stay at the
+        # same wall clock time across daylight saving time changes.
+        dtstart = series.begin.astimezone(tz)
+        try:
+            rules = dateutil.rrule.rruleset()
+            rules.rrule(dateutil.rrule.rrulestr(series.rrule, dtstart=dtstart))
+            # The start of the series is always an occurrence (RFC 5545)
+            rules.rdate(dtstart)
+            for exdate in series.exdates:
+                rules.exdate(exdate)
+            begins = rules.between(start, end - length, inc=True)
+        except ValueError:
+            # Rules dateutil can't handle (e.g. an UNTIL in local time for a
+            # series in a named time zone): treat the series as a single event
+            begins = [series.begin] if start <= series.begin <= end - length else []
+        overridden = self._overrides.get(series.uid, set())
+        return [
+            dataclasses.replace(
+                series, begin=begin, end=begin + length, rrule=None, exdates=[]
+            )
+            for begin in begins
+            if begin.timestamp() not in overridden
+        ]
+
+    @traced("calendar.query")
+    def query_events(
+        self, start: datetime.datetime, end: datetime.datetime, email: str
+    ) -> list[CalendarEvent]:
+        """
+        Return the events attended by `email` that lie within `start`..`end`,
+        ordered by their start time, including occurrences of recurring series
+        """
+        occurrences = []
+        singles = self._singles.get(email, [])
+        begins = self._begins.get(email, [])
+        last = bisect.bisect_right(begins, end.timestamp())
+        for i in range(bisect.bisect_left(begins, start.timestamp()), last):
+            e = singles[i][1]
+            if e.end <= end:
+                occurrences.append(e)
+        for series in self._series.get(email, []):
+            occurrences.extend(self.expand(series, start, end))
+        occurrences.sort(key=lambda e: e.begin)
+        return occurrences
+
+    def query(
+        self, start: datetime.datetime, end: datetime.datetime, email: str
+    ) -> list[str]:
+        """
+        Like `query_events`, but return the events formatted for the prompt
+        """
+        return [format_event(e) for e in self.query_events(start, end, email)]
+
+    @classmethod
+    def from_calendars(cls, calendars: Iterable["Calendar"]) -> "EventTable":
+        events = []
+        for calendar in calendars:
+            # Events without attendees never show up in a query, but moved
+            # occurrences of recurring series still replace the original ones
+            events.extend(
+                to_calendar_event(e)
+                for e in calendar.events
+                if e.attendees or any(line.name == "RECURRENCE-ID" for line in e.extra)
+            )
+        return cls(events)
+
+    def to_json(self) -> list:
+        def date_time(dt):
+            return dt.isoformat() if dt is not None else None
+
+        return [
+            [
+                e.begin.isoformat(),
+                e.end.isoformat(),
+                e.name,
+                e.duration.total_seconds() if e.duration is not None else None,
+                e.description,
+                [[att.email, att.partstat, att.common_name] for att in e.attendees],
+                e.uid,
+                e.tzid,
+                e.rrule,
+                [exdate.isoformat() for exdate in e.exdates],
+                date_time(e.recurrence_id),
+            ]
+            for e in self.events
+        ]
+
+    @classmethod
+    def from_json(cls, rows: list) -> "EventTable":
+        def date_time(value):
+            return datetime.datetime.fromisoformat(value) if value is not None else None
+
+        return cls(
+            [
+                CalendarEvent(
+                    date_time(begin),
+                    date_time(end),
+                    name,
+                    (
+                        datetime.timedelta(seconds=duration)
+                        if duration is not None
+                        else None
+                    ),
+                    description,
+                    [Attendee(*attendee) for attendee in attendees],
+                    uid,
+                    tzid,
+                    rrule,
+                    [date_time(exdate) for exdate in exdates],
+                    date_time(recurrence_id),
+                )
+                for (
+                    begin,
+                    end,
+                    name,
+                    duration,
+                    description,
+                    attendees,
+                    uid,
+                    tzid,
+                    rrule,
+                    exdates,
+                    recurrence_id,
+                ) in rows
+            ]
+        )
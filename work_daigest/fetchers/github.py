@@ -1,12 +1,24 @@
 import dataclasses
 import datetime
+import functools
+import hashlib
 import json
+import math
 import os
+import re
+import threading
+from concurrent.futures import Executor, ThreadPoolExecutor
 from dataclasses import dataclass
-from typing import Literal, NewType
+from typing import TYPE_CHECKING, Any, Callable, Literal, NewType
 
-import dateutil.parser
-import requests
+from ..cache import DiskCache, default_cache_dir
+from ..profiling import annotate, in_current_context, traced
+from ..progress import report
+from .github_store import GitHubActivityStore, default_store
+from .ratelimit import send_request
+
+if TYPE_CHECKING:
+    import requests
 
 CommentText = NewType("CommentText", str)
 RepositoryName = NewType("RepositoryName", str)
@@ -14,14 +26,19 @@ CommentType = NewType("CommentType", str)
 Action = Literal[
     "created", "updated", "closed", "reopened", "merged", "commented", "committed"
 ]
+# The kinds of search we run. "issue" and "pull-request" double as the values
+# of the `is:` qualifier of the issue search.
+SearchKind = Literal["issue", "pull-request", "commit"]
 
 
-@dataclass
+@dataclass(slots=True)
 class GitHubComment:
     date: datetime.datetime
     text: CommentText
     repository: RepositoryName
     action: Action
+    # None if unknown, e.g. for data exported by earlier versions
+    kind: SearchKind | None = None
 
 
 def to_github_datetime_format(dt: datetime.datetime) -> str:
@@ -31,7 +48,19 @@ def to_github_datetime_format(dt: datetime.datetime) -> str:
     return dt.isoformat()[:19] + "Z"
 
 
-BASE_URL = "https://api.github.com/search"
+def parse_github_datetime(value: str) -> datetime.datetime:
+    """
+    Parse a date returned by GitHub's API, such as "2024-01-31T12:00:00Z".
+    These are always in ISO 8601 format, which `fromisoformat` parses much
+    faster than `dateutil.parser.parse`.
+    """
+    return datetime.datetime.fromisoformat(value)
+
+
+# Set `GITHUB_API_URL` to use another API endpoint, e.g. that of a GitHub
+# Enterprise server or a local stand-in for benchmarks
+API_URL = os.getenv("GITHUB_API_URL", "https://api.github.com")
+BASE_URL = f"{API_URL}/search"
 
 HEADERS = {
     "Accept": "application/vnd.github.v3+json",
@@ -41,149 +70,608 @@ if token := os.getenv("GITHUB_TOKEN"):
     HEADERS["Authorization"] = f"token {token}"
 
 
-def extract_next_page_link_from_header(link_header: str) -> str | None:
+# Default upper bound on the number of GitHub API requests in flight at the
+# same time.
+DEFAULT_MAX_WORKERS = 8
+# Number of keep-alive connections kept open to the GitHub API. This should be
+# at least as large as the largest concurrency limit in use.
+CONNECTION_POOL_SIZE = 32
+
+_session: "requests.Session | None" = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> "requests.Session":
     """
-    Extract the URL of the next page of results from the "Link" header
+    Return the process-wide session used for all GitHub API requests, so that
+    concurrent fetches share one pool of keep-alive connections
+    """
+    # Importing `requests` noticeably delays startup, so wait until the first
+    # request
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_maxsize=CONNECTION_POOL_SIZE)
+            _session.mount("https://", adapter)
+            _session.mount("http://", adapter)
+        return _session
+
+
+def parse_link_header(link_header: str) -> dict[str, str]:
+    """
+    Parse a "Link" header into a mapping from "rel" values to URLs
     """
     # The "link" header contains a comma-separated list of links, each with a
     # "rel" attribute (separated from the link by a semicolon and a space) that
     # describes the relationship of the link to the current page of results.
-    # We're interested in the "rel=next" link.
-    # If there is no "rel=next" link, we're done.
-    links = link_header.split(", ")
-    for link in links:
+    links = {}
+    for link in link_header.split(", "):
         url, rel = link.split("; ")
-        if rel == 'rel="next"':
-            # The URL is enclosed in angle brackets, so we strip those off
-            return url.lstrip("<").rstrip(">")
-    return None
+        # The URL is enclosed in angle brackets, so we strip those off
+        links[rel.removeprefix("rel=").strip('"')] = url.lstrip("<").rstrip(">")
+    return links
+
+
+def extract_next_page_link_from_header(link_header: str) -> str | None:
+    """
+    Extract the URL of the next page of results from the "Link" header
+    """
+    # If there is no "rel=next" link, we're done.
+    return parse_link_header(link_header).get("next")
+
+
+# Cached responses are revalidated with GitHub on every use, so the TTL only
+# bounds how long unused entries linger.
+HTTP_CACHE_TTL = 7 * 24 * 60 * 60
+HTTP_CACHE_MAX_BYTES = 100 * 1024 * 1024
+
+http_cache: DiskCache | None = DiskCache(
+    default_cache_dir() / "http", ttl=HTTP_CACHE_TTL, max_bytes=HTTP_CACHE_MAX_BYTES
+)
 
 
-def send_query(url: str, query: str) -> list[dict]:
+def set_http_cache(cache: DiskCache | None) -> None:
     """
-    Send a query to the GitHub API and return the `items` field of the response
+    Replace the cache used for GitHub API responses. Pass `None` to disable
+    caching.
     """
-    items = []
-    current_url = f"{url}?q={query}&per_page=30"
-    while current_url:
-        # The GitHub Search API uses pagination, so we need to fetch multiple
-        # pages of results. The current page to fetch is determined by the
-        # `current_url` variable.
-        response = requests.get(current_url, headers=HEADERS)
-        response.raise_for_status()
-        items.extend(response.json()["items"])
+    global http_cache
+    http_cache = cache
+
+
+@dataclass(slots=True)
+class Page:
+    payload: dict
+    link: str | None
+
+
+def auth_identity() -> str:
+    """
+    Identify who is making requests to GitHub. Responses depend on who is
+    asking (e.g. private repositories only show up for authenticated users),
+    so cached data is keyed by this hash of the credentials.
+    """
+    return hashlib.sha256(HEADERS.get("Authorization", "").encode()).hexdigest()
+
+
+def http_cache_key(url: str) -> str:
+    """
+    Cache key for a request to `url`
+    """
+    return f"{auth_identity()}:{url}"
+
+
+@traced("github.page")
+def get_page(url: str) -> Page:
+    """
+    Fetch a single page of search results
+
+    If a cached copy of the page exists, the request is made conditional on
+    the page having changed since. GitHub answers such requests with a
+    "304 Not Modified" that does not count against the rate limit. Requests
+    wait for the rate limit to allow them and are retried when GitHub rejects
+    them because of it (see `ratelimit.py`).
+    """
+    cache = http_cache
+    key = http_cache_key(url)
+    cached = cache.get(key) if cache is not None else None
+
+    headers = dict(HEADERS)
+    if cached is not None:
+        if cached["etag"]:
+            headers["If-None-Match"] = cached["etag"]
+        if cached["last_modified"]:
+            headers["If-Modified-Since"] = cached["last_modified"]
+
+    response = send_request(url, lambda: get_session().get(url, headers=headers))
+    annotate(bytes=len(response.content), not_modified=response.status_code == 304)
+    if response.status_code == 304 and cached is not None:
+        # Store the entry again to reset its TTL
+        cache.set(key, cached)
+        annotate(items=len(cached["payload"]["items"]))
+        report("github.page", items=len(cached["payload"]["items"]))
+        return Page(cached["payload"], cached["link"])
+    response.raise_for_status()
+
+    page = Page(response.json(), response.headers.get("link"))
+    annotate(items=len(page.payload["items"]))
+    report("github.page", items=len(page.payload["items"]))
+    if cache is not None and (
+        "etag" in response.headers or "last-modified" in response.headers
+    ):
+        cache.set(
+            key,
+            {
+                "etag": response.headers.get("etag"),
+                "last_modified": response.headers.get("last-modified"),
+                "payload": page.payload,
+                "link": page.link,
+            },
+        )
+    return page
+
+
+def remaining_page_urls(link_header: str) -> list[str]:
+    """
+    List the URLs of all pages following the first one, as announced by the
+    "rel=last" link of the first page's "Link" header
+    """
+    last_url = parse_link_header(link_header).get("last")
+    if last_url is None:
+        return []
+    match = re.search(r"([?&])page=(\d+)", last_url)
+    if match is None:
+        return []
+    # Rewrite only the `page` parameter so that the (already encoded) query
+    # stays exactly as GitHub sent it.
+    return [
+        last_url[: match.start()]
+        + f"{match.group(1)}page={page}"
+        + last_url[match.end() :]
+        for page in range(2, int(match.group(2)) + 1)
+    ]
+
+
+# The search API returns at most this many results per query, however many
+# it finds
+MAX_SEARCH_RESULTS = 1000
+# Largest page size the search API allows
+PAGE_SIZE = 100
+# Searches finding more than `MAX_SEARCH_RESULTS` items are split into shards
+# expected to find this many items each. This leaves headroom for activity
+# that is unevenly spread over time, so that shards rarely need to be split
+# again.
+SHARD_TARGET_RESULTS = 500
+
+
+def split_range(
+    lower_date: datetime.datetime, upper_date: datetime.datetime, parts: int
+) -> list[tuple[datetime.datetime, datetime.datetime]]:
+    """
+    Split a date range into up to `parts` consecutive ranges. GitHub's date
+    qualifiers include both bounds and have a resolution of one second, so
+    the ranges are made of whole, non-overlapping seconds.
+    """
+    lower_date = lower_date.replace(microsecond=0)
+    seconds = int((upper_date.replace(microsecond=0) - lower_date).total_seconds()) + 1
+    parts = min(parts, seconds)
+    starts = [
+        lower_date + datetime.timedelta(seconds=seconds * i // parts)
+        for i in range(parts + 1)
+    ]
+    return [
+        (start, next_start - datetime.timedelta(seconds=1))
+        for start, next_start in zip(starts, starts[1:])
+    ]
+
+
+def can_split(lower_date: datetime.datetime, upper_date: datetime.datetime) -> bool:
+    return upper_date - lower_date >= datetime.timedelta(seconds=1)
+
+
+@traced("github.search")
+def send_query(
+    url: str,
+    query_for_range: Callable[[datetime.datetime, datetime.datetime], str],
+    lower_date: datetime.datetime,
+    upper_date: datetime.datetime,
+    executor: Executor | None = None,
+    decode: Callable[[dict], Any] | None = None,
+) -> list:
+    """
+    Search the GitHub API for items in a date range and return the `items`
+    fields of the responses
+
+    The GitHub Search API uses pagination, and returns no more than
+    `MAX_SEARCH_RESULTS` items per query. The first page tells us how many
+    items a query finds, so queries finding more than that are split into
+    queries for shorter date ranges (shards), recursively, until none of them
+    finds too many. All remaining pages of all shards are then fetched. If an
+    `executor` is given, the pages of each step are fetched concurrently on
+    it. Otherwise, pages are fetched one by one. Items found by several shards
+    are only returned once.
 
+    :param query_for_range: Function returning the search query for the items
+      in a date range.
+    :param decode: Function applied to every item. Items are decoded page by
+      page as the pages arrive, so that the raw JSON of only a few pages is
+      in memory at any time.
+    """
+
+    def page_items(page: Page) -> list:
+        return [
+            (item["url"], item if decode is None else decode(item))
+            for item in page.payload["items"]
+        ]
+
+    def fetch_items(url: str) -> list:
+        return page_items(get_page(url))
+
+    def fetch_all(fn: Callable, urls: list[str]):
+        if executor is None:
+            return map(fn, urls)
+        # `map` preserves the order of the URLs. Each page is decoded by the
+        # thread that fetched it.
+        return executor.map(in_current_context(fn), urls)
+
+    shards = [(lower_date, upper_date)]
+    first_pages = []
+    while shards:
+        urls = [
+            f"{url}?q={query_for_range(lower, upper)}&per_page={PAGE_SIZE}"
+            for lower, upper in shards
+        ]
+        split_shards = []
+        for (lower, upper), page in zip(shards, fetch_all(get_page, urls)):
+            total_count = page.payload["total_count"]
+            if total_count > MAX_SEARCH_RESULTS and can_split(lower, upper):
+                split_shards.extend(
+                    split_range(
+                        lower, upper, math.ceil(total_count / SHARD_TARGET_RESULTS)
+                    )
+                )
+            else:
+                first_pages.append(page)
+        shards = split_shards
+    annotate(shards=len(first_pages))
+
+    items = []
+    remaining_urls = []
+    for page in first_pages:
+        items.extend(page_items(page))
         # Pagination: GitHub API responses contain a "link" header that
-        # contains links to the next page of results. If there is no "link"
+        # contains links to the other pages of results. If there is no "link"
         # header, we're done.
-        if "link" not in response.headers:
-            break
-        # If there is a "link" header, extract the URL of the next page of
-        # results.
-        current_url = extract_next_page_link_from_header(response.headers["link"])
+        if page.link is None:
+            continue
+        if executor is not None:
+            remaining_urls.extend(remaining_page_urls(page.link))
+            continue
+        current_url = extract_next_page_link_from_header(page.link)
+        while current_url:
+            page = get_page(current_url)
+            items.extend(page_items(page))
+            if page.link is None:
+                break
+            current_url = extract_next_page_link_from_header(page.link)
+    for decoded_items in fetch_all(fetch_items, remaining_urls):
+        items.extend(decoded_items)
 
-    return items
+    # Items can show up twice when they move between pages while these are
+    # being fetched, so deduplicate them by URL, which identifies them
+    seen = set()
+    unique_items = []
+    for item_url, item in items:
+        if item_url not in seen:
+            seen.add(item_url)
+            unique_items.append(item)
+    return unique_items
 
 
 def get_latest_action(comment_json: dict) -> (str, str):
+    # GitHub returns these dates in UTC and in the same fixed-width format
+    # ("2024-01-31T12:00:00Z"), so comparing them as strings compares them as
+    # dates. On ties, later actions win.
     min_date = "1970-01-01T00:00:00Z"
-    created = ("created", comment_json.get("created_at") or min_date)
-    updated = ("updated", comment_json.get("updated_at") or min_date)
-    closed = ("closed", comment_json.get("closed_at") or min_date)
-    actions = [created, updated, closed]
-    actions = sorted(actions, key=lambda x: dateutil.parser.parse(x[1]))
-    return actions[-1]
+    latest = ("created", comment_json.get("created_at") or min_date)
+    for action, key in (("updated", "updated_at"), ("closed", "closed_at")):
+        date = comment_json.get(key) or min_date
+        if date >= latest[1]:
+            latest = (action, date)
+    return latest
+
+
+def search_items(
+    kind: SearchKind,
+    handle: str,
+    lower_date: datetime.datetime,
+    upper_date: datetime.datetime,
+    executor: Executor | None = None,
+    decode: Callable[[dict], Any] | None = None,
+    updated_since: datetime.datetime | None = None,
+) -> list:
+    """
+    Search for GitHub items of the given `kind` authored by user `handle` and
+    return the raw JSON items, or the result of `decode` for each of them
+
+    :param updated_since: Only search for issues or pull requests updated at
+      or after this time.
+    """
+
+    def date_range(lower: datetime.datetime, upper: datetime.datetime) -> str:
+        return f"{to_github_datetime_format(lower)}..{to_github_datetime_format(upper)}"
+
+    if kind == "commit":
+        return send_query(
+            f"{BASE_URL}/commits",
+            lambda lower, upper: f"author:{handle}+committer:{handle}+author-date:{date_range(lower, upper)}",
+            lower_date,
+            upper_date,
+            executor,
+            decode,
+        )
+    updated = ""
+    if updated_since is not None:
+        updated = f"+updated:>={to_github_datetime_format(updated_since)}"
+    return send_query(
+        f"{BASE_URL}/issues",
+        lambda lower, upper: f"is:{kind}+author:{handle}+created:{date_range(lower, upper)}{updated}",
+        lower_date,
+        upper_date,
+        executor,
+        decode,
+    )
+
+
+def item_timestamp(kind: SearchKind, item: dict) -> datetime.datetime:
+    """
+    Return the date that searches of the given `kind` filter on
+    """
+    if kind == "commit":
+        return parse_github_datetime(item["commit"]["author"]["date"])
+    return parse_github_datetime(item["created_at"])
+
+
+def decode_item(kind: SearchKind, item: dict) -> GitHubComment:
+    """
+    Turn a raw JSON item returned by a search of the given `kind` into a
+    `GitHubComment`
+    """
+    if kind == "commit":
+        return GitHubComment(
+            parse_github_datetime(item["commit"]["author"]["date"]),
+            CommentText(item["commit"]["message"]),
+            RepositoryName(item["repository"]["full_name"]),
+            "committed",
+            kind,
+        )
+    latest_action, date = get_latest_action(item)
+    return GitHubComment(
+        parse_github_datetime(date),
+        CommentText(item["body"]),
+        # example repo URL: https://api.github.com/repos/tweag/chainsail
+        # so we use "tweag/chainsail" as human-readable repo identifier
+        RepositoryName("/".join(item["repository_url"].split("/")[-2:])),
+        latest_action,
+        kind,
+    )
 
 
 def fetch_issues(
-    handle: str, lower_date: datetime.datetime, upper_date: datetime.datetime
+    handle: str,
+    lower_date: datetime.datetime,
+    upper_date: datetime.datetime,
+    executor: Executor | None = None,
 ) -> list[GitHubComment]:
     """
     Fetch all GitHub issues authored by user `handle`
     """
-    # TODO: could also try to use "updated_at" or "closed_at" fields
-    datetime_filter = f"created:{to_github_datetime_format(lower_date)}..{to_github_datetime_format(upper_date)}"
-    response_items = send_query(
-        f"{BASE_URL}/issues", f"is:issue+author:{handle}+{datetime_filter}"
+    return search_items(
+        "issue",
+        handle,
+        lower_date,
+        upper_date,
+        executor,
+        functools.partial(decode_item, "issue"),
     )
-    all_comments = []
-    for comment_json in response_items:
-        latest_action, date = get_latest_action(comment_json)
-        all_comments.append(
-            GitHubComment(
-                dateutil.parser.parse(date),
-                CommentText(comment_json["body"]),
-                # example repo URL: https://api.github.com/repos/tweag/chainsail
-                # so we use "tweag/chainsail" as human-readable repo identifier
-                RepositoryName(
-                    "/".join(comment_json["repository_url"].split("/")[-2:])
-                ),
-                latest_action,
-            )
-        )
-    return all_comments
 
 
 def fetch_prs(
-    handle: str, lower_date: datetime.datetime, upper_date: datetime.datetime
+    handle: str,
+    lower_date: datetime.datetime,
+    upper_date: datetime.datetime,
+    executor: Executor | None = None,
 ) -> list[GitHubComment]:
     """
     Fetch all GitHub pull requests authored by user `handle`
     """
-    # TODO: could also try to use "updated_at" or "closed_at" fields
-    datetime_filter = f"created:{to_github_datetime_format(lower_date)}..{to_github_datetime_format(upper_date)}"
-    response_items = send_query(
-        f"{BASE_URL}/issues", f"is:pull-request+author:{handle}+{datetime_filter}"
+    return search_items(
+        "pull-request",
+        handle,
+        lower_date,
+        upper_date,
+        executor,
+        functools.partial(decode_item, "pull-request"),
     )
-    all_comments = []
-    for comment_json in response_items:
-        latest_action, date = get_latest_action(comment_json)
-        all_comments.append(
-            GitHubComment(
-                dateutil.parser.parse(date),
-                CommentText(comment_json["body"]),
-                # example repo URL: https://api.github.com/repos/tweag/chainsail
-                # so we use "tweag/chainsail" as human-readable repo identifier
-                RepositoryName(
-                    "/".join(comment_json["repository_url"].split("/")[-2:])
-                ),
-                latest_action,
-            )
-        )
-    return all_comments
 
 
 def fetch_commits(
-    handle: str, lower_date: datetime.datetime, upper_date: datetime.datetime
+    handle: str,
+    lower_date: datetime.datetime,
+    upper_date: datetime.datetime,
+    executor: Executor | None = None,
 ) -> list[GitHubComment]:
     """
     Fetch all GitHub commits authored by user `handle`
     """
-    datetime_filter = f"author-date:{to_github_datetime_format(lower_date)}..{to_github_datetime_format(upper_date)}"
-    response_items = send_query(
-        f"{BASE_URL}/commits", f"author:{handle}+committer:{handle}+{datetime_filter}"
+    return search_items(
+        "commit",
+        handle,
+        lower_date,
+        upper_date,
+        executor,
+        functools.partial(decode_item, "commit"),
     )
-    return [
-        GitHubComment(
-            dateutil.parser.parse(comment_json["commit"]["author"]["date"]),
-            CommentText(comment_json["commit"]["message"]),
-            RepositoryName(comment_json["repository"]["full_name"]),
-            "committed",
+
+
+# "rest" uses the search API, "graphql" the GraphQL API (see
+# `github_graphql.py`), which needs far fewer requests. Both return the same
+# comments.
+GitHubBackend = Literal["rest", "graphql"]
+GITHUB_BACKENDS: tuple[GitHubBackend, ...] = ("rest", "graphql")
+
+DEFAULT_GITHUB_BACKEND: GitHubBackend = os.getenv("GITHUB_BACKEND", "rest")
+
+github_backend: GitHubBackend = DEFAULT_GITHUB_BACKEND
+
+
+def set_github_backend(backend: GitHubBackend) -> None:
+    """
+    Choose the API that GitHub data is fetched through
+    """
+    if backend not in GITHUB_BACKENDS:
+        raise ValueError(f"Unknown GitHub backend: {backend}")
+    global github_backend
+    github_backend = backend
+
+
+activity_store: GitHubActivityStore | None = default_store()
+
+# Issues and pull requests keep changing after they are created (they are
+# edited, closed or merged), so those in the store are searched for again if
+# they were updated since they were fetched. Commits never change.
+MUTABLE_KINDS: tuple[SearchKind, ...] = ("issue", "pull-request")
+# Subtracted from the time items were fetched when searching for items
+# updated since, to allow for skew between GitHub's and the local clock
+REFRESH_MARGIN = datetime.timedelta(minutes=5)
+
+
+def set_activity_store(store: GitHubActivityStore | None) -> None:
+    """
+    Replace the local store of GitHub activity. Pass `None` to always fetch
+    everything from GitHub.
+    """
+    global activity_store
+    activity_store = store
+
+
+def comment_to_record(comment: GitHubComment) -> dict:
+    return dict(dataclasses.asdict(comment), date=comment.date.isoformat())
+
+
+def record_to_comment(record: dict) -> GitHubComment:
+    return GitHubComment(
+        **dict(record, date=datetime.datetime.fromisoformat(record["date"]))
+    )
+
+
+def fetch_from_store(
+    store: GitHubActivityStore,
+    kind: SearchKind,
+    handle: str,
+    lower_date: datetime.datetime,
+    upper_date: datetime.datetime,
+    executor: Executor | None = None,
+) -> list[GitHubComment]:
+    """
+    Fetch GitHub items of the given `kind` from the local `store`, first
+    querying GitHub for those parts of the date range that are not in the
+    store yet, and for stored issues and pull requests that changed since
+    they were fetched
+    """
+    viewer = auth_identity()
+
+    def to_record(item: dict) -> tuple[str, datetime.datetime, dict]:
+        return (
+            item["url"],
+            item_timestamp(kind, item),
+            comment_to_record(decode_item(kind, item)),
         )
-        for comment_json in response_items
-    ]
+
+    covered = []
+    if kind in MUTABLE_KINDS:
+        covered = store.covered_ranges(viewer, handle, kind, lower_date, upper_date)
+    missing = store.missing_ranges(viewer, handle, kind, lower_date, upper_date)
+    for lower, upper, fetched_at in covered:
+        refreshed_at = datetime.datetime.now(datetime.timezone.utc)
+        items = search_items(
+            kind,
+            handle,
+            lower,
+            upper,
+            executor,
+            to_record,
+            updated_since=fetched_at - REFRESH_MARGIN,
+        )
+        store.refresh(viewer, handle, kind, lower, upper, items, refreshed_at)
+    for lower, upper in missing:
+        fetched_at = datetime.datetime.now(datetime.timezone.utc)
+        items = search_items(kind, handle, lower, upper, executor, to_record)
+        store.add(viewer, handle, kind, lower, upper, items, fetched_at)
+    records = store.query(viewer, handle, kind, lower_date, upper_date)
+    return [record_to_comment(dict(record, kind=kind)) for record in records]
 
 
+@traced("github.fetch")
 def fetch_comments(
-    handle: str, lower_date: datetime.datetime, upper_date: datetime.datetime
+    handle: str,
+    lower_date: datetime.datetime,
+    upper_date: datetime.datetime,
+    max_workers: int = DEFAULT_MAX_WORKERS,
 ) -> list[GitHubComment]:
     """
     Fetch all GitHub comments authored by user `handle`
+
+    The issue, pull request and commit searches run concurrently and share a
+    pool of `max_workers` threads for fetching result pages, so at most
+    `max_workers` requests are in flight at any time. If a local activity
+    store is configured, only the parts of the date range that are not in the
+    store yet are fetched from GitHub. The GraphQL backend is used instead if
+    selected with `set_github_backend`.
     """
+    kinds = ("issue", "pull-request", "commit")
+    store = activity_store
+    if github_backend == "graphql":
+        # Imported here since `github_graphql` builds on this module
+        from .github_graphql import fetch_comments as fetch_comments_graphql
+
+        return fetch_comments_graphql(
+            handle, lower_date, upper_date, max_workers, store
+        )
     all_comments = []
-    all_comments.extend(fetch_issues(handle, lower_date, upper_date))
-    all_comments.extend(fetch_prs(handle, lower_date, upper_date))
-    all_comments.extend(fetch_commits(handle, lower_date, upper_date))
+    with ThreadPoolExecutor(max_workers=max_workers) as page_pool:
+        with ThreadPoolExecutor(max_workers=len(kinds)) as search_pool:
+            if store is None:
+                fetchers = (fetch_issues, fetch_prs, fetch_commits)
+                futures = [
+                    search_pool.submit(
+                        in_current_context(fetch),
+                        handle,
+                        lower_date,
+                        upper_date,
+                        page_pool,
+                    )
+                    for fetch in fetchers
+                ]
+            else:
+                futures = [
+                    search_pool.submit(
+                        in_current_context(fetch_from_store),
+                        store,
+                        kind,
+                        handle,
+                        lower_date,
+                        upper_date,
+                        page_pool,
+                    )
+                    for kind in kinds
+                ]
+            for future in futures:
+                all_comments.extend(future.result())
     return all_comments
 
 
@@ -0,0 +1,490 @@
+"""
+GitHub GraphQL backend of the GitHub fetcher
+
+Instead of one paginated REST search per kind of item (30 items per page),
+the issue and pull request searches and the commit history of every
+repository the user committed to are requested as aliased fields of a few
+batched GraphQL queries, with 100 items per page and only the fields that
+`GitHubComment` needs.
+
+Results are turned into the shape of the REST search API's items, so that
+they are decoded (and stored) exactly like those of the REST backend.
+"""
+
+import datetime
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+from ..profiling import annotate, in_current_context, traced
+from ..progress import report
+from .github import (
+    API_URL,
+    DEFAULT_MAX_WORKERS,
+    HEADERS,
+    MAX_SEARCH_RESULTS,
+    MUTABLE_KINDS,
+    REFRESH_MARGIN,
+    SHARD_TARGET_RESULTS,
+    GitHubComment,
+    SearchKind,
+    auth_identity,
+    can_split,
+    comment_to_record,
+    decode_item,
+    get_session,
+    item_timestamp,
+    parse_github_datetime,
+    record_to_comment,
+    split_range,
+    to_github_datetime_format,
+)
+from .github_store import GitHubActivityStore
+from .ratelimit import send_request
+
+# Set `GITHUB_GRAPHQL_URL` to use another endpoint. On GitHub Enterprise
+# servers, it is not below the REST API's URL.
+GRAPHQL_URL = os.getenv("GITHUB_GRAPHQL_URL", f"{API_URL}/graphql")
+
+# Largest page size GitHub allows for connections
+PAGE_SIZE = 100
+# Number of aliased fields requested in one query. Each of them returns up to
+# `PAGE_SIZE` nodes, which keeps queries well below GitHub's node limit.
+MAX_FIELDS_PER_QUERY = 20
+# `contributionsCollection` covers at most one year
+MAX_CONTRIBUTIONS_SPAN = datetime.timedelta(days=365)
+# Commit histories are filtered by commit date, while the REST backend (and
+# thus this one) filters commits by author date. Commits committed up to this
+# long after they were authored (e.g. when rebased) are still found.
+COMMIT_DATE_SLACK = datetime.timedelta(days=30)
+
+ITEM_FIELDS = """
+number body createdAt updatedAt closedAt repository { nameWithOwner }
+"""
+
+SEARCH_FIELD = """
+%(alias)s: search(
+  query: $%(alias)s_query, type: ISSUE, first: %(page_size)d, after: $%(alias)s_after
+) {
+  issueCount
+  pageInfo { hasNextPage endCursor }
+  nodes { ... on Issue { %(fields)s } ... on PullRequest { %(fields)s } }
+}
+"""
+
+CONTRIBUTIONS_FIELD = """
+%(alias)s: user(login: $%(alias)s_login) {
+  id
+  contributionsCollection(from: $%(alias)s_from, to: $%(alias)s_to) {
+    commitContributionsByRepository(maxRepositories: 100) {
+      repository { name owner { login } }
+    }
+  }
+}
+"""
+
+HISTORY_FIELD = """
+%(alias)s: repository(owner: $%(alias)s_owner, name: $%(alias)s_name) {
+  defaultBranchRef {
+    target {
+      ... on Commit {
+        history(
+          first: %(page_size)d, after: $%(alias)s_after, author: {id: $%(alias)s_author},
+          since: $%(alias)s_since, until: $%(alias)s_until
+        ) {
+          pageInfo { hasNextPage endCursor }
+          nodes { oid message authoredDate committer { user { login } } }
+        }
+      }
+    }
+  }
+}
+"""
+
+
+class GraphQLError(Exception):
+    """
+    Error reported by the GitHub GraphQL API in the body of a response
+    """
+
+
+@dataclass
+class IssueSearch:
+    """
+    Search for issues or pull requests, continued page by page. Like REST
+    searches, searches finding too many items are split into shards.
+    """
+
+    kind: SearchKind
+    handle: str
+    lower: datetime.datetime
+    upper: datetime.datetime
+    items: list
+    after: str | None = None
+    # Only search for items updated at or after this time, if given
+    updated_since: datetime.datetime | None = None
+
+    def field(self, alias: str) -> tuple[str, dict[str, str], dict]:
+        text = SEARCH_FIELD % {
+            "alias": alias,
+            "page_size": PAGE_SIZE,
+            "fields": ITEM_FIELDS,
+        }
+        date_range = f"{to_github_datetime_format(self.lower)}..{to_github_datetime_format(self.upper)}"
+        query = f"is:{self.kind} author:{self.handle} created:{date_range}"
+        if self.updated_since is not None:
+            query += f" updated:>={to_github_datetime_format(self.updated_since)}"
+        types = {f"{alias}_query": "String!", f"{alias}_after": "String"}
+        variables = {f"{alias}_query": query, f"{alias}_after": self.after}
+        return text, types, variables
+
+    def receive(self, data: dict) -> list:
+        issue_count = data["issueCount"]
+        if (
+            self.after is None
+            and issue_count > MAX_SEARCH_RESULTS
+            and can_split(self.lower, self.upper)
+        ):
+            return [
+                IssueSearch(
+                    self.kind,
+                    self.handle,
+                    lower,
+                    upper,
+                    self.items,
+                    updated_since=self.updated_since,
+                )
+                for lower, upper in split_range(
+                    self.lower,
+                    self.upper,
+                    math.ceil(issue_count / SHARD_TARGET_RESULTS),
+                )
+            ]
+        for node in data["nodes"]:
+            # Results the token can't access come back as empty objects
+            if node:
+                self.items.append(issue_to_rest_item(node))
+        if data["pageInfo"]["hasNextPage"]:
+            self.after = data["pageInfo"]["endCursor"]
+            return [self]
+        return []
+
+
+@dataclass
+class CommitRepositories:
+    """
+    Lookup of the repositories a user committed to, which are then searched
+    for the user's commits
+    """
+
+    handle: str
+    lower: datetime.datetime
+    upper: datetime.datetime
+    items: list
+
+    def field(self, alias: str) -> tuple[str, dict[str, str], dict]:
+        text = CONTRIBUTIONS_FIELD % {"alias": alias}
+        types = {
+            f"{alias}_login": "String!",
+            f"{alias}_from": "DateTime!",
+            f"{alias}_to": "DateTime!",
+        }
+        variables = {
+            f"{alias}_login": self.handle,
+            f"{alias}_from": to_github_datetime_format(self.lower),
+            f"{alias}_to": to_github_datetime_format(self.upper),
+        }
+        return text, types, variables
+
+    def receive(self, data: dict) -> list:
+        contributions = data["contributionsCollection"]
+        return [
+            CommitHistory(
+                contribution["repository"]["owner"]["login"],
+                contribution["repository"]["name"],
+                data["id"],
+                self.handle,
+                self.lower,
+                self.upper,
+                self.items,
+            )
+            for contribution in contributions["commitContributionsByRepository"]
+        ]
+
+
+@dataclass
+class CommitHistory:
+    """
+    Commits of a user on the default branch of a repository, continued page
+    by page
+    """
+
+    owner: str
+    name: str
+    author_id: str
+    handle: str
+    lower: datetime.datetime
+    upper: datetime.datetime
+    items: list
+    after: str | None = None
+
+    def field(self, alias: str) -> tuple[str, dict[str, str], dict]:
+        text = HISTORY_FIELD % {"alias": alias, "page_size": PAGE_SIZE}
+        types = {
+            f"{alias}_owner": "String!",
+            f"{alias}_name": "String!",
+            f"{alias}_author": "ID!",
+            f"{alias}_since": "GitTimestamp!",
+            f"{alias}_until": "GitTimestamp!",
+            f"{alias}_after": "String",
+        }
+        variables = {
+            f"{alias}_owner": self.owner,
+            f"{alias}_name": self.name,
+            f"{alias}_author": self.author_id,
+            f"{alias}_since": to_github_datetime_format(self.lower),
+            f"{alias}_until": to_github_datetime_format(self.upper + COMMIT_DATE_SLACK),
+            f"{alias}_after": self.after,
+        }
+        return text, types, variables
+
+    def receive(self, data: dict | None) -> list:
+        branch = data and data["defaultBranchRef"]
+        if not branch:
+            return []
+        history = branch["target"]["history"]
+        for node in history["nodes"]:
+            committer = node["committer"]["user"]
+            # Like the REST search, only keep commits that the user both
+            # authored and committed, by author date
+            if (
+                committer is not None
+                and committer["login"].lower() == self.handle.lower()
+                and self.lower
+                <= parse_github_datetime(node["authoredDate"])
+                <= self.upper
+            ):
+                self.items.append(commit_to_rest_item(self.owner, self.name, node))
+        if history["pageInfo"]["hasNextPage"]:
+            self.after = history["pageInfo"]["endCursor"]
+            return [self]
+        return []
+
+
+def issue_to_rest_item(node: dict) -> dict:
+    """
+    Convert an issue or pull request node to an item of the REST search API
+    """
+    repository = node["repository"]["nameWithOwner"]
+    return {
+        "url": f"{API_URL}/repos/{repository}/issues/{node['number']}",
+        # Empty bodies are null in REST responses but "" in GraphQL ones
+        "body": node["body"] or None,
+        "created_at": node["createdAt"],
+        "updated_at": node["updatedAt"],
+        "closed_at": node["closedAt"],
+        "repository_url": f"{API_URL}/repos/{repository}",
+    }
+
+
+def commit_to_rest_item(owner: str, name: str, node: dict) -> dict:
+    """
+    Convert a commit node to an item of the REST commit search API
+    """
+    return {
+        "url": f"{API_URL}/repos/{owner}/{name}/commits/{node['oid']}",
+        "commit": {
+            "author": {"date": node["authoredDate"]},
+            "message": node["message"],
+        },
+        "repository": {"full_name": f"{owner}/{name}"},
+    }
+
+
+@traced("github.graphql")
+def post_query(query: str, variables: dict) -> dict:
+    """
+    Send a GraphQL query and return the `data` field of the response
+    """
+    response = send_request(
+        GRAPHQL_URL,
+        lambda: get_session().post(
+            GRAPHQL_URL,
+            json={"query": query, "variables": variables},
+            headers=HEADERS,
+        ),
+    )
+    annotate(bytes=len(response.content))
+    response.raise_for_status()
+    payload = response.json()
+    if payload.get("errors"):
+        raise GraphQLError("; ".join(error["message"] for error in payload["errors"]))
+    return payload["data"]
+
+
+def run_batch(requests: list) -> list:
+    """
+    Request the next page of each of `requests` in a single query
+
+    :return: The requests to continue with.
+    """
+    fields, types, variables = [], {}, {}
+    for i, request in enumerate(requests):
+        text, field_types, field_variables = request.field(f"f{i}")
+        fields.append(text)
+        types.update(field_types)
+        variables.update(field_variables)
+    declarations = ", ".join(f"${name}: {type_}" for name, type_ in types.items())
+    data = post_query(f"query({declarations}) {{{''.join(fields)}}}", variables)
+    annotate(fields=len(requests))
+    report("github.page", fields=len(requests))
+    return [
+        follow_up
+        for i, request in enumerate(requests)
+        for follow_up in request.receive(data[f"f{i}"])
+    ]
+
+
+def contribution_windows(
+    lower_date: datetime.datetime, upper_date: datetime.datetime
+) -> list[tuple[datetime.datetime, datetime.datetime]]:
+    """
+    Split a date range into windows that `contributionsCollection` accepts
+    """
+    windows = []
+    while upper_date - lower_date > MAX_CONTRIBUTIONS_SPAN:
+        windows.append((lower_date, lower_date + MAX_CONTRIBUTIONS_SPAN))
+        lower_date += MAX_CONTRIBUTIONS_SPAN
+    windows.append((lower_date, upper_date))
+    return windows
+
+
+@traced("github.graphql_search")
+def search_all(
+    handle: str,
+    searches: list[
+        tuple[
+            SearchKind, datetime.datetime, datetime.datetime, datetime.datetime | None
+        ]
+    ],
+    max_workers: int = DEFAULT_MAX_WORKERS,
+) -> list[list[dict]]:
+    """
+    Search for GitHub items authored by user `handle`
+
+    All searches advance together: every round requests the next page of all
+    unfinished searches in as few queries as possible, which are sent
+    concurrently on up to `max_workers` threads.
+
+    :param searches: Kind, date range and the time since which issues or
+      pull requests must have been updated (or None) of each search.
+    :return: The items found by each search, in the format of the REST search
+      API.
+    """
+    results = [[] for _ in searches]
+    pending = []
+    for (kind, lower_date, upper_date, updated_since), items in zip(searches, results):
+        # Round the bounds as the REST backend does
+        lower_date, upper_date = (
+            parse_github_datetime(to_github_datetime_format(dt))
+            for dt in (lower_date, upper_date)
+        )
+        if kind == "commit":
+            pending.extend(
+                CommitRepositories(handle, lower, upper, items)
+                for lower, upper in contribution_windows(lower_date, upper_date)
+            )
+        else:
+            pending.append(
+                IssueSearch(
+                    kind,
+                    handle,
+                    lower_date,
+                    upper_date,
+                    items,
+                    updated_since=updated_since,
+                )
+            )
+
+    rounds = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending:
+            rounds += 1
+            batches = [
+                pending[i : i + MAX_FIELDS_PER_QUERY]
+                for i in range(0, len(pending), MAX_FIELDS_PER_QUERY)
+            ]
+            pending = [
+                request
+                for follow_ups in executor.map(in_current_context(run_batch), batches)
+                for request in follow_ups
+            ]
+    annotate(rounds=rounds, items=sum(map(len, results)))
+    # Shards may find the same items, as REST searches do
+    return [list({item["url"]: item for item in items}.values()) for items in results]
+
+
+def fetch_comments(
+    handle: str,
+    lower_date: datetime.datetime,
+    upper_date: datetime.datetime,
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    store: GitHubActivityStore | None = None,
+) -> list[GitHubComment]:
+    """
+    Fetch all GitHub comments authored by user `handle` through the GraphQL
+    API
+
+    If a local activity `store` is given, only the parts of the date range
+    that are not in the store yet are fetched from GitHub, along with the
+    stored issues and pull requests that changed since they were fetched.
+    """
+    kinds: tuple[SearchKind, ...] = ("issue", "pull-request", "commit")
+    if store is None:
+        searches = [(kind, lower_date, upper_date, None) for kind in kinds]
+        results = search_all(handle, searches, max_workers)
+        return [
+            decode_item(kind, item)
+            for (kind, *_), items in zip(searches, results)
+            for item in items
+        ]
+
+    viewer = auth_identity()
+    refreshes = [
+        (kind, lower, upper, fetched_at - REFRESH_MARGIN)
+        for kind in MUTABLE_KINDS
+        for lower, upper, fetched_at in store.covered_ranges(
+            viewer, handle, kind, lower_date, upper_date
+        )
+    ]
+    searches = [
+        (kind, lower, upper, None)
+        for kind in kinds
+        for lower, upper in store.missing_ranges(
+            viewer, handle, kind, lower_date, upper_date
+        )
+    ]
+    if refreshes or searches:
+        fetched_at = datetime.datetime.now(datetime.timezone.utc)
+        results = search_all(handle, refreshes + searches, max_workers)
+        for i, ((kind, lower, upper, updated_since), items) in enumerate(
+            zip(refreshes + searches, results)
+        ):
+            records = [
+                (
+                    item["url"],
+                    item_timestamp(kind, item),
+                    comment_to_record(decode_item(kind, item)),
+                )
+                for item in items
+            ]
+            if i < len(refreshes):
+                store.refresh(viewer, handle, kind, lower, upper, records, fetched_at)
+            else:
+                store.add(viewer, handle, kind, lower, upper, records, fetched_at)
+    return [
+        record_to_comment(dict(record, kind=kind))
+        for kind in kinds
+        for record in store.query(viewer, handle, kind, lower_date, upper_date)
+    ]
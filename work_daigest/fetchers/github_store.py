@@ -0,0 +1,277 @@
+import datetime
+import json
+import pathlib
+import sqlite3
+import threading
+
+from ..cache import default_cache_dir
+
+# Activity that happened shortly before a fetch may still change (e.g. an issue
+# that gets closed an hour later), so such time ranges are not marked as
+# covered and get fetched again next time.
+SETTLE_TIME = datetime.timedelta(days=1)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    viewer TEXT NOT NULL,
+    handle TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    item_id TEXT NOT NULL,
+    timestamp REAL NOT NULL,
+    record TEXT NOT NULL,
+    PRIMARY KEY (viewer, handle, kind, item_id)
+);
+CREATE INDEX IF NOT EXISTS items_by_time
+    ON items (viewer, handle, kind, timestamp);
+CREATE TABLE IF NOT EXISTS coverage (
+    viewer TEXT NOT NULL,
+    handle TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    lower REAL NOT NULL,
+    upper REAL NOT NULL,
+    fetched_at REAL NOT NULL
+);
+"""
+
+
+def to_timestamp(dt: datetime.datetime) -> float:
+    """
+    Convert a datetime to a POSIX timestamp, treating naive datetimes as UTC
+    like the GitHub fetcher does
+    """
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=datetime.timezone.utc)
+    return dt.timestamp()
+
+
+def from_timestamp(ts: float) -> datetime.datetime:
+    """
+    Inverse of `to_timestamp`, returning a naive datetime
+    """
+    return datetime.datetime.fromtimestamp(ts, datetime.timezone.utc).replace(
+        tzinfo=None
+    )
+
+
+class GitHubActivityStore:
+    """
+    Local SQLite store of GitHub search results.
+
+    Items are stored per viewer (a hash of the credentials used to fetch them,
+    since private repositories are only visible to some viewers), GitHub
+    handle and kind of search ("issue", "pull-request" or "commit"), together
+    with the timestamp the search filters on. The store also remembers which
+    time ranges have been fetched completely, and when, so that only missing
+    ranges need to be queried from GitHub, along with the items of covered
+    ranges that changed since they were fetched.
+    """
+
+    def __init__(self, path: pathlib.Path):
+        self.path = pathlib.Path(path)
+        self._lock = threading.Lock()
+        self._connection: sqlite3.Connection | None = None
+
+    def _connect(self) -> sqlite3.Connection:
+        # Must be called with `self._lock` held
+        if self._connection is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.executescript(SCHEMA)
+        return self._connection
+
+    def _coverage(
+        self, viewer: str, handle: str, kind: str
+    ) -> list[tuple[float, float, float]]:
+        rows = self._connect().execute(
+            "SELECT lower, upper, fetched_at FROM coverage"
+            " WHERE viewer = ? AND handle = ? AND kind = ? ORDER BY lower",
+            (viewer, handle, kind),
+        )
+        return list(rows)
+
+    def missing_ranges(
+        self,
+        viewer: str,
+        handle: str,
+        kind: str,
+        lower_date: datetime.datetime,
+        upper_date: datetime.datetime,
+    ) -> list[tuple[datetime.datetime, datetime.datetime]]:
+        """
+        Return the sub-ranges of `lower_date`..`upper_date` that have not been
+        fetched completely yet
+        """
+        lower, upper = to_timestamp(lower_date), to_timestamp(upper_date)
+        with self._lock:
+            coverage = self._coverage(viewer, handle, kind)
+        missing = []
+        current = lower
+        for covered_lower, covered_upper, _ in coverage:
+            if covered_upper < current:
+                continue
+            if covered_lower > upper:
+                break
+            if covered_lower > current:
+                missing.append((current, covered_lower))
+            current = max(current, covered_upper)
+        if current < upper:
+            missing.append((current, upper))
+        return [(from_timestamp(lo), from_timestamp(hi)) for lo, hi in missing]
+
+    def covered_ranges(
+        self,
+        viewer: str,
+        handle: str,
+        kind: str,
+        lower_date: datetime.datetime,
+        upper_date: datetime.datetime,
+    ) -> list[tuple[datetime.datetime, datetime.datetime, datetime.datetime]]:
+        """
+        Return the sub-ranges of `lower_date`..`upper_date` that have been
+        fetched completely, each with the time it was last fetched. Items
+        that changed since (e.g. issues that were closed) are outdated in the
+        store until they are fetched again with `refresh`.
+        """
+        lower, upper = to_timestamp(lower_date), to_timestamp(upper_date)
+        with self._lock:
+            coverage = self._coverage(viewer, handle, kind)
+        return [
+            (
+                from_timestamp(max(lower, covered_lower)),
+                from_timestamp(min(upper, covered_upper)),
+                from_timestamp(fetched_at),
+            )
+            for covered_lower, covered_upper, fetched_at in coverage
+            if covered_lower < upper and covered_upper > lower
+        ]
+
+    def _put_items(
+        self,
+        connection: sqlite3.Connection,
+        viewer: str,
+        handle: str,
+        kind: str,
+        items: list[tuple[str, datetime.datetime, dict]],
+    ) -> None:
+        connection.executemany(
+            "INSERT OR REPLACE INTO items VALUES (?, ?, ?, ?, ?, ?)",
+            [
+                (viewer, handle, kind, item_id, to_timestamp(ts), json.dumps(r))
+                for item_id, ts, r in items
+            ],
+        )
+
+    def add(
+        self,
+        viewer: str,
+        handle: str,
+        kind: str,
+        lower_date: datetime.datetime,
+        upper_date: datetime.datetime,
+        items: list[tuple[str, datetime.datetime, dict]],
+        fetched_at: datetime.datetime,
+    ) -> None:
+        """
+        Store the complete results of a search over `lower_date`..`upper_date`
+
+        :param items: Tuples of item ID, the timestamp the search filters on
+          and the JSON-serializable record to store.
+        :param fetched_at: When the search was run; the part of the range after
+          `fetched_at - SETTLE_TIME` is not marked as covered.
+        """
+        lower = to_timestamp(lower_date)
+        upper = min(to_timestamp(upper_date), to_timestamp(fetched_at - SETTLE_TIME))
+        fetched = to_timestamp(fetched_at)
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                self._put_items(connection, viewer, handle, kind, items)
+                if lower >= upper:
+                    return
+                # Merge the new range with all ranges it overlaps or touches,
+                # so the coverage table stays a set of disjoint ranges. The
+                # merged range is as outdated as its oldest part.
+                coverage = self._coverage(viewer, handle, kind)
+                for covered_lower, covered_upper, covered_fetched in coverage:
+                    if covered_upper >= lower and covered_lower <= upper:
+                        lower = min(lower, covered_lower)
+                        upper = max(upper, covered_upper)
+                        fetched = min(fetched, covered_fetched)
+                connection.execute(
+                    "DELETE FROM coverage"
+                    " WHERE viewer = ? AND handle = ? AND kind = ?"
+                    " AND upper >= ? AND lower <= ?",
+                    (viewer, handle, kind, lower, upper),
+                )
+                connection.execute(
+                    "INSERT INTO coverage VALUES (?, ?, ?, ?, ?, ?)",
+                    (viewer, handle, kind, lower, upper, fetched),
+                )
+
+    def refresh(
+        self,
+        viewer: str,
+        handle: str,
+        kind: str,
+        lower_date: datetime.datetime,
+        upper_date: datetime.datetime,
+        items: list[tuple[str, datetime.datetime, dict]],
+        fetched_at: datetime.datetime,
+    ) -> None:
+        """
+        Store the items of the covered range `lower_date`..`upper_date` that
+        changed since it was last fetched, replacing their outdated records
+
+        :param items: As for `add`.
+        :param fetched_at: When the search for changed items was run. Covered
+          ranges lying completely within `lower_date`..`upper_date` are up to
+          date as of then.
+        """
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                self._put_items(connection, viewer, handle, kind, items)
+                connection.execute(
+                    "UPDATE coverage SET fetched_at = max(fetched_at, ?)"
+                    " WHERE viewer = ? AND handle = ? AND kind = ?"
+                    " AND lower >= ? AND upper <= ?",
+                    (
+                        to_timestamp(fetched_at),
+                        viewer,
+                        handle,
+                        kind,
+                        to_timestamp(lower_date),
+                        to_timestamp(upper_date),
+                    ),
+                )
+
+    def query(
+        self,
+        viewer: str,
+        handle: str,
+        kind: str,
+        lower_date: datetime.datetime,
+        upper_date: datetime.datetime,
+    ) -> list[dict]:
+        """
+        Return the records of all stored items whose timestamp lies within
+        `lower_date`..`upper_date`, oldest first
+        """
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT record FROM items"
+                " WHERE viewer = ? AND handle = ? AND kind = ?"
+                " AND timestamp >= ? AND timestamp <= ? ORDER BY timestamp",
+                (
+                    viewer,
+                    handle,
+                    kind,
+                    to_timestamp(lower_date),
+                    to_timestamp(upper_date),
+                ),
+            )
+            return [json.loads(record) for (record,) in rows]
+
+
+def default_store() -> GitHubActivityStore:
+    return GitHubActivityStore(default_cache_dir() / "github-activity.sqlite3")
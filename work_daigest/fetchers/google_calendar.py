@@ -1,7 +1,109 @@
+import datetime
 import re
-from datetime import datetime
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING
 
-from ics import Calendar
+import dateutil.tz
+
+from ..profiling import traced
+
+if TYPE_CHECKING:
+    from ics import Calendar
+
+
+@dataclass
+class Attendee:
+    email: str | None
+    partstat: str | None
+    common_name: str | None
+
+
+@dataclass
+class CalendarEvent:
+    """
+    The parts of an `ics.Event` that end up in the prompt. The attribute names
+    match those of `ics.Event`, so either can be passed to `format_event`.
+    """
+
+    begin: datetime.datetime
+    end: datetime.datetime
+    name: str | None
+    duration: datetime.timedelta | None
+    description: str | None
+    attendees: list[Attendee]
+    # Recurrence information, see RFC 5545, section 3.8.5. `tzid` is the time
+    # zone the recurrence rule is evaluated in.
+    uid: str | None = None
+    tzid: str | None = None
+    rrule: str | None = None
+    exdates: list[datetime.datetime] = field(default_factory=list)
+    recurrence_id: datetime.datetime | None = None
+
+
+def tz_name(tz: datetime.tzinfo | None) -> str | None:
+    """
+    Return the IANA name of a time zone returned by `dateutil.tz.gettz`
+    (which is what `ics` uses to resolve TZID parameters), if it has one
+    """
+    # `dateutil` doesn't expose the name, but it does keep the zoneinfo file
+    # name around, e.g. "/usr/share/zoneinfo/Europe/Paris".
+    filename = getattr(tz, "_filename", None)
+    if not isinstance(filename, str):
+        return None
+    return filename.split("zoneinfo/")[-1]
+
+
+def parse_date_times(
+    value: str, params: dict[str, list[str]], default_tz: datetime.tzinfo
+) -> list[datetime.datetime]:
+    """
+    Parse the comma-separated dates or date-times of an EXDATE or
+    RECURRENCE-ID property
+    """
+    tz = default_tz
+    if tzids := params.get("TZID"):
+        tz = dateutil.tz.gettz(tzids[0]) or default_tz
+    date_times = []
+    for item in value.split(","):
+        item = item.strip()
+        if "T" not in item:
+            dt = datetime.datetime.strptime(item, "%Y%m%d").replace(tzinfo=tz)
+        elif item.endswith("Z"):
+            dt = datetime.datetime.strptime(item, "%Y%m%dT%H%M%SZ").replace(
+                tzinfo=datetime.timezone.utc
+            )
+        else:
+            dt = datetime.datetime.strptime(item, "%Y%m%dT%H%M%S").replace(tzinfo=tz)
+        date_times.append(dt)
+    return date_times
+
+
+def to_calendar_event(e) -> CalendarEvent:
+    begin = e.begin.datetime
+    rrule = None
+    exdates = []
+    recurrence_id = None
+    # `ics` doesn't support recurrences, but keeps the properties around
+    for line in e.extra:
+        if line.name == "RRULE":
+            rrule = line.value
+        elif line.name == "EXDATE":
+            exdates.extend(parse_date_times(line.value, line.params, begin.tzinfo))
+        elif line.name == "RECURRENCE-ID":
+            recurrence_id = parse_date_times(line.value, line.params, begin.tzinfo)[0]
+    return CalendarEvent(
+        begin,
+        e.end.datetime,
+        e.name,
+        e.duration,
+        e.description,
+        [Attendee(att.email, att.partstat, att.common_name) for att in e.attendees],
+        e.uid,
+        tz_name(begin.tzinfo),
+        rrule,
+        exdates,
+        recurrence_id,
+    )
 
 
 def remove_text_pattern(description):
@@ -10,32 +112,36 @@ def remove_text_pattern(description):
     return re.sub(pattern, "", description)
 
 
-def filter_events(calendar: Calendar, start: datetime, end: datetime, email):
-    events = calendar.events
-    events = [e for e in events if e.begin >= start and e.end <= end]
-    all_events = []
-    is_valid_attendee = lambda att: att.email == email and (
-        att.partstat not in ("DECLINED", "NEEDS-ACTION")
+def is_attended_by(e, email) -> bool:
+    return any(
+        att.email == email and att.partstat not in ("DECLINED", "NEEDS-ACTION")
+        for att in e.attendees
     )
 
-    for e in events:
-        event_text = []
-        if not any(map(is_valid_attendee, e.attendees)):
-            continue
 
-        event_text.append(e.name)
+def format_event(e) -> str:
+    event_text = []
+    event_text.append(e.name)
+
+    event_text.append(f"duration: {e.duration}")
+
+    if desc := e.description:
+        desc = remove_text_pattern(desc)
+        event_text.append(f"description: {desc}")
 
-        event_text.append(f"duration: {e.duration}")
+    if e.attendees:
+        event_text.append("attendees:")
+    for att in e.attendees:
+        event_text.append(f"  - {att.common_name}")
 
-        if desc := e.description:
-            desc = remove_text_pattern(desc)
-            event_text.append(f"description: {desc}")
+    event_text.append("-------------------")
+    return "\n".join(event_text)
 
-        if e.attendees:
-            event_text.append("attendees:")
-        for att in e.attendees:
-            event_text.append(f"  - {att.common_name}")
 
-        event_text.append("-------------------")
-        all_events.append("\n".join(event_text))
-    return all_events
+@traced("calendar.filter")
+def filter_events(
+    calendar: "Calendar", start: datetime.datetime, end: datetime.datetime, email
+):
+    events = calendar.events
+    events = [e for e in events if e.begin >= start and e.end <= end]
+    return [format_event(e) for e in events if is_attended_by(e, email)]
@@ -0,0 +1,243 @@
+import datetime
+import re
+from typing import TYPE_CHECKING, Callable, Iterable, Iterator, TextIO
+
+from ..profiling import traced
+from .calendar_index import EventTable
+from .google_calendar import CalendarEvent, format_event
+
+if TYPE_CHECKING:
+    from ics import Calendar
+
+# Offsets of real-world time zones lie within UTC-12 and UTC+14, so a local
+# time is at most this far from the same wall clock time in UTC.
+MAX_UTC_OFFSET = datetime.timedelta(hours=14)
+
+DATE_TIME_PATTERN = re.compile(r"(\d{8})(?:T(\d{6})(Z?))?$")
+
+
+def unfold_lines(lines: Iterable[str]) -> Iterator[str]:
+    """
+    Join folded content lines: a line starting with a space or a tab continues
+    the previous line (RFC 5545, section 3.1)
+    """
+    current = None
+    for line in lines:
+        line = line.rstrip("\r\n")
+        if line[:1] in (" ", "\t"):
+            if current is not None:
+                current += line[1:]
+            continue
+        if current is not None:
+            yield current
+        current = line
+    if current:
+        yield current
+
+
+def split_property(line: str) -> tuple[str, dict[str, str], str]:
+    """
+    Split a content line into its name, parameters and value
+    """
+    # The value starts after the first colon that is not within a quoted
+    # parameter value (e.g. `CN="Doe: John"`).
+    in_quotes = False
+    for i, char in enumerate(line):
+        if char == '"':
+            in_quotes = not in_quotes
+        elif char == ":" and not in_quotes:
+            head, value = line[:i], line[i + 1 :]
+            break
+    else:
+        head, value = line, ""
+    name, *raw_params = head.split(";")
+    params = {}
+    for param in raw_params:
+        key, _, param_value = param.partition("=")
+        params[key] = param_value.strip('"')
+    return name, params, value
+
+
+def iter_components(
+    lines: Iterable[str],
+) -> Iterator[tuple[str, list[str]]]:
+    """
+    Yield the top-level components of a calendar, one at a time, as the
+    component name and its (unfolded) content lines. Calendar properties
+    outside of any component are yielded with the name "VCALENDAR", one line
+    at a time.
+    """
+    component = None
+    depth = 0
+    for line in unfold_lines(lines):
+        if depth == 0:
+            if line.startswith("BEGIN:") and line != "BEGIN:VCALENDAR":
+                component = [line]
+                depth = 1
+            elif line not in ("BEGIN:VCALENDAR", "END:VCALENDAR") and line:
+                yield "VCALENDAR", [line]
+            continue
+        component.append(line)
+        if line.startswith("BEGIN:"):
+            depth += 1
+        elif line.startswith("END:"):
+            depth -= 1
+            if depth == 0:
+                yield component[0].removeprefix("BEGIN:"), component
+                component = None
+
+
+def parse_date_time(
+    value: str, params: dict[str, str]
+) -> tuple[datetime.datetime, datetime.datetime] | None:
+    """
+    Return bounds on the UTC time of a DTSTART/DTEND value, or `None` if the
+    value can't be parsed. Values in UTC are exact, whereas values in a named
+    time zone, floating times and dates can be anywhere within
+    `MAX_UTC_OFFSET` of the wall clock time.
+    """
+    match = DATE_TIME_PATTERN.match(value.strip())
+    if match is None:
+        return None
+    date, time, utc = match.groups()
+    try:
+        dt = datetime.datetime.strptime(date + (time or "000000"), "%Y%m%d%H%M%S")
+    except ValueError:
+        return None
+    dt = dt.replace(tzinfo=datetime.timezone.utc)
+    if utc and "TZID" not in params:
+        return dt, dt
+    return dt - MAX_UTC_OFFSET, dt + MAX_UTC_OFFSET
+
+
+def may_match(
+    event_lines: list[str],
+    start: datetime.datetime,
+    end: datetime.datetime,
+    email: str,
+) -> bool:
+    """
+    Cheaply check whether an event may be needed to answer a query for the
+    events attended by `email` within `start`..`end`, looking only at a few
+    of its properties. This errs on the side of caution: it only returns
+    `False` for events that surely don't contribute to the result.
+    """
+    attends = False
+    outside_range = False
+    recurring = False
+    depth = 0
+    for line in event_lines[1:-1]:
+        # Skip nested components (e.g. VALARM), which have their own properties
+        if line.startswith("BEGIN:"):
+            depth += 1
+        elif line.startswith("END:"):
+            depth -= 1
+        if depth > 0 or line.startswith("END:"):
+            continue
+        name, params, value = split_property(line)
+        if name == "DTSTART":
+            bounds = parse_date_time(value, params)
+            if bounds is not None and bounds[1] < start:
+                outside_range = True
+        elif name == "DTEND":
+            bounds = parse_date_time(value, params)
+            if bounds is not None and bounds[0] > end:
+                outside_range = True
+        elif name == "RRULE":
+            # Later occurrences of the series may still fall within the range
+            recurring = True
+        elif name == "RECURRENCE-ID":
+            # A moved occurrence of a recurring series, which replaces the
+            # original one
+            return True
+        elif name == "ATTENDEE" and email in value:
+            if params.get("PARTSTAT") not in ("DECLINED", "NEEDS-ACTION"):
+                attends = True
+    return attends and (recurring or not outside_range)
+
+
+# Number of events parsed by `ics` at once when parsing a calendar in chunks
+CHUNK_SIZE = 1000
+
+
+def parse_in_chunks(
+    cal_file: TextIO,
+    keep_event: Callable[[list[str]], bool] = lambda lines: True,
+    chunk_size: int = CHUNK_SIZE,
+) -> Iterator["Calendar"]:
+    """
+    Read a calendar one component at a time and parse the events for which
+    `keep_event` returns `True`, `chunk_size` events at a time. Each chunk is
+    returned as a separate `Calendar` that also contains all time zone
+    definitions seen so far, which its events may refer to.
+    """
+    # Deferred so that `--help` and cached runs don't wait for `ics` to load
+    from ics import Calendar
+
+    calendar_lines = []
+    timezone_lines = []
+    event_lines = []
+    num_events = 0
+
+    def make_calendar():
+        return Calendar(
+            "\r\n".join(
+                [
+                    "BEGIN:VCALENDAR",
+                    *calendar_lines,
+                    *timezone_lines,
+                    *event_lines,
+                    "END:VCALENDAR",
+                ]
+            )
+        )
+
+    for name, lines in iter_components(cal_file):
+        if name == "VCALENDAR":
+            calendar_lines.extend(lines)
+        elif name == "VTIMEZONE":
+            timezone_lines.extend(lines)
+        elif name == "VEVENT" and keep_event(lines):
+            event_lines.extend(lines)
+            num_events += 1
+            if num_events == chunk_size:
+                yield make_calendar()
+                event_lines = []
+                num_events = 0
+
+    if num_events:
+        yield make_calendar()
+
+
+@traced("calendar.stream_parse")
+def stream_query_events(
+    cal_file: TextIO,
+    start: datetime.datetime,
+    end: datetime.datetime,
+    email: str,
+) -> list[CalendarEvent]:
+    """
+    Streaming equivalent of building an `EventTable` of the whole calendar
+    and querying its events.
+
+    The calendar is read one component at a time, and events that clearly
+    fall outside of the date range or are not attended by `email` are dropped
+    before they are parsed. Only the remaining events are parsed, a chunk at a
+    time, and kept in memory.
+    """
+    calendars = parse_in_chunks(
+        cal_file, lambda lines: may_match(lines, start, end, email)
+    )
+    return EventTable.from_calendars(calendars).query_events(start, end, email)
+
+
+def stream_filter_events(
+    cal_file: TextIO,
+    start: datetime.datetime,
+    end: datetime.datetime,
+    email: str,
+) -> list[str]:
+    """
+    Like `stream_query_events`, but return the events formatted for the prompt
+    """
+    return [format_event(e) for e in stream_query_events(cal_file, start, end, email)]
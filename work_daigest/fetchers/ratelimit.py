@@ -0,0 +1,263 @@
+"""
+Scheduling of GitHub API requests within GitHub's rate limits
+
+GitHub allows a number of requests per time window and per resource (e.g.
+30 search requests per minute), and reports in the headers of every response
+how many requests are left in the current window and when it resets. All
+requests to the same resource in the process go through one `RateLimiter`, a
+token bucket holding as many tokens as requests are left, which is refilled
+when the window resets. Concurrent fetches thus use up the whole allowance
+without ever exceeding it, and when GitHub rejects requests anyway (e.g.
+because of another process using the same token, or because of a secondary
+rate limit), they all pause for as long as GitHub asks.
+"""
+
+import datetime
+import email.utils
+import logging
+import math
+import threading
+import time
+from typing import TYPE_CHECKING, Callable
+
+from ..profiling import annotate
+
+if TYPE_CHECKING:
+    import requests
+
+logger = logging.getLogger(__name__)
+
+# Added to waits for the rate limit window to reset, since the reset time is
+# given in whole seconds and clocks may be skewed
+RESET_MARGIN = 1.0
+# Initial wait after a secondary rate limit was hit without GitHub saying for
+# how long to wait. GitHub asks to wait at least a minute, and longer after
+# each new violation.
+SECONDARY_BACKOFF = 60.0
+MAX_SECONDARY_BACKOFF = 15 * 60.0
+# Number of times a rejected request is retried after waiting
+MAX_RATE_LIMIT_RETRIES = 5
+
+
+def resource_for_url(url: str) -> str:
+    """
+    Name of the rate limit resource that requests to `url` count against
+    """
+    if url.endswith("/graphql"):
+        return "graphql"
+    if "/search/" in url:
+        return "search"
+    return "core"
+
+
+def retry_after(response: "requests.Response") -> float | None:
+    """
+    Delay (in seconds) asked for by the Retry-After header of a response,
+    given either as a number of seconds or as an HTTP date
+
+    :return: None if there is no such header or it can't be parsed.
+    """
+    value = response.headers.get("retry-after")
+    if value is None:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            date = email.utils.parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        if date.tzinfo is None:
+            date = date.replace(tzinfo=datetime.timezone.utc)
+        now = datetime.datetime.now(datetime.timezone.utc)
+        seconds = (date - now).total_seconds()
+    return max(seconds, 0.0) if math.isfinite(seconds) else None
+
+
+def is_rate_limited(response: "requests.Response") -> bool:
+    """
+    Whether GitHub rejected a request because of a primary or secondary rate
+    limit. Other 403 responses (e.g. for missing permissions) are not.
+    """
+    if response.status_code == 429:
+        return True
+    if response.status_code != 403:
+        return False
+    return (
+        response.headers.get("x-ratelimit-remaining") == "0"
+        or "retry-after" in response.headers
+        or "rate limit" in response.text.lower()
+    )
+
+
+class RateLimiter:
+    def __init__(self, resource: str):
+        """
+        :param resource: Name of the rate limit resource, as in the
+          "X-RateLimit-Resource" header.
+        """
+        self.resource = resource
+        # Total time (in seconds) requests waited for the rate limit
+        self.waited = 0.0
+        self._condition = threading.Condition()
+        # Requests allowed per window, requests left in the current window
+        # (not counting requests in flight) and time (since the epoch) at
+        # which the window resets, once known from a response
+        self._limit: int | None = None
+        self._remaining: int | None = None
+        self._reset: float | None = None
+        self._blocked_until = 0.0
+        self._backoff = SECONDARY_BACKOFF
+        self._in_flight = 0
+        # Until the first response tells whether limits apply at all (some
+        # servers don't report any), only one request is sent at a time
+        self._probing = True
+
+    def _next_wait(self, now: float) -> float | None:
+        """
+        Time to wait before a request can be sent (0 if it can be sent right
+        away), or None to wait until another request completes
+        """
+        if now < self._blocked_until:
+            return self._blocked_until - now
+        if self._reset is not None and now >= self._reset + RESET_MARGIN:
+            # A new window started, with a full bucket
+            self._remaining = self._limit - self._in_flight
+            self._reset = None
+        if self._probing:
+            return 0.0 if self._in_flight == 0 else None
+        if self._remaining is None or self._remaining > 0:
+            return 0.0
+        if self._reset is None:
+            # The window reset, but no response since then reported the limits
+            # (e.g. failed requests, or errors from a proxy). Requests are
+            # sent one at a time until one does, rather than waiting for a
+            # request to complete when none is in flight.
+            return 0.0 if self._in_flight == 0 else None
+        return self._reset + RESET_MARGIN - now
+
+    def acquire(self) -> float:
+        """
+        Wait until a request can be sent, and take a token for it
+
+        :return: Time waited, in seconds.
+        """
+        start = time.monotonic()
+        waited = 0.0
+        with self._condition:
+            while (wait := self._next_wait(time.time())) != 0.0:
+                self._condition.wait(wait)
+                waited = time.monotonic() - start
+            self._in_flight += 1
+            if self._remaining is not None:
+                self._remaining -= 1
+            self.waited += waited
+        return waited
+
+    def release(self, response: "requests.Response | None") -> None:
+        """
+        Update the limits from the headers of the `response` to a request,
+        which is None if the request failed
+        """
+        with self._condition:
+            self._in_flight -= 1
+            if response is not None:
+                self._update(response)
+            elif self._remaining is not None:
+                # The request most likely never reached GitHub, so its token
+                # is given back
+                self._remaining += 1
+            self._condition.notify_all()
+
+    def _update(self, response: "requests.Response") -> None:
+        self._probing = False
+        now = time.time()
+        headers = response.headers
+        if "x-ratelimit-remaining" in headers and "x-ratelimit-reset" in headers:
+            remaining = int(headers["x-ratelimit-remaining"])
+            reset = float(headers["x-ratelimit-reset"])
+            self._limit = int(headers.get("x-ratelimit-limit", remaining))
+            if reset != self._reset:
+                # First response of a new window. Requests in flight may not
+                # have been counted yet.
+                self._remaining = remaining - self._in_flight
+                self._reset = reset
+            else:
+                # Responses can arrive out of order, so never add tokens back
+                self._remaining = min(self._remaining, remaining)
+
+        if not is_rate_limited(response):
+            self._backoff = SECONDARY_BACKOFF
+            return
+        if (delay := retry_after(response)) is not None:
+            until = now + delay
+        elif headers.get("x-ratelimit-remaining") == "0" and self._reset is not None:
+            until = self._reset + RESET_MARGIN
+        else:
+            until = now + self._backoff
+            self._backoff = min(self._backoff * 2, MAX_SECONDARY_BACKOFF)
+        self._blocked_until = max(self._blocked_until, until)
+        logger.warning(
+            f"GitHub {self.resource} rate limit hit, pausing requests for {until - now:.0f}s"
+        )
+
+
+_rate_limiters: dict[str, RateLimiter] = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(resource: str) -> RateLimiter:
+    """
+    Return the process-wide rate limiter of a rate limit resource
+    """
+    with _rate_limiters_lock:
+        if resource not in _rate_limiters:
+            _rate_limiters[resource] = RateLimiter(resource)
+        return _rate_limiters[resource]
+
+
+def format_rate_limit_waits() -> str | None:
+    """
+    Describe how long requests of the process waited for each rate limit
+    resource, or return None if they never waited
+    """
+    with _rate_limiters_lock:
+        waits = {
+            resource: limiter.waited
+            for resource, limiter in _rate_limiters.items()
+            if limiter.waited
+        }
+    if not waits:
+        return None
+    details = ", ".join(f"{resource}: {s:.1f}s" for resource, s in waits.items())
+    return (
+        f"GitHub requests waited {sum(waits.values()):.1f}s in total for rate"
+        f" limits ({details})"
+    )
+
+
+def send_request(
+    url: str, request: Callable[[], "requests.Response"]
+) -> "requests.Response":
+    """
+    Send a request to `url` with `request` once the rate limit allows it, and
+    send it again (up to `MAX_RATE_LIMIT_RETRIES` times) whenever GitHub
+    rejects it because of a rate limit
+
+    :return: The last response, which is a rejection if all retries were
+      rejected too.
+    """
+    limiter = get_rate_limiter(resource_for_url(url))
+    waited = 0.0
+    for _ in range(MAX_RATE_LIMIT_RETRIES + 1):
+        waited += limiter.acquire()
+        response = None
+        try:
+            response = request()
+        finally:
+            limiter.release(response)
+        if not is_rate_limited(response):
+            break
+    if waited:
+        annotate(rate_limit_wait_seconds=waited)
+    return response
@@ -0,0 +1,249 @@
+"""
+Hedged model invocations, to bound the latency of slow invocations
+
+An invocation is first sent along the primary path (the chosen model in the
+configured regions). If it hasn't answered after a delay, a backup request is
+sent along a second path (another model or region), and whichever answers
+first wins. Only invocations slower than the delay cost an extra request, so
+choosing a delay around the usual p95 latency bounds the tail latency for a
+few percent more requests.
+
+Bedrock invocations can't be cancelled, so the losing request keeps running
+until the model answers. Such requests aren't covered by the callers' limits
+on concurrent invocations, so the number of backup requests outstanding at
+once (until both requests of their invocation finished) is capped.
+"""
+
+import contextvars
+import logging
+import math
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable
+
+from .profiling import annotate, in_current_context, traced
+
+logger = logging.getLogger(__name__)
+
+# Latency percentiles reported in summaries
+REPORTED_PERCENTILES = (50, 90, 99)
+# Default largest number of backup requests outstanding at once
+DEFAULT_MAX_BACKUPS = 4
+
+
+@dataclass
+class HedgeConfig:
+    # Time (in seconds) to wait for the primary path before sending the backup
+    # request
+    delay: float
+    # Model choice and region of the backup path. Each defaults to the one of
+    # the primary path.
+    model: str | None = None
+    region: str | None = None
+    # Largest number of backup requests outstanding at once in the process.
+    # Slow invocations wait for the primary path alone while none is left.
+    max_backups: int = DEFAULT_MAX_BACKUPS
+
+
+@dataclass
+class HedgePath:
+    # Name of the path in statistics, e.g. "claude3@us-west-2"
+    label: str
+    # Function invoking the model with a `prompt` keyword argument
+    model_fn: Callable[..., str]
+    # Model choice the path invokes, reported by `invoke_reporting_model`
+    model: str | None = None
+
+
+# Model choice of the path that won the last hedged invocation of the current
+# context
+_answering_model: contextvars.ContextVar[str | None] = contextvars.ContextVar(
+    "answering_model", default=None
+)
+
+
+def invoke_reporting_model(
+    model_fn: Callable[..., str], default_model: str, **kwargs
+) -> tuple[str, str]:
+    """
+    Invoke `model_fn`, which may be hedged
+
+    :param default_model: Model choice `model_fn` invokes if it isn't hedged.
+    :return: The answer, and the model choice that gave it.
+    """
+    token = _answering_model.set(None)
+    try:
+        answer = model_fn(**kwargs)
+        return answer, _answering_model.get() or default_model
+    finally:
+        _answering_model.reset(token)
+
+
+def percentile(values: list[float], q: float) -> float:
+    """
+    Nearest-rank percentile `q` (between 0 and 100) of non-empty `values`
+    """
+    ordered = sorted(values)
+    rank = max(math.ceil(q / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+class HedgeStats:
+    """
+    Outcome of the hedged invocations of a process: which path won each of
+    them, how long they took and how many needed a backup request
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latencies: list[float] = []
+        self._wins: dict[str, int] = {}
+        self._backups = 0
+
+    def record(self, winner: str, latency: float, backup_sent: bool) -> None:
+        with self._lock:
+            self._latencies.append(latency)
+            self._wins[winner] = self._wins.get(winner, 0) + 1
+            self._backups += backup_sent
+
+    def summary(self) -> dict:
+        """
+        :return: Number of invocations and backup requests, wins per path and
+          latency percentiles (in seconds).
+        """
+        with self._lock:
+            latencies = list(self._latencies)
+            summary = {
+                "invocations": len(latencies),
+                "backup_requests": self._backups,
+                "wins": dict(self._wins),
+            }
+        if latencies:
+            summary["latency"] = {
+                f"p{q}": round(percentile(latencies, q), 3)
+                for q in REPORTED_PERCENTILES
+            }
+        return summary
+
+    def format_summary(self) -> str:
+        summary = self.summary()
+        wins = ", ".join(f"{label}: {n}" for label, n in summary["wins"].items())
+        text = (
+            f"Hedged {summary['invocations']} model invocation(s)"
+            f" with {summary['backup_requests']} backup request(s)"
+        )
+        if wins:
+            text += f", wins by {wins}"
+        if latency := summary.get("latency"):
+            text += ", latency " + " ".join(
+                f"{q}={seconds:.2f}s" for q, seconds in latency.items()
+            )
+        return text
+
+
+# Statistics of all hedged invocations of the process
+hedge_stats = HedgeStats()
+
+_backup_slots: dict[int, threading.Semaphore] = {}
+_backup_slots_lock = threading.Lock()
+
+
+def get_backup_slots(max_backups: int) -> threading.Semaphore:
+    """
+    Return the process-wide slots for outstanding backup requests shared by
+    all hedged functions allowing `max_backups` of them
+    """
+    with _backup_slots_lock:
+        if max_backups not in _backup_slots:
+            _backup_slots[max_backups] = threading.Semaphore(max_backups)
+        return _backup_slots[max_backups]
+
+
+def hedged(
+    primary: HedgePath,
+    backup: HedgePath,
+    delay: float,
+    stats: HedgeStats | None = None,
+    backup_slots: threading.Semaphore | None = None,
+) -> Callable[..., str]:
+    """
+    Return a function invoking the model along the `primary` path, and along
+    the `backup` path too if the primary path hasn't answered successfully
+    within `delay` seconds. The first successful answer is returned. If the
+    primary path fails before the delay, the backup request is sent right
+    away.
+
+    A backup request that wasn't sent yet when the primary path answers is
+    never sent, but a losing request in flight runs until the model answers,
+    and its answer is dropped. Requests run in daemon threads so that a
+    request in flight never delays exiting.
+
+    :param stats: Where to record the winner and latency of each invocation.
+      Defaults to the process-wide `hedge_stats`.
+    :param backup_slots: Slots for outstanding backup requests (see
+      `get_backup_slots`), each taken from sending a backup request until
+      both requests of the invocation finished. No backup request is sent
+      while none is free. None for no limit.
+    """
+    if stats is None:
+        stats = hedge_stats
+
+    @traced("bedrock.hedged")
+    def invoke(**kwargs) -> str:
+        start = time.monotonic()
+        condition = threading.Condition()
+        # Answers and errors of each path, in order of arrival. Both paths may
+        # have the same label, so they are told apart by their position.
+        answers: list[tuple[HedgePath, str]] = []
+        errors: list[tuple[HedgePath, Exception]] = []
+        backup_sent = False
+
+        def attempt(path: HedgePath):
+            try:
+                answer = path.model_fn(**kwargs)
+            except Exception as e:
+                outcome = errors, (path, e)
+            else:
+                outcome = answers, (path, answer)
+            with condition:
+                results, result = outcome
+                results.append(result)
+                if backup_sent and len(answers) + len(errors) == 2:
+                    # The loser finished too
+                    if backup_slots is not None:
+                        backup_slots.release()
+                condition.notify_all()
+
+        def send(path: HedgePath):
+            threading.Thread(
+                target=in_current_context(attempt), args=(path,), daemon=True
+            ).start()
+
+        send(primary)
+        with condition:
+            # Wait for an answer, for the primary path to fail or for the
+            # delay to pass, whichever comes first
+            condition.wait_for(lambda: answers or errors, timeout=max(delay, 0.0))
+            if not answers and (
+                backup_slots is None or backup_slots.acquire(blocking=False)
+            ):
+                backup_sent = True
+                logger.info(f"No answer from {primary.label}, trying {backup.label}")
+                send(backup)
+                condition.wait_for(lambda: answers or len(errors) == 2)
+            elif not answers:
+                logger.info(f"No backup request left, waiting for {primary.label}")
+                condition.wait_for(lambda: answers or errors)
+            if not answers:
+                # Both paths failed, so report the error of the primary path
+                raise next(e for path, e in errors if path is primary)
+            winner, answer = answers[0]
+
+        _answering_model.set(winner.model)
+        latency = time.monotonic() - start
+        stats.record(winner.label, latency, backup_sent)
+        annotate(winner=winner.label, backup_sent=backup_sent)
+        return answer
+
+    return invoke
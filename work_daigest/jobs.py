@@ -0,0 +1,127 @@
+import logging
+import threading
+import time
+from typing import Any, Callable, Literal
+
+from .progress import reporting
+
+logger = logging.getLogger(__name__)
+
+JobStatus = Literal["queued", "running", "done", "failed", "cancelled"]
+
+
+class JobCancelled(Exception):
+    """
+    Raised in a job's thread at its next progress report after it was
+    cancelled
+    """
+
+
+class Job:
+    def __init__(self, fn: Callable, *args, **kwargs):
+        """
+        Call `fn` with the given arguments in a background thread once the
+        job is started, or in the calling thread once it is run. Stages that
+        `fn` reports with `progress.report` are recorded in `stages`, and its
+        return value in `result`.
+        """
+        self.status: JobStatus = "queued"
+        self.result: Any = None
+        self.error: Exception | None = None
+        self.started_at: float | None = None
+        self.finished_at: float | None = None
+        self._fn = fn
+        self._args = args
+        self._kwargs = kwargs
+        # Number of reports and details of the latest report of each stage,
+        # in order of first report
+        self._stages: dict[str, tuple[int, dict]] = {}
+        self._lock = threading.Lock()
+        self._cancelled = threading.Event()
+        self._finished = threading.Event()
+
+    def start(self) -> "Job":
+        threading.Thread(target=self.run, daemon=True).start()
+        return self
+
+    def run(self):
+        """
+        Run the job in the calling thread, unless it was cancelled while
+        queued
+        """
+        with self._lock:
+            if self.status != "queued":
+                return
+            self.status = "running"
+            self.started_at = time.time()
+        try:
+            with reporting(self._report):
+                self.result = self._fn(*self._args, **self._kwargs)
+            self.status = "done"
+        except JobCancelled:
+            self.status = "cancelled"
+        except Exception as e:
+            logger.exception("Job failed")
+            self.error = e
+            self.status = "failed"
+        finally:
+            self._finish()
+
+    def _finish(self):
+        self.finished_at = time.time()
+        # Finished jobs may be kept around for their results, but their
+        # arguments aren't needed anymore
+        self._fn = self._args = self._kwargs = None
+        self._finished.set()
+
+    def _report(self, stage: str, details: dict):
+        self.check_cancelled()
+        with self._lock:
+            count, _ = self._stages.get(stage, (0, {}))
+            self._stages[stage] = (count + 1, details)
+
+    def check_cancelled(self):
+        """
+        Raise `JobCancelled` if the job was cancelled. Called on every
+        progress report, and can be called by the job itself in between.
+        """
+        if self._cancelled.is_set():
+            raise JobCancelled()
+
+    def cancel(self):
+        """
+        Ask the job to stop at its next progress report, or not to run at all
+        if it is still queued
+        """
+        self._cancelled.set()
+        with self._lock:
+            if self.status == "queued":
+                self.status = "cancelled"
+                self._finish()
+
+    @property
+    def running(self) -> bool:
+        """
+        Whether the job is queued or running, i.e. hasn't finished yet
+        """
+        return self.status in ("queued", "running")
+
+    @property
+    def stages(self) -> dict[str, tuple[int, dict]]:
+        with self._lock:
+            return dict(self._stages)
+
+    def wait(self, timeout: float | None = None) -> bool:
+        """
+        Wait for the job to finish
+
+        :return: Whether it finished within `timeout` seconds.
+        """
+        return self._finished.wait(timeout)
+
+
+def start_job(fn: Callable, *args, **kwargs) -> Job:
+    """
+    Run `fn` with the given arguments in a background job
+    """
+    return Job(fn, *args, **kwargs).start()
@@ -1,52 +1,77 @@
 import argparse
 import datetime
 import functools
+import io
 import json
 import pathlib
-from typing import List
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, Callable, List
 
 import pytz
-from ics import Calendar
-from streamlit.runtime.uploaded_file_manager import UploadedFile
 
-from .bedrock import init_client, invoke_claude3, invoke_jurassic2, invoke_llama2
-from .fetchers.github import fetch_comments
-from .fetchers.google_calendar import filter_events
-
-PROMPT_TEMPLATE = """
-    Human:
-    Summarize the events in the calendar and my work on GitHub and tell me what I did during the covered period of time.
-    Please mention the covered period of time ({lower_date} - {upper_date}) in your answer.
-    If the event has a description, include a summary.
-    Include attendees names.
-    If the event is lunch, do not include it.
-    For GitHub issues / pull requests / commits, don't include the full text / description / commit message,
-    but summarize it if it is longer than two sentences.
-
-    Calendar events:
-    ```
-    {calendar_data}
-    ```
-
-    These are GitHub issues, pull requests and commits I worked on, in a JSON format:
-    ```
-    {github_data}
-    ```
-
-    AI:
-    """
-
-
-def datetime_to_readable_date(dt: datetime.datetime) -> str:
-    return dt.strftime("%Y-%m-%d")
+from .bedrock import (
+    get_runtime_client,
+    invoke_claude3,
+    invoke_jurassic2,
+    invoke_llama2,
+    stream_claude3,
+    stream_jurassic2,
+    stream_llama2,
+)
+from .client import (
+    DEFAULT_SERVER,
+    POLL_INTERVAL,
+    DigestClient,
+    RemoteJob,
+    digest_request,
+)
+from .fetchers.calendar_cache import (
+    get_calendar_cache,
+    load_event_table,
+    set_calendar_cache,
+)
+from .fetchers.github import (
+    DEFAULT_GITHUB_BACKEND,
+    DEFAULT_MAX_WORKERS,
+    GITHUB_BACKENDS,
+    fetch_comments,
+    set_activity_store,
+    set_github_backend,
+    set_http_cache,
+)
+from .fetchers.google_calendar import CalendarEvent
+from .fetchers.ics_stream import stream_query_events
+from .fetchers.ratelimit import format_rate_limit_waits
+from .hedging import (
+    DEFAULT_MAX_BACKUPS,
+    HedgeConfig,
+    HedgePath,
+    get_backup_slots,
+    hedge_stats,
+    hedged,
+)
+from .profiling import (
+    annotate,
+    format_json,
+    format_text,
+    in_current_context,
+    profile,
+    traced,
+)
+from .progress import report
+from .prompt import build_prompt
+from .summarize import DEFAULT_MAX_MODEL_WORKERS, set_digest_store, summarize_map_reduce
 
 
+@traced("calendar.load")
 def munge_calendar_data(
-    cal_file: pathlib.PosixPath | UploadedFile,
+    cal_file: pathlib.Path | BinaryIO,
     min_date: datetime.datetime,
     max_date: datetime.datetime,
     email: str,
-) -> List[str]:
+) -> List[CalendarEvent]:
     """
     Munge calendar data to be used in the prompt template.
 
@@ -54,23 +79,37 @@ def munge_calendar_data(
     :param min_date: Minimum date to consider.
     :param max_date: Maximum date to consider.
     :param email: Email to filter calendar events.
-    :return: Munged calendar data.
+    :return: Events attended by `email`, ordered by their start time.
+
+    With the calendar cache, all attended events of the export are parsed
+    into memory the first time it is seen, so that later calls for any date
+    range skip parsing. Without it, the export is streamed and memory use is
+    bounded by the requested events.
     """
-    if isinstance(cal_file, UploadedFile):
-        file_content = cal_file.getvalue().decode("utf-8")
-    elif isinstance(cal_file, pathlib.PosixPath):
-        with open(cal_file, "r") as f:
-            file_content = f.read()
+    utc = pytz.UTC
+    min_date, max_date = utc.localize(min_date), utc.localize(max_date)
+    if isinstance(cal_file, pathlib.Path):
+        annotate(bytes=cal_file.stat().st_size)
+    elif hasattr(cal_file, "read"):
+        # Uploaded files are recognized by their methods so that the CLI
+        # doesn't need to import Streamlit
+        annotate(bytes=getattr(cal_file, "size", None))
     else:
         raise ValueError(f"Invalid file type: {type(cal_file)}")
-    calendar = Calendar(file_content)
 
-    utc = pytz.UTC
-    events = filter_events(
-        calendar, utc.localize(min_date), utc.localize(max_date), email
-    )
+    if (cache := get_calendar_cache()) is not None:
+        return load_event_table(cache, cal_file).query_events(min_date, max_date, email)
 
-    return events
+    if isinstance(cal_file, pathlib.Path):
+        with open(cal_file, "r") as f:
+            return stream_query_events(f, min_date, max_date, email)
+    cal_file.seek(0)
+    text_file = io.TextIOWrapper(cal_file, encoding="utf-8")
+    try:
+        return stream_query_events(text_file, min_date, max_date, email)
+    finally:
+        # Don't close the uploaded file along with the wrapper
+        text_file.detach()
 
 
 def munge_github_data(file_path: str) -> str:
@@ -96,15 +135,64 @@ def convert_to_datetime(datestr: str) -> datetime.datetime:
     return datetime.datetime.strptime(datestr, "%Y-%m-%d").replace(microsecond=1)
 
 
-def process_data(
-    calendar_file, github_handle, email, lower_date, upper_date, model_choice
-):
-    runtime_client = init_client("bedrock-runtime", "us-east-1")
-    model_functions = {
-        "jurassic2": functools.partial(invoke_jurassic2, client=runtime_client),
-        "llama2": functools.partial(invoke_llama2, client=runtime_client),
-        "claude3": functools.partial(invoke_claude3, client=runtime_client),
-    }
+def get_model_function(
+    model_choice: str,
+    stream: bool = False,
+    use_cache: bool = True,
+    runtime_client=None,
+    hedge: HedgeConfig | None = None,
+) -> Callable:
+    """
+    Return the function invoking the chosen model.
+
+    :param stream: Whether the function should yield the completion piece by
+      piece instead of returning it all at once.
+    :param use_cache: Whether the function may answer from (and add to) the
+      cache of model responses.
+    :param runtime_client: `bedrock-runtime` client to use. Defaults to the
+      shared client for the regions in `BEDROCK_REGIONS`.
+    :param hedge: Whether and how to send a backup request when the model is
+      slow to answer. Not supported with `stream`.
+    """
+    if runtime_client is None:
+        runtime_client = get_runtime_client()
+    if hedge is not None:
+        if stream:
+            raise ValueError("Hedged invocations can't be streamed")
+        backup_model = hedge.model or model_choice
+        backup_client = (
+            get_runtime_client([hedge.region]) if hedge.region else runtime_client
+        )
+        primary = HedgePath(
+            path_label(model_choice, runtime_client),
+            get_model_function(model_choice, False, use_cache, runtime_client),
+            model_choice,
+        )
+        backup = HedgePath(
+            path_label(backup_model, backup_client),
+            get_model_function(backup_model, False, use_cache, backup_client),
+            backup_model,
+        )
+        if backup.label == primary.label:
+            backup.label += " (backup)"
+        return hedged(
+            primary,
+            backup,
+            hedge.delay,
+            backup_slots=get_backup_slots(hedge.max_backups),
+        )
+    if stream:
+        model_functions = {
+            "jurassic2": stream_jurassic2,
+            "llama2": stream_llama2,
+            "claude3": stream_claude3,
+        }
+    else:
+        model_functions = {
+            "jurassic2": invoke_jurassic2,
+            "llama2": invoke_llama2,
+            "claude3": invoke_claude3,
+        }
 
     model_fn = model_functions.get(model_choice)
 
@@ -112,13 +200,216 @@ def process_data(
         raise ValueError(
             f"Invalid model choice: {model_choice}. Choose from {model_functions.keys()}."
         )
+    return functools.partial(model_fn, client=runtime_client, use_cache=use_cache)
+
 
-    calendar_data = munge_calendar_data(calendar_file, lower_date, upper_date, email)
-    github_data = fetch_comments(github_handle, lower_date, upper_date)
+def path_label(model_choice: str, runtime_client) -> str:
+    """
+    Name of a model and the regions it is invoked in, e.g. "claude3@us-east-1"
+    """
+    regions = getattr(runtime_client, "regions", None)
+    return f"{model_choice}@{','.join(regions)}" if regions else model_choice
+
+
+@traced("process_data")
+def process_data(
+    calendar_file,
+    github_handle,
+    email,
+    lower_date,
+    upper_date,
+    model_choice,
+    max_workers=DEFAULT_MAX_WORKERS,
+    stream=False,
+    use_cache=True,
+    runtime_client=None,
+    hedge=None,
+):
+    """
+    Fetch calendar and GitHub data and set up the model.
 
+    :param stream: Whether the returned model function should yield the
+      completion piece by piece instead of returning it all at once.
+    :param use_cache: Whether the model function may answer from (and add to)
+      the cache of model responses.
+    :param runtime_client: `bedrock-runtime` client to use. Defaults to the
+      shared client for the regions in `BEDROCK_REGIONS`.
+    :param hedge: Whether and how the model function should send a backup
+      request when the model is slow to answer.
+    :return: The model function, calendar data and GitHub data.
+    """
+    model_fn = get_model_function(
+        model_choice, stream, use_cache, runtime_client, hedge
+    )
+
+    # Parsing the calendar is local work while fetching GitHub data is mostly
+    # waiting on the network, so both run side by side.
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        calendar_future = executor.submit(
+            in_current_context(munge_calendar_data),
+            calendar_file,
+            lower_date,
+            upper_date,
+            email,
+        )
+        github_future = executor.submit(
+            in_current_context(fetch_comments),
+            github_handle,
+            lower_date,
+            upper_date,
+            max_workers,
+        )
+        calendar_data = calendar_future.result()
+        report("calendar", events=len(calendar_data))
+        github_data = github_future.result()
+        report("github", items=len(github_data))
+
+    annotate(calendar_events=len(calendar_data), github_items=len(github_data))
     return model_fn, calendar_data, github_data
 
 
+def add_hedge_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "--hedge-delay",
+        type=float,
+        help="Send a backup request when the model hasn't answered after this many seconds, and use whichever answer comes first. A delay around the usual 95th percentile latency bounds slow invocations for a few extra requests. The losing request can't be cancelled: it keeps running (and is billed) until the model answers, on top of the model workers. Not supported with --stream.",
+    )
+    parser.add_argument(
+        "--hedge-model",
+        type=str,
+        choices=["jurassic2", "llama2", "claude3"],
+        help="Model to send backup requests to. Defaults to the model of the summary.",
+    )
+    parser.add_argument(
+        "--hedge-region",
+        type=str,
+        help="AWS region to send backup requests to. Defaults to the regions in BEDROCK_REGIONS.",
+    )
+    parser.add_argument(
+        "--hedge-max-backups",
+        type=int,
+        default=DEFAULT_MAX_BACKUPS,
+        help=f"Largest number of backup requests outstanding at once, counting those whose invocation already got an answer from the other request. This bounds the model invocations running beyond the model workers. Slow invocations wait for their first request alone while none is left. Defaults to {DEFAULT_MAX_BACKUPS}.",
+    )
+
+
+def hedge_config(args: argparse.Namespace) -> HedgeConfig | None:
+    if args.hedge_delay is None:
+        return None
+    return HedgeConfig(
+        args.hedge_delay, args.hedge_model, args.hedge_region, args.hedge_max_backups
+    )
+
+
+def check_hedge_arguments(parser: argparse.ArgumentParser, args: argparse.Namespace):
+    if args.hedge_delay is None and (args.hedge_model or args.hedge_region):
+        parser.error("--hedge-model and --hedge-region require --hedge-delay")
+    if args.hedge_max_backups < 0:
+        parser.error("--hedge-max-backups must not be negative")
+
+
+def generate_summary(args: argparse.Namespace):
+    """
+    Generate a summary as specified by the command line arguments and print it
+    """
+    model_fn, calendar_data, github_data = process_data(
+        args.calendar_data,
+        args.github_handle,
+        args.email,
+        args.lower_date,
+        args.upper_date,
+        args.model,
+        args.max_workers,
+        args.stream,
+        not args.no_llm_cache,
+        hedge=hedge_config(args),
+    )
+    if waits := format_rate_limit_waits():
+        print(waits, file=sys.stderr)
+    if args.map_reduce:
+        summary = summarize_map_reduce(
+            model_fn,
+            functools.partial(
+                munge_calendar_data, args.calendar_data, email=args.email
+            ),
+            github_data,
+            args.lower_date,
+            args.upper_date,
+            args.model,
+            args.map_reduce,
+            args.max_model_workers,
+            args.email,
+            not args.no_llm_cache,
+        )
+    else:
+        prompt, compacted = build_prompt(
+            calendar_data,
+            github_data,
+            args.lower_date,
+            args.upper_date,
+            args.model,
+            args.email,
+        )
+        print(
+            f"Compacted prompt data from ~{compacted.tokens_before} to ~{compacted.tokens_after} tokens",
+            file=sys.stderr,
+        )
+        summary = model_fn(prompt=prompt)
+        if args.stream:
+            for text in summary:
+                print(text, end="", flush=True)
+            print()
+            return
+
+    print(summary)
+    if args.hedge_delay is not None:
+        print(hedge_stats.format_summary(), file=sys.stderr)
+
+
+def generate_summary_remotely(args: argparse.Namespace):
+    """
+    Have the digest server at `args.server` generate the summary specified by
+    the command line arguments and print it
+    """
+    client = DigestClient(args.server)
+    request = digest_request(
+        args.calendar_data.read_bytes(),
+        args.github_handle,
+        args.email,
+        args.lower_date,
+        args.upper_date,
+        args.model,
+        args.map_reduce,
+        args.max_model_workers,
+        not args.no_llm_cache,
+    )
+    job = RemoteJob(client, client.submit(request))
+    printed = 0
+    try:
+        if args.stream:
+            while job.running:
+                text = job.stages.get("inference", (0, {}))[1].get("text", "")
+                print(text[printed:], end="", flush=True)
+                printed = len(text)
+                time.sleep(POLL_INTERVAL)
+        else:
+            job.wait()
+    except KeyboardInterrupt:
+        job.cancel()
+        raise
+    if job.status != "done":
+        sys.exit(f"Couldn't generate the summary: {job.error or job.status}")
+
+    result = job.result
+    if result["tokens"] is not None and not printed:
+        before, after = result["tokens"]
+        print(
+            f"Compacted prompt data from ~{before} to ~{after} tokens",
+            file=sys.stderr,
+        )
+    print(result["summary"][printed:])
+
+
 def main():
     """
     Main program flow.
@@ -163,26 +454,107 @@ def main():
         default="claude3",
         help="Model to use for summary generation",
     )
-    args = parser.parse_args()
-
-    model_fn, calendar_data, github_data = process_data(
-        args.calendar_data,
-        args.github_handle,
-        args.email,
-        args.lower_date,
-        args.upper_date,
-        args.model,
+    parser.add_argument(
+        "--max-workers",
+        type=int,
+        default=DEFAULT_MAX_WORKERS,
+        help=f"Maximum number of concurrent GitHub API requests. Defaults to {DEFAULT_MAX_WORKERS}.",
     )
-    summary = model_fn(
-        prompt=PROMPT_TEMPLATE.format(
-            calendar_data="\n".join(calendar_data),
-            github_data=github_data,
-            lower_date=datetime_to_readable_date(args.lower_date),
-            upper_date=datetime_to_readable_date(args.upper_date),
-        )
+    parser.add_argument(
+        "--no-http-cache",
+        action="store_true",
+        help="Don't use or update the on-disk cache of GitHub API responses",
+    )
+    parser.add_argument(
+        "--no-activity-store",
+        action="store_true",
+        help="Fetch all GitHub data from GitHub instead of reusing previously fetched data",
+    )
+    parser.add_argument(
+        "--no-calendar-cache",
+        action="store_true",
+        help="Parse the calendar file instead of using a previously parsed copy. The file is then streamed, keeping only the requested events in memory, whereas the cache parses all attended events of the export into memory on a miss.",
+    )
+    parser.add_argument(
+        "--map-reduce",
+        type=str,
+        choices=["day", "week", "repository"],
+        help="Summarize the data in chunks (by day, by week or by repository) and combine the partial summaries. Useful for long periods of time. Summaries of days and weeks are stored and reused by later runs as long as their data doesn't change.",
+    )
+    parser.add_argument(
+        "--max-model-workers",
+        type=int,
+        default=DEFAULT_MAX_MODEL_WORKERS,
+        help=f"Maximum number of concurrent model invocations with --map-reduce. Defaults to {DEFAULT_MAX_MODEL_WORKERS}.",
+    )
+    parser.add_argument(
+        "--no-digest-store",
+        action="store_true",
+        help="Summarize all days or weeks with --map-reduce instead of reusing stored summaries of them",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Print the summary as it is being generated. Not supported with --map-reduce.",
     )
+    parser.add_argument(
+        "--no-llm-cache",
+        action="store_true",
+        help="Always invoke the model instead of reusing a cached response to the same prompt",
+    )
+    parser.add_argument(
+        "--profile",
+        type=str,
+        choices=["json", "text"],
+        help="Print the time spent in each stage, along with bytes transferred, item and token counts and peak memory use, to standard error",
+    )
+    parser.add_argument(
+        "--github-backend",
+        type=str,
+        choices=GITHUB_BACKENDS,
+        default=DEFAULT_GITHUB_BACKEND,
+        help="API to fetch GitHub data through. GraphQL needs fewer requests, but requires a token. Defaults to the GITHUB_BACKEND environment variable, or rest.",
+    )
+    add_hedge_arguments(parser)
+    parser.add_argument(
+        "--server",
+        type=str,
+        default=DEFAULT_SERVER,
+        help="Address of a digest server (started with work-daigest-server) to generate the summary on, such as http://127.0.0.1:8765 or unix:/path/to/socket. GitHub, cache and hedging options are then those of the server. Defaults to the WORK_DAIGEST_SERVER environment variable.",
+    )
+    args = parser.parse_args()
+    if args.stream and args.map_reduce:
+        parser.error("--stream can't be combined with --map-reduce")
+    if args.stream and args.hedge_delay is not None:
+        parser.error("--stream can't be combined with --hedge-delay")
+    check_hedge_arguments(parser, args)
+    if args.server:
+        if args.profile:
+            parser.error("--profile can't be combined with --server")
+        if args.hedge_delay is not None:
+            parser.error("--hedge-delay can't be combined with --server")
+        generate_summary_remotely(args)
+        return
 
-    print(summary)
+    set_github_backend(args.github_backend)
+    if args.no_http_cache:
+        set_http_cache(None)
+    if args.no_activity_store:
+        set_activity_store(None)
+    if args.no_calendar_cache:
+        set_calendar_cache(None)
+    if args.no_digest_store:
+        set_digest_store(None)
+
+    if args.profile:
+        with profile() as root:
+            generate_summary(args)
+        if args.profile == "json":
+            print(format_json(root), file=sys.stderr)
+        else:
+            print(format_text(root), file=sys.stderr)
+    else:
+        generate_summary(args)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,230 @@
+import contextlib
+import contextvars
+import functools
+import inspect
+import json
+import time
+import tracemalloc
+from dataclasses import dataclass, field
+from typing import Callable, Iterator
+
+# Width (in characters) of the bars of the text report
+BAR_WIDTH = 30
+
+
+@dataclass
+class Span:
+    name: str
+    start: float = field(default_factory=time.perf_counter)
+    duration: float | None = None
+    attributes: dict = field(default_factory=dict)
+    children: list["Span"] = field(default_factory=list)
+
+    def to_dict(self, origin: float | None = None) -> dict:
+        """
+        Convert the span and its children to JSON-compatible dicts, with start
+        times in seconds since the start of the span at `origin` (by default
+        this span)
+        """
+        origin = self.start if origin is None else origin
+        return {
+            "name": self.name,
+            "start": self.start - origin,
+            "duration": self.duration,
+            "attributes": self.attributes,
+            "children": [child.to_dict(origin) for child in self.children],
+        }
+
+
+# Span that new spans are added to as children. `None` when not profiling, in
+# which case spans are not recorded at all.
+_current_span: contextvars.ContextVar[Span | None] = contextvars.ContextVar(
+    "current_span", default=None
+)
+
+
+@contextlib.contextmanager
+def span(name: str, **attributes) -> Iterator[Span]:
+    """
+    Record the wall time of the enclosed block as a child of the current span
+    """
+    parent = _current_span.get()
+    current = Span(name, attributes=attributes)
+    if parent is None:
+        yield current
+        return
+    parent.children.append(current)
+    _current_span.set(current)
+    try:
+        yield current
+    finally:
+        current.duration = time.perf_counter() - current.start
+        # Not `reset`, which fails if a generator is closed in another context
+        _current_span.set(parent)
+
+
+def annotate(**attributes):
+    """
+    Add attributes (e.g. bytes transferred, item or token counts) to the
+    current span
+    """
+    if (current := _current_span.get()) is not None:
+        current.attributes.update(attributes)
+
+
+def traced(name: str) -> Callable:
+    """
+    Decorator recording each call of the decorated function as a span. For
+    functions returning a list, the number of items is recorded. Generator
+    functions are timed until they are exhausted, and the number of yielded
+    values and the time until the first one are recorded.
+    """
+
+    def decorator(fn):
+        if inspect.isgeneratorfunction(fn):
+
+            @functools.wraps(fn)
+            def generator_wrapper(*args, **kwargs):
+                parent = _current_span.get()
+                if parent is None:
+                    yield from fn(*args, **kwargs)
+                    return
+                current = Span(name)
+                parent.children.append(current)
+                generator = fn(*args, **kwargs)
+                chunks = 0
+                try:
+                    while True:
+                        # The span is only current while the generator runs,
+                        # so that spans of the caller between values aren't
+                        # recorded as its children
+                        _current_span.set(current)
+                        try:
+                            value = next(generator)
+                        except StopIteration:
+                            break
+                        finally:
+                            _current_span.set(parent)
+                        if chunks == 0:
+                            current.attributes["first_chunk_seconds"] = (
+                                time.perf_counter() - current.start
+                            )
+                        chunks += 1
+                        yield value
+                    current.attributes["chunks"] = chunks
+                finally:
+                    generator.close()
+                    current.duration = time.perf_counter() - current.start
+
+            return generator_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name) as current:
+                result = fn(*args, **kwargs)
+                if isinstance(result, list):
+                    current.attributes["items"] = len(result)
+                return result
+
+        return wrapper
+
+    return decorator
+
+
+def in_current_context(fn: Callable) -> Callable:
+    """
+    Wrap `fn` to run in a copy of the current context, so that spans
+    recorded in executor threads are added to the current span
+    """
+    context = contextvars.copy_context()
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        # A context can't be entered by several threads at once
+        return context.copy().run(fn, *args, **kwargs)
+
+    return wrapper
+
+
+@contextlib.contextmanager
+def profile(name: str = "work-daigest", trace_memory: bool = True) -> Iterator[Span]:
+    """
+    Record spans within the enclosed block under a root span named `name`
+
+    :param trace_memory: Whether to trace memory allocations to record the
+      peak memory use. This makes allocations noticeably slower.
+    """
+    start_tracing = trace_memory and not tracemalloc.is_tracing()
+    if start_tracing:
+        tracemalloc.start()
+    elif trace_memory:
+        tracemalloc.reset_peak()
+
+    root = Span(name)
+    token = _current_span.set(root)
+    try:
+        yield root
+    finally:
+        root.duration = time.perf_counter() - root.start
+        _current_span.reset(token)
+        if trace_memory:
+            root.attributes["peak_memory_bytes"] = tracemalloc.get_traced_memory()[1]
+        if start_tracing:
+            tracemalloc.stop()
+
+
+def format_json(root: Span) -> str:
+    return json.dumps(root.to_dict(), indent=2)
+
+
+def merge_siblings(spans: list[Span]) -> list[tuple[str, int, float, dict, list]]:
+    """
+    Merge spans of the same name, e.g. the pages of a GitHub search, adding up
+    their durations and numeric attributes
+
+    :return: Name, number of spans, total duration, attributes and children of
+      each group of spans, in order of first appearance.
+    """
+    groups = {}
+    for s in spans:
+        count, duration, attributes, children = groups.get(s.name, (0, 0.0, {}, []))
+        attributes = dict(attributes)
+        for key, value in s.attributes.items():
+            if isinstance(value, (int, float)) and key in attributes:
+                attributes[key] += value
+            else:
+                attributes[key] = value
+        groups[s.name] = (
+            count + 1,
+            duration + (s.duration or 0.0),
+            attributes,
+            children + s.children,
+        )
+    return [(name, *group) for name, group in groups.items()]
+
+
+def format_text(root: Span) -> str:
+    """
+    Render spans as an indented tree with bars proportional to their
+    durations. Sibling spans with the same name are shown as one line. Their
+    durations are added up and can thus exceed that of their parent if they
+    ran concurrently.
+    """
+    total = root.duration or 0.0
+    lines = []
+
+    def add(spans: list[Span], depth: int):
+        for name, count, duration, attributes, children in merge_siblings(spans):
+            label = "  " * depth + name + (f" x{count}" if count > 1 else "")
+            width = min(round(BAR_WIDTH * duration / total), BAR_WIDTH) if total else 0
+            details = " ".join(
+                f"{key}={value:.3f}" if isinstance(value, float) else f"{key}={value}"
+                for key, value in attributes.items()
+            )
+            lines.append(
+                f"{label:<40} {duration:8.3f}s {'#' * width:<{BAR_WIDTH}} {details}"
+            )
+            add(children, depth + 1)
+
+    add([root], 0)
+    return "\n".join(line.rstrip() for line in lines)
@@ -0,0 +1,36 @@
+import contextlib
+import contextvars
+from typing import Callable, Iterator
+
+# Function receiving the name and details of each stage reported in the
+# current context, or `None` when nobody is listening. Executor threads see
+# it too when their tasks are wrapped with `profiling.in_current_context`.
+ProgressReporter = Callable[[str, dict], None]
+
+_reporter: contextvars.ContextVar[ProgressReporter | None] = contextvars.ContextVar(
+    "progress_reporter", default=None
+)
+
+
+def report(stage: str, **details):
+    """
+    Report that a stage of the pipeline (e.g. parsing the calendar, or one
+    page of a GitHub search) completed
+
+    The reporter may raise an exception to abort the pipeline, e.g. when the
+    user cancelled it, so this is only called where stopping is safe.
+    """
+    if (reporter := _reporter.get()) is not None:
+        reporter(stage, details)
+
+
+@contextlib.contextmanager
+def reporting(reporter: ProgressReporter) -> Iterator[None]:
+    """
+    Send the stages reported within the enclosed block to `reporter`
+    """
+    token = _reporter.set(reporter)
+    try:
+        yield
+    finally:
+        _reporter.reset(token)
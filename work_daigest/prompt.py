@@ -0,0 +1,70 @@
+import datetime
+
+from .compaction import CompactedData, compact
+from .fetchers.github import GitHubComment
+from .fetchers.google_calendar import CalendarEvent
+from .profiling import annotate, traced
+
+PROMPT_TEMPLATE = """
+    Human:
+    Summarize the events in the calendar and my work on GitHub and tell me what I did during the covered period of time.
+    Please mention the covered period of time ({lower_date} - {upper_date}) in your answer.
+    If the event has a description, include a summary.
+    Include attendees names.
+    If the event is lunch, do not include it.
+    For GitHub issues / pull requests / commits, don't include the full text / description / commit message,
+    but summarize it if it is longer than two sentences.
+    Take numbers of meetings, hours and GitHub items from the facts, which cover all of my activity,
+    while the events and GitHub items below are a selection.
+
+    Facts:
+    ```
+    {facts}
+    ```
+
+    Calendar events:
+    ```
+    {calendar_data}
+    ```
+
+    These are GitHub issues, pull requests and commits I worked on, in a JSON format:
+    ```
+    {github_data}
+    ```
+
+    AI:
+    """
+
+
+def datetime_to_readable_date(dt: datetime.datetime) -> str:
+    return dt.strftime("%Y-%m-%d")
+
+
+@traced("build_prompt")
+def build_prompt(
+    calendar_data: list[CalendarEvent],
+    github_data: list[GitHubComment],
+    lower_date: datetime.datetime,
+    upper_date: datetime.datetime,
+    model_choice: str,
+    email: str | None = None,
+) -> tuple[str, CompactedData]:
+    """
+    Compact the calendar and GitHub data to fit the model's token budget and
+    fill them into the prompt template.
+
+    :param email: Email address of the person the data is about, which is
+      left out of the attendees in the facts.
+    :return: The prompt and the compacted data, which also tells how many
+      tokens the compaction saved.
+    """
+    compacted = compact(calendar_data, github_data, model_choice, email)
+    annotate(tokens_before=compacted.tokens_before, tokens_after=compacted.tokens_after)
+    prompt = PROMPT_TEMPLATE.format(
+        facts=compacted.facts,
+        calendar_data=compacted.calendar_data,
+        github_data=compacted.github_data,
+        lower_date=datetime_to_readable_date(lower_date),
+        upper_date=datetime_to_readable_date(upper_date),
+    )
+    return prompt, compacted
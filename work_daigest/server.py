@@ -0,0 +1,585 @@
+"""
+Long-lived digest server
+
+Every run of `work-daigest` pays for importing its dependencies, setting up
+Bedrock and GitHub clients and reading its caches from disk. The server pays
+for this once and then generates digests for any number of clients, keeping
+the clients' connection pools, recently parsed calendars and the caches warm.
+
+Digests are requested over a small JSON API, served over TCP or a Unix
+socket:
+
+- `POST /digests` queues a digest (see `DigestRequest` for the fields) and
+  returns its job. Requesting a digest that is already queued or being
+  generated returns the existing job instead of generating it twice.
+- `GET /digests/<id>` returns the status, progress and result of a job. With
+  `?wait=<seconds>`, the answer is delayed until the job finishes or the time
+  is up.
+- `DELETE /digests/<id>` cancels a job, once everybody who requested it did.
+- `GET /health` returns the numbers of queued, running and finished jobs.
+
+Jobs run on a bounded pool of workers. Each user (identified by email
+address) has their own queue, and workers take jobs from the users' queues in
+turn, so that somebody requesting many digests doesn't hold up everybody
+else.
+"""
+
+import argparse
+import base64
+import collections
+import datetime
+import functools
+import hashlib
+import io
+import json
+import logging
+import os
+import socket
+import socketserver
+import threading
+import uuid
+from dataclasses import asdict, dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable
+from urllib.parse import parse_qs, urlsplit
+
+from .bedrock import BEDROCK_REGIONS, get_client, get_runtime_client
+from .fetchers.calendar_cache import default_calendar_cache, set_calendar_cache
+from .fetchers.github import (
+    DEFAULT_GITHUB_BACKEND,
+    DEFAULT_MAX_WORKERS,
+    GITHUB_BACKENDS,
+    get_session,
+    set_github_backend,
+)
+from .hedging import HedgeConfig
+from .jobs import Job
+from .main import (
+    add_hedge_arguments,
+    check_hedge_arguments,
+    hedge_config,
+    munge_calendar_data,
+    process_data,
+)
+from .progress import report
+from .prompt import build_prompt
+from .summarize import DEFAULT_MAX_MODEL_WORKERS, as_naive_utc, summarize_map_reduce
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+# Default number of digests generated at the same time
+DEFAULT_WORKERS = 4
+# Default number of parsed calendars kept in memory, i.e. roughly the number
+# of people whose calendars are parsed again only after a restart
+DEFAULT_CALENDARS_IN_MEMORY = 64
+# Number of finished jobs whose results can still be retrieved
+MAX_FINISHED_JOBS = 1000
+# Longest time (in seconds) a status request waits for a job to finish
+MAX_WAIT = 60.0
+# Largest accepted request body, which mostly consists of the calendar
+MAX_REQUEST_BYTES = 256 * 1024 * 1024
+
+MODEL_CHOICES = ("jurassic2", "llama2", "claude3")
+CHUNK_BY_CHOICES = ("day", "week", "repository")
+
+
+@dataclass
+class DigestRequest:
+    github_handle: str
+    email: str
+    lower_date: datetime.datetime
+    upper_date: datetime.datetime
+    # Content of the calendar .ics file, base64-encoded in JSON bodies
+    calendar: bytes = field(repr=False)
+    model: str = "claude3"
+    # How to split the data for map-reduce summarization, or None to
+    # summarize it with a single prompt
+    map_reduce: str | None = None
+    max_model_workers: int = DEFAULT_MAX_MODEL_WORKERS
+    use_cache: bool = True
+
+    @classmethod
+    def from_json(cls, data: dict) -> "DigestRequest":
+        """
+        Validate the JSON body of a digest request, in which dates are given
+        in ISO 8601 format. Dates with a UTC offset are converted to naive UTC
+        dates, like the dates of the CLI.
+
+        :raises ValueError: If a field is missing or invalid.
+        """
+        if not isinstance(data, dict):
+            raise ValueError("Expected a JSON object")
+        try:
+            request = cls(
+                github_handle=str(data["github_handle"]),
+                email=str(data["email"]),
+                lower_date=as_naive_utc(
+                    datetime.datetime.fromisoformat(data["lower_date"])
+                ),
+                upper_date=as_naive_utc(
+                    datetime.datetime.fromisoformat(data["upper_date"])
+                ),
+                calendar=base64.b64decode(data["calendar"], validate=True),
+                model=data.get("model", "claude3"),
+                map_reduce=data.get("map_reduce"),
+                max_model_workers=int(
+                    data.get("max_model_workers", DEFAULT_MAX_MODEL_WORKERS)
+                ),
+                use_cache=bool(data.get("use_cache", True)),
+            )
+        except KeyError as e:
+            raise ValueError(f"Missing field {e}") from None
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"Invalid field: {e}") from None
+        if request.model not in MODEL_CHOICES:
+            raise ValueError(f"Invalid model {request.model!r}")
+        if request.map_reduce not in (None, *CHUNK_BY_CHOICES):
+            raise ValueError(f"Invalid map_reduce {request.map_reduce!r}")
+        if request.lower_date > request.upper_date:
+            raise ValueError("lower_date must not be after upper_date")
+        if request.max_model_workers < 1:
+            raise ValueError("max_model_workers must be positive")
+        return request
+
+    def key(self) -> str:
+        """
+        Identify requests for the same digest, which are coalesced
+        """
+        fields = asdict(self)
+        fields["calendar"] = hashlib.sha256(self.calendar).hexdigest()
+        data = json.dumps(fields, sort_keys=True, default=str)
+        return hashlib.sha256(data.encode()).hexdigest()
+
+
+def generate_digest(
+    request: DigestRequest,
+    runtime_client=None,
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    hedge: HedgeConfig | None = None,
+) -> dict:
+    """
+    Generate the digest for a request, reporting the progress of each stage.
+    Single prompt summaries are streamed unless hedged, and the text so far
+    is reported as the details of the "inference" stage.
+
+    :return: The summary, along with the numbers of calendar events and
+      GitHub items, and the numbers of tokens of the prompt data before and
+      after compaction (unless the data was summarized in chunks).
+    """
+    calendar = request.calendar
+    stream = request.map_reduce is None and hedge is None
+    model_fn, calendar_data, github_data = process_data(
+        io.BytesIO(calendar),
+        request.github_handle,
+        request.email,
+        request.lower_date,
+        request.upper_date,
+        request.model,
+        max_workers,
+        stream,
+        request.use_cache,
+        runtime_client,
+        hedge,
+    )
+    report("inference", model=request.model, text="")
+    tokens = None
+    if request.map_reduce:
+        summary = summarize_map_reduce(
+            model_fn,
+            lambda start, end: munge_calendar_data(
+                io.BytesIO(calendar), start, end, request.email
+            ),
+            github_data,
+            request.lower_date,
+            request.upper_date,
+            request.model,
+            request.map_reduce,
+            request.max_model_workers,
+            request.email,
+            request.use_cache,
+        )
+    else:
+        prompt, compacted = build_prompt(
+            calendar_data,
+            github_data,
+            request.lower_date,
+            request.upper_date,
+            request.model,
+            request.email,
+        )
+        tokens = [compacted.tokens_before, compacted.tokens_after]
+        if stream:
+            summary = ""
+            for text in model_fn(prompt=prompt):
+                summary += text
+                report("inference", model=request.model, text=summary)
+        else:
+            summary = model_fn(prompt=prompt)
+    return {
+        "summary": summary,
+        "calendar_events": len(calendar_data),
+        "github_items": len(github_data),
+        "tokens": tokens,
+    }
+
+
+@dataclass
+class DigestJob:
+    id: str
+    user: str
+    key: str
+    job: Job
+    # Number of clients that requested the digest and haven't cancelled it
+    subscribers: int = 1
+
+    def to_json(self) -> dict:
+        job = self.job
+        return {
+            "id": self.id,
+            "status": job.status,
+            "stages": {
+                stage: {"count": count, "details": details}
+                for stage, (count, details) in job.stages.items()
+            },
+            "result": job.result,
+            "error": f"{type(job.error).__name__}: {job.error}" if job.error else None,
+            "started_at": job.started_at,
+            "finished_at": job.finished_at,
+        }
+
+
+class DigestScheduler:
+    def __init__(
+        self, generate: Callable[[DigestRequest], dict], workers: int = DEFAULT_WORKERS
+    ):
+        """
+        Run `generate` for submitted requests on a pool of `workers` threads,
+        taking turns between users
+        """
+        self._generate = generate
+        self._condition = threading.Condition()
+        # Queued jobs of each user, and users with queued jobs in the order
+        # in which they get their next turn
+        self._queues: dict[str, collections.deque[DigestJob]] = {}
+        self._turns: collections.deque[str] = collections.deque()
+        # All jobs by id, in order of submission, and unfinished jobs by
+        # request key
+        self._jobs: collections.OrderedDict[str, DigestJob] = collections.OrderedDict()
+        self._pending: dict[str, DigestJob] = {}
+        self._running = 0
+        self._closed = False
+        self._threads = [
+            threading.Thread(target=self._work, daemon=True) for _ in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, request: DigestRequest) -> tuple[DigestJob, bool]:
+        """
+        Queue a job for `request`, unless the same digest is already queued or
+        being generated
+
+        :return: The job, and whether it was already there.
+        """
+        key = request.key()
+        with self._condition:
+            if (existing := self._pending.get(key)) is not None:
+                existing.subscribers += 1
+                return existing, True
+            user = request.email.lower()
+            job = DigestJob(uuid.uuid4().hex, user, key, Job(self._generate, request))
+            self._jobs[job.id] = job
+            self._pending[key] = job
+            if user not in self._queues:
+                self._queues[user] = collections.deque()
+                self._turns.append(user)
+            self._queues[user].append(job)
+            self._condition.notify()
+            return job, False
+
+    def get(self, job_id: str) -> DigestJob | None:
+        with self._condition:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> DigestJob | None:
+        """
+        Withdraw one request for a job, and cancel the job once nobody waits
+        for it anymore
+        """
+        with self._condition:
+            job = self._jobs.get(job_id)
+            if job is None or not job.job.running:
+                return job
+            job.subscribers -= 1
+            if job.subscribers > 0:
+                return job
+            # Later requests for the same digest get a new job
+            self._pending.pop(job.key, None)
+        job.job.cancel()
+        return job
+
+    def stats(self) -> dict:
+        with self._condition:
+            queued = {user: len(queue) for user, queue in self._queues.items()}
+            return {
+                "workers": len(self._threads),
+                "running": self._running,
+                "queued": sum(queued.values()),
+                "queued_by_user": queued,
+                "jobs": len(self._jobs),
+            }
+
+    def close(self):
+        """
+        Stop taking queued jobs. Running jobs are finished.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def _next_job(self) -> DigestJob | None:
+        """
+        Wait for a queued job and take it from the queue of the user whose
+        turn it is, or return None once the scheduler is closed
+        """
+        with self._condition:
+            while True:
+                if self._closed:
+                    return None
+                while self._turns:
+                    user = self._turns.popleft()
+                    queue = self._queues[user]
+                    job = queue.popleft()
+                    if queue:
+                        self._turns.append(user)
+                    else:
+                        del self._queues[user]
+                    # Jobs cancelled while queued are skipped
+                    if job.job.status == "queued":
+                        self._running += 1
+                        return job
+                self._condition.wait()
+
+    def _work(self):
+        while (job := self._next_job()) is not None:
+            try:
+                job.job.run()
+            finally:
+                with self._condition:
+                    self._running -= 1
+                    if self._pending.get(job.key) is job:
+                        del self._pending[job.key]
+                    self._forget_finished()
+
+    def _forget_finished(self):
+        # Must be called with `self._condition` held
+        finished = [id for id, job in self._jobs.items() if not job.job.running]
+        for id in finished[: max(len(finished) - MAX_FINISHED_JOBS, 0)]:
+            del self._jobs[id]
+
+
+class DigestRequestHandler(BaseHTTPRequestHandler):
+    server: "DigestHTTPServer | DigestUnixServer"
+    # Keep connections open, since clients poll for progress
+    protocol_version = "HTTP/1.1"
+
+    def address_string(self) -> str:
+        # Clients of Unix sockets have no address
+        return self.client_address[0] if self.client_address else "unix"
+
+    def log_message(self, format: str, *args):
+        logger.debug(f"{self.address_string()} {format % args}")
+
+    def send_json(self, status: int, body: dict):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_error_json(self, status: int, message: str):
+        self.send_json(status, {"error": message})
+
+    def job_id(self, path: str) -> str | None:
+        prefix, _, job_id = path.rpartition("/")
+        return job_id if prefix == "/digests" and job_id else None
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path == "/health":
+            return self.send_json(200, self.server.scheduler.stats())
+        if (job_id := self.job_id(url.path)) is None:
+            return self.send_error_json(404, "Not found")
+        if (job := self.server.scheduler.get(job_id)) is None:
+            return self.send_error_json(404, f"No job {job_id}")
+        try:
+            wait = float(parse_qs(url.query).get("wait", ["0"])[0])
+        except ValueError:
+            return self.send_error_json(400, "Invalid wait time")
+        if wait > 0:
+            job.job.wait(min(wait, MAX_WAIT))
+        self.send_json(200, job.to_json())
+
+    def do_POST(self):
+        if urlsplit(self.path).path != "/digests":
+            return self.send_error_json(404, "Not found")
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+        except ValueError:
+            length = -1
+        if length < 0:
+            self.close_connection = True
+            return self.send_error_json(400, "Invalid Content-Length")
+        if length > MAX_REQUEST_BYTES:
+            self.close_connection = True
+            return self.send_error_json(413, "Request too large")
+        try:
+            request = DigestRequest.from_json(json.loads(self.rfile.read(length)))
+        except ValueError as e:
+            return self.send_error_json(400, str(e))
+        job, coalesced = self.server.scheduler.submit(request)
+        logger.info(
+            f"{'Joined' if coalesced else 'Queued'} job {job.id} for {request.email}"
+        )
+        self.send_json(202, job.to_json())
+
+    def do_DELETE(self):
+        if (job_id := self.job_id(urlsplit(self.path).path)) is None:
+            return self.send_error_json(404, "Not found")
+        if (job := self.server.scheduler.cancel(job_id)) is None:
+            return self.send_error_json(404, f"No job {job_id}")
+        self.send_json(200, job.to_json())
+
+
+class DigestHTTPServer(ThreadingHTTPServer):
+    def __init__(self, address: tuple[str, int], scheduler: DigestScheduler):
+        super().__init__(address, DigestRequestHandler)
+        self.scheduler = scheduler
+
+
+class DigestUnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path: str, scheduler: DigestScheduler):
+        remove_stale_socket(path)
+        super().__init__(path, DigestRequestHandler)
+        self.scheduler = scheduler
+
+    def server_close(self):
+        super().server_close()
+        os.unlink(self.server_address)
+
+
+def remove_stale_socket(path: str):
+    """
+    Remove the socket file of a server that didn't shut down cleanly
+
+    :raises OSError: If another server is listening on the socket.
+    """
+    if not os.path.exists(path):
+        return
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+        try:
+            probe.connect(path)
+        except ConnectionRefusedError:
+            os.unlink(path)
+            return
+    raise OSError(f"Another server is listening on {path}")
+
+
+def warm_up(regions: list[str]):
+    """
+    Create the Bedrock and GitHub clients (and import their dependencies)
+    before the first job needs them
+    """
+    for region in regions:
+        get_client("bedrock-runtime", region)
+    get_session()
+
+
+def main():
+    """
+    Run the digest server until interrupted.
+    """
+    parser = argparse.ArgumentParser(
+        description="Serve summaries of work to thin clients"
+    )
+    parser.add_argument(
+        "--host",
+        type=str,
+        default=DEFAULT_HOST,
+        help=f"Address to listen on. Defaults to {DEFAULT_HOST}.",
+    )
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=DEFAULT_PORT,
+        help=f"Port to listen on. Defaults to {DEFAULT_PORT}.",
+    )
+    parser.add_argument(
+        "--socket",
+        type=str,
+        help="Path of a Unix socket to listen on instead of a TCP port",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=DEFAULT_WORKERS,
+        help=f"Maximum number of digests generated at the same time. Defaults to {DEFAULT_WORKERS}.",
+    )
+    parser.add_argument(
+        "--max-workers",
+        type=int,
+        default=DEFAULT_MAX_WORKERS,
+        help=f"Maximum number of concurrent GitHub API requests per digest. Defaults to {DEFAULT_MAX_WORKERS}.",
+    )
+    parser.add_argument(
+        "--calendars-in-memory",
+        type=int,
+        default=DEFAULT_CALENDARS_IN_MEMORY,
+        help=f"Number of parsed calendars kept in memory. Defaults to {DEFAULT_CALENDARS_IN_MEMORY}.",
+    )
+    parser.add_argument(
+        "--github-backend",
+        type=str,
+        choices=GITHUB_BACKENDS,
+        default=DEFAULT_GITHUB_BACKEND,
+        help="API to fetch GitHub data through. GraphQL needs fewer requests, but requires a token. Defaults to the GITHUB_BACKEND environment variable, or rest.",
+    )
+    add_hedge_arguments(parser)
+    args = parser.parse_args()
+    check_hedge_arguments(parser, args)
+    logging.basicConfig(level=logging.INFO)
+
+    set_github_backend(args.github_backend)
+    set_calendar_cache(default_calendar_cache(args.calendars_in_memory))
+    warm_up(BEDROCK_REGIONS)
+    scheduler = DigestScheduler(
+        functools.partial(
+            generate_digest,
+            runtime_client=get_runtime_client(),
+            max_workers=args.max_workers,
+            hedge=hedge_config(args),
+        ),
+        args.workers,
+    )
+    if args.socket:
+        server = DigestUnixServer(args.socket, scheduler)
+        logger.info(f"Listening on {args.socket}")
+    else:
+        server = DigestHTTPServer((args.host, args.port), scheduler)
+        logger.info(f"Listening on http://{args.host}:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        scheduler.close()
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,286 @@
+import bisect
+import collections
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Literal
+
+from .bedrock import request_fingerprint
+from .compaction import MODEL_TOKEN_BUDGETS, estimate_tokens
+from .digest_store import DigestStore, default_store
+from .fetchers.github import GitHubComment
+from .fetchers.google_calendar import CalendarEvent
+from .hedging import invoke_reporting_model
+from .profiling import annotate, in_current_context, traced
+from .progress import report
+from .prompt import build_prompt, datetime_to_readable_date
+
+ChunkBy = Literal["day", "week", "repository"]
+
+# Default number of concurrent model invocations
+DEFAULT_MAX_MODEL_WORKERS = 4
+
+REDUCE_PROMPT_TEMPLATE = """
+    Human:
+    Below are summaries of what I did during parts of the period {lower_date} - {upper_date}.
+    Combine them into a single summary of what I did during the whole period.
+    Please mention the covered period of time ({lower_date} - {upper_date}) in your answer.
+    Keep the names of people, repositories and projects, but don't repeat the same information twice.
+
+    Summaries:
+    ```
+    {summaries}
+    ```
+
+    AI:
+    """
+
+
+# Parts of a day shorter than this at the end of a date range are left out when
+# chunking by day or week, e.g. the microsecond past midnight that the CLI adds
+# to upper dates
+MIN_DAY_FRAGMENT = datetime.timedelta(seconds=1)
+
+
+def whole_days(
+    lower_date: datetime.datetime, upper_date: datetime.datetime
+) -> tuple[datetime.datetime, datetime.datetime]:
+    """
+    Widen a date range to whole days, from midnight to midnight, so that the
+    same days get the same chunks whichever time of day the range is given
+    with
+    """
+    start = lower_date.replace(hour=0, minute=0, second=0, microsecond=0)
+    end = upper_date.replace(hour=0, minute=0, second=0, microsecond=0)
+    if upper_date - end >= MIN_DAY_FRAGMENT or end <= start:
+        end += datetime.timedelta(days=1)
+    return start, end
+
+
+def split_by_day(
+    lower_date: datetime.datetime, upper_date: datetime.datetime
+) -> list[tuple[datetime.datetime, datetime.datetime]]:
+    """
+    Split a date range into consecutive ranges that each cover (part of) one
+    day
+    """
+    ranges = []
+    start = lower_date
+    while start < upper_date:
+        midnight = start.replace(hour=0, minute=0, second=0, microsecond=0)
+        end = min(midnight + datetime.timedelta(days=1), upper_date)
+        ranges.append((start, end))
+        start = end
+    return ranges
+
+
+def split_by_week(
+    lower_date: datetime.datetime, upper_date: datetime.datetime
+) -> list[tuple[datetime.datetime, datetime.datetime]]:
+    """
+    Split a date range into consecutive ranges that each cover (part of) one
+    week, starting on Mondays
+    """
+    ranges = []
+    start = lower_date
+    while start < upper_date:
+        monday = (start - datetime.timedelta(days=start.weekday())).replace(
+            hour=0, minute=0, second=0, microsecond=0
+        )
+        end = min(monday + datetime.timedelta(weeks=1), upper_date)
+        ranges.append((start, end))
+        start = end
+    return ranges
+
+
+def as_naive_utc(dt: datetime.datetime) -> datetime.datetime:
+    if dt.tzinfo is None:
+        return dt
+    return dt.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+
+
+def make_chunks(
+    calendar_fn: Callable[[datetime.datetime, datetime.datetime], list[CalendarEvent]],
+    github_data: list[GitHubComment],
+    lower_date: datetime.datetime,
+    upper_date: datetime.datetime,
+    chunk_by: ChunkBy,
+) -> list[
+    tuple[
+        datetime.datetime, datetime.datetime, list[CalendarEvent], list[GitHubComment]
+    ]
+]:
+    """
+    Split calendar and GitHub data into chunks that are summarized separately
+
+    :param calendar_fn: Function returning the calendar events within a date
+      range.
+    :return: Date range, calendar events and GitHub items of each chunk.
+    """
+    if chunk_by in ("day", "week"):
+        split = split_by_day if chunk_by == "day" else split_by_week
+        ranges = split(*whole_days(lower_date, upper_date))
+        starts = [start for start, _ in ranges]
+        by_range = [[] for _ in ranges]
+        for comment in github_data:
+            # Items dated outside the date range (e.g. issues created within
+            # it but closed after it) go to the first or last chunk, so that
+            # no chunk misses what a single prompt would contain
+            i = bisect.bisect_right(starts, as_naive_utc(comment.date)) - 1
+            by_range[min(max(i, 0), len(ranges) - 1)].append(comment)
+        chunks = [
+            (start, end, calendar_fn(start, end), comments)
+            for (start, end), comments in zip(ranges, by_range)
+        ]
+    elif chunk_by == "repository":
+        # Calendar events don't belong to a repository, so they make up a
+        # chunk of their own
+        chunks = [(lower_date, upper_date, calendar_fn(lower_date, upper_date), [])]
+        by_repository = collections.defaultdict(list)
+        for comment in github_data:
+            by_repository[comment.repository].append(comment)
+        for comments in by_repository.values():
+            chunks.append((lower_date, upper_date, [], comments))
+    else:
+        raise ValueError(f"Invalid chunking: {chunk_by}")
+    return [chunk for chunk in chunks if chunk[2] or chunk[3]]
+
+
+digest_store: DigestStore | None = default_store()
+
+
+def set_digest_store(store: DigestStore | None) -> None:
+    """
+    Replace the store of summaries of days and weeks. Pass `None` to always
+    summarize every chunk.
+    """
+    global digest_store
+    digest_store = store
+
+
+def period_key(start: datetime.datetime, end: datetime.datetime) -> str:
+    """
+    Key of the whole days from `start` to `end` (excluded) in the digest store
+    """
+    return f"{start:%Y-%m-%d}..{end:%Y-%m-%d}"
+
+
+def reduce_summaries(
+    model_fn: Callable[..., str],
+    summaries: list[str],
+    lower_date: datetime.datetime,
+    upper_date: datetime.datetime,
+    model_choice: str,
+    executor: ThreadPoolExecutor,
+) -> str:
+    """
+    Combine partial summaries into one. If they don't fit into one prompt,
+    they are combined in groups first, and so on.
+    """
+    budget = MODEL_TOKEN_BUDGETS[model_choice]
+    while len(summaries) > 1:
+        # Groups hold at least two summaries so that every round makes progress
+        groups = [[]]
+        group_tokens = 0
+        for summary in summaries:
+            tokens = estimate_tokens(summary)
+            if len(groups[-1]) >= 2 and group_tokens + tokens > budget:
+                groups.append([])
+                group_tokens = 0
+            groups[-1].append(summary)
+            group_tokens += tokens
+        prompts = [
+            REDUCE_PROMPT_TEMPLATE.format(
+                summaries="\n\n".join(group),
+                lower_date=datetime_to_readable_date(lower_date),
+                upper_date=datetime_to_readable_date(upper_date),
+            )
+            for group in groups
+        ]
+        summaries = list(
+            executor.map(in_current_context(lambda p: model_fn(prompt=p)), prompts)
+        )
+    return summaries[0]
+
+
+@traced("summarize_map_reduce")
+def summarize_map_reduce(
+    model_fn: Callable[..., str],
+    calendar_fn: Callable[[datetime.datetime, datetime.datetime], list[CalendarEvent]],
+    github_data: list[GitHubComment],
+    lower_date: datetime.datetime,
+    upper_date: datetime.datetime,
+    model_choice: str,
+    chunk_by: ChunkBy = "week",
+    max_workers: int = DEFAULT_MAX_MODEL_WORKERS,
+    email: str | None = None,
+    use_cache: bool = True,
+) -> str:
+    """
+    Summarize long date ranges by summarizing chunks of the data (by day, by
+    week or by repository) concurrently, then combining the partial summaries.
+
+    Summaries of days and weeks are kept in the digest store, so that later
+    summaries of overlapping date ranges only need to summarize the days or
+    weeks that are new or whose data changed.
+
+    :param model_fn: Function invoking the model, as returned by `process_data`.
+    :param calendar_fn: Function returning the calendar events within a date
+      range.
+    :param max_workers: Maximum number of concurrent model invocations.
+    :param email: Email address of the person the data is about.
+    :param use_cache: Whether summaries of days and weeks may be taken from
+      the digest store.
+    :return: Summary of the whole date range.
+    """
+    chunks = make_chunks(calendar_fn, github_data, lower_date, upper_date, chunk_by)
+    by_period = chunk_by in ("day", "week")
+    if not chunks:
+        bounds = (
+            whole_days(lower_date, upper_date)
+            if by_period
+            else (lower_date, upper_date)
+        )
+        chunks = [(*bounds, [], [])]
+    store = digest_store if by_period else None
+
+    def summarize_chunk(chunk) -> tuple[str, bool]:
+        """
+        :return: The summary, and whether it was taken from the store.
+        """
+        start, end, calendar_data, comments = chunk
+        # Chunks of days and weeks end at midnight, which isn't part of them
+        last = end - datetime.timedelta(microseconds=1) if by_period else end
+        prompt, _ = build_prompt(
+            calendar_data, comments, start, last, model_choice, email
+        )
+        if store is None:
+            summary = model_fn(prompt=prompt)
+            from_store = False
+        else:
+            key = (email or "", model_choice, period_key(start, end))
+            fingerprint = request_fingerprint(model_choice, prompt)
+            summary = store.get(*key, fingerprint) if use_cache else None
+            from_store = summary is not None
+            if not from_store:
+                # A hedged invocation may be answered by the backup model, in
+                # which case the summary is stored as that model's
+                summary, model = invoke_reporting_model(
+                    model_fn, model_choice, prompt=prompt
+                )
+                key = (email or "", model, period_key(start, end))
+                store.put(*key, request_fingerprint(model, prompt), summary)
+        report("inference.partial", chunks=len(chunks))
+        return summary, from_store
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(in_current_context(summarize_chunk), chunks))
+        summaries = [summary for summary, _ in results]
+        annotate(
+            chunks=len(chunks),
+            stored_chunks=sum(from_store for _, from_store in results),
+        )
+        if len(summaries) == 1:
+            return summaries[0]
+        return reduce_summaries(
+            model_fn, summaries, lower_date, upper_date, model_choice, executor
+        )
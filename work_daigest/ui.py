@@ -1,14 +1,234 @@
+import contextlib
 import datetime
+import functools
+import io
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 
 import streamlit as st
 
-from work_daigest.main import PROMPT_TEMPLATE, datetime_to_readable_date, process_data
+from work_daigest.bedrock import get_runtime_client
+from work_daigest.client import (
+    DEFAULT_SERVER,
+    REQUEST_ERRORS,
+    DigestClient,
+    RemoteJob,
+    digest_request,
+)
+from work_daigest.fetchers.github import GitHubComment, fetch_comments
+from work_daigest.fetchers.google_calendar import CalendarEvent
+from work_daigest.jobs import Job, start_job
+from work_daigest.main import get_model_function, munge_calendar_data
+from work_daigest.profiling import Span, format_text, in_current_context, profile
+from work_daigest.progress import report
+from work_daigest.prompt import build_prompt
+from work_daigest.summarize import DEFAULT_MAX_MODEL_WORKERS, summarize_map_reduce
+
+# Time (in seconds) between refreshes of the page while a summary is being
+# generated
+POLL_INTERVAL = 0.5
+# GitHub activity keeps changing, so fetched data is only reused for this
+# long (in seconds)
+GITHUB_DATA_TTL = 10 * 60
+# Number of calendar and GitHub fetch results kept in memory for all sessions
+MAX_CACHED_RESULTS = 64
+
+
+@dataclass
+class Digest:
+    label: str
+    summary: str
+    calendar_events: int
+    github_items: int
+    # Tokens of the prompt data before and after compaction, unless the data
+    # was summarized in chunks
+    tokens: tuple[int, int] | None
+    profile: Span | None
+
+
+# The caches below are shared by all sessions, so that people using the same
+# Streamlit server don't redo each other's work, and so that reruns (which
+# happen on every widget change) reuse previous results.
+@st.cache_resource
+def runtime_client():
+    return get_runtime_client()
+
+
+@st.cache_data(show_spinner=False, max_entries=MAX_CACHED_RESULTS)
+def load_calendar(
+    calendar_bytes: bytes,
+    lower_date: datetime.datetime,
+    upper_date: datetime.datetime,
+    email: str,
+) -> list[CalendarEvent]:
+    return munge_calendar_data(
+        io.BytesIO(calendar_bytes), lower_date, upper_date, email
+    )
+
+
+@st.cache_data(show_spinner=False, ttl=GITHUB_DATA_TTL, max_entries=MAX_CACHED_RESULTS)
+def load_github(
+    github_handle: str, lower_date: datetime.datetime, upper_date: datetime.datetime
+) -> list[GitHubComment]:
+    return fetch_comments(github_handle, lower_date, upper_date)
+
+
+def generate_digest(
+    label: str,
+    calendar_bytes: bytes,
+    github_handle: str,
+    email: str,
+    lower_date: datetime.datetime,
+    upper_date: datetime.datetime,
+    model_choice: str,
+    chunk_by: str | None,
+    max_model_workers: int,
+    use_cache: bool,
+    show_profile: bool,
+) -> Digest:
+    """
+    Generate a summary in a background job, reporting the progress of each
+    stage. Streamed text is reported as the details of the "inference" stage.
+    """
+    profiling = profile() if show_profile else contextlib.nullcontext()
+    with profiling as root:
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            calendar_future = executor.submit(
+                in_current_context(load_calendar),
+                calendar_bytes,
+                lower_date,
+                upper_date,
+                email,
+            )
+            github_future = executor.submit(
+                in_current_context(load_github), github_handle, lower_date, upper_date
+            )
+            calendar_data = calendar_future.result()
+            report("calendar", events=len(calendar_data))
+            github_data = github_future.result()
+            report("github", items=len(github_data))
+
+        # Partial summaries are needed as a whole, so only stream single
+        # prompt summaries
+        model_fn = get_model_function(
+            model_choice,
+            stream=chunk_by is None,
+            use_cache=use_cache,
+            runtime_client=runtime_client(),
+        )
+        report("inference", model=model_choice, text="")
+        tokens = None
+        if chunk_by:
+            summary = summarize_map_reduce(
+                model_fn,
+                functools.partial(load_calendar, calendar_bytes, email=email),
+                github_data,
+                lower_date,
+                upper_date,
+                model_choice,
+                chunk_by,
+                max_model_workers,
+                email,
+                use_cache,
+            )
+        else:
+            prompt, compacted = build_prompt(
+                calendar_data,
+                github_data,
+                lower_date,
+                upper_date,
+                model_choice,
+                email,
+            )
+            tokens = (compacted.tokens_before, compacted.tokens_after)
+            summary = ""
+            for text in model_fn(prompt=prompt):
+                summary += text
+                report("inference", model=model_choice, text=summary)
+    return Digest(label, summary, len(calendar_data), len(github_data), tokens, root)
+
+
+def remote_digest(label: str, result: dict) -> Digest:
+    """
+    Convert the result of a digest generated by a digest server
+    """
+    tokens = tuple(result["tokens"]) if result["tokens"] is not None else None
+    return Digest(
+        label,
+        result["summary"],
+        result["calendar_events"],
+        result["github_items"],
+        tokens,
+        None,
+    )
+
+
+def submit_digest(label: str, request: dict) -> RemoteJob:
+    """
+    Have the digest server generate a summary
+    """
+    client = DigestClient(DEFAULT_SERVER)
+    return RemoteJob(
+        client, client.submit(request), functools.partial(remote_digest, label)
+    )
+
+
+def show_progress(job: Job | RemoteJob):
+    stages = job.stages
+    with st.status("Generating summary...", expanded=True):
+        if "calendar" in stages:
+            st.write(
+                f"✅ Parsed the calendar: {stages['calendar'][1]['events']} event(s)"
+            )
+        else:
+            st.write("Parsing the calendar...")
+        pages = stages.get("github.page", (0, {}))[0]
+        if "github" in stages:
+            st.write(
+                f"✅ Fetched {stages['github'][1]['items']} GitHub event(s) in {pages} request(s)"
+            )
+        else:
+            st.write(f"Fetching GitHub data: {pages} request(s) so far...")
+        if "inference" in stages:
+            st.write(
+                f"Generating the summary with {stages['inference'][1]['model']}..."
+            )
+            if "inference.partial" in stages:
+                done, details = stages["inference.partial"]
+                st.progress(
+                    min(done / details["chunks"], 1.0),
+                    text=f"{done} of {details['chunks']} partial summaries",
+                )
+    if stages.get("inference", (0, {}))[1].get("text"):
+        st.markdown(stages["inference"][1]["text"])
+
+
+def show_digest(digest: Digest):
+    st.info(
+        f"Got {digest.calendar_events} calendar event(s) and {digest.github_items} GitHub event(s)."
+    )
+    if digest.tokens is not None:
+        st.info(
+            f"Compacted prompt data from ~{digest.tokens[0]} to ~{digest.tokens[1]} tokens."
+        )
+    st.markdown(digest.summary)
+    if digest.profile is not None:
+        with st.expander("Profile"):
+            st.code(format_text(digest.profile))
+            st.json(digest.profile.to_dict(), expanded=False)
+
 
 # Title and description
 st.set_page_config(layout="wide")
 st.title("Work-dAIgest 📰")
 st.subheader("Generate a summary of your work with AI")
 
+# Finished summaries stay in the session (newest first), so that they survive
+# reruns
+st.session_state.setdefault("job", None)
+st.session_state.setdefault("digests", [])
+
 # Sidebar for input
 with st.sidebar:
     st.header("Configuration")
@@ -31,26 +251,119 @@ with st.sidebar:
     model_choice = st.selectbox(
         "Choose a model", model_options, help="Make sure you enable the model in AWS"
     )
+    summarization_options = {
+        "Single prompt": None,
+        "By day": "day",
+        "By week": "week",
+        "By repository": "repository",
+    }
+    summarization = st.selectbox(
+        "Summarization mode",
+        summarization_options,
+        help="For long periods of time, summarize the data in chunks and combine the partial summaries. Summaries of days and weeks are reused by later summaries as long as their data doesn't change.",
+    )
+    max_model_workers = st.number_input(
+        "Concurrent model invocations",
+        min_value=1,
+        value=DEFAULT_MAX_MODEL_WORKERS,
+        disabled=summarization_options[summarization] is None,
+    )
+    use_cache = st.checkbox(
+        "Reuse cached summaries",
+        value=True,
+        help="Uncheck to generate a new summary even if the same data was summarized before",
+    )
+    show_profile = st.checkbox(
+        "Show profile",
+        help="Show the time spent in each stage, along with bytes transferred, item and token counts and peak memory use. Not available when summaries are generated by a digest server.",
+        disabled=bool(DEFAULT_SERVER),
+    )
+
+job: Job | RemoteJob | None = st.session_state.job
+try:
+    running = job is not None and job.running
+except REQUEST_ERRORS as e:
+    st.error(f"Lost track of the summary on the digest server: {e}")
+    st.session_state.job = job = None
+    running = False
 
 # Button to trigger summary generation
 # add magic light emoji
-if st.button("Generate Summary 🪄"):
+if st.button("Generate Summary 🪄", disabled=running):
     if not all([email, github_handle, calendar_data]):
         st.error("Please fill out all required fields.")
     else:
-        model_fn, calendar_data, github_data = process_data(
-            calendar_data, github_handle, email, lower_date, upper_date, model_choice
-        )
-        st.info(
-            f"Got {len(calendar_data)} calendar event(s) and {len(github_data)} GitHub event(s)."
+        label = (
+            f"{email}, {lower_date:%Y-%m-%d} to {upper_date:%Y-%m-%d}, {model_choice}"
         )
-        st.success(f"Generating summary for {email} using {model_choice}...")
-        summary = model_fn(
-            prompt=PROMPT_TEMPLATE.format(
-                calendar_data="\n".join(calendar_data),
-                github_data=github_data,
-                lower_date=datetime_to_readable_date(lower_date),
-                upper_date=datetime_to_readable_date(upper_date),
+        # The summary is generated in the background (or by the digest
+        # server, if there is one), so that the page stays responsive and
+        # changing widgets doesn't interrupt it
+        if DEFAULT_SERVER:
+            try:
+                job = submit_digest(
+                    label,
+                    digest_request(
+                        calendar_data.getvalue(),
+                        github_handle,
+                        email,
+                        lower_date,
+                        upper_date,
+                        model_choice,
+                        summarization_options[summarization],
+                        max_model_workers,
+                        use_cache,
+                    ),
+                )
+            except REQUEST_ERRORS as e:
+                st.error(f"Couldn't submit the summary to the digest server: {e}")
+                job = None
+        else:
+            job = start_job(
+                generate_digest,
+                label,
+                calendar_data.getvalue(),
+                github_handle,
+                email,
+                lower_date,
+                upper_date,
+                model_choice,
+                summarization_options[summarization],
+                max_model_workers,
+                use_cache,
+                show_profile,
             )
-        )
-        st.write(summary)
+        st.session_state.job = job
+        running = job is not None
+        if running:
+            st.success(f"Generating summary for {email} using {model_choice}...")
+
+if running:
+    try:
+        if st.button("Cancel"):
+            job.cancel()
+        show_progress(job)
+    except REQUEST_ERRORS as e:
+        st.error(f"Lost track of the summary on the digest server: {e}")
+        st.session_state.job = None
+    else:
+        time.sleep(POLL_INTERVAL)
+        st.rerun()
+
+if job is not None and not running:
+    # Keep the result of each job once
+    st.session_state.job = None
+    if job.status == "done":
+        st.session_state.digests.insert(0, job.result)
+    elif job.status == "failed":
+        st.error(f"Couldn't generate the summary: {job.error}")
+    else:
+        st.warning("Cancelled.")
+
+digests: list[Digest] = st.session_state.digests
+if digests:
+    st.caption(digests[0].label)
+    show_digest(digests[0])
+for digest in digests[1:]:
+    with st.expander(digest.label):
+        show_digest(digest)